@@ -0,0 +1,123 @@
+# api_local.py
+# Servidor HTTP local no lugar da API da Polus, para testar envio, spool e
+# drain sem rede.
+#
+#   POST /api/meter/save-tests/rcd-cr         {"test": {...}, "batch_number": "..."}
+#   POST /api/meter/save-tests/rcd-cr/batch   {"items": [{"test", "batch_number"}, ...]} (aceita gzip)
+#   HEAD /                                     (pre-aquecimento da conexao)
+#
+# Cada resultado aceito recebe um auvoLink falso por MAC. --fail-rate faz uma
+# fracao das requisicoes responder 503 e --latency simula servidor lento.
+#
+# Uso:
+#   python api_local.py [--port 8080] [--latency 0.2] [--fail-rate 0.1]
+#   python teste.py --api-url http://127.0.0.1:8080
+#   python envio.py drain --batch --api-url http://127.0.0.1:8080
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAVE_TESTS_PATH = "/api/meter/save-tests/rcd-cr"
+BATCH_PATH = SAVE_TESTS_PATH + "/batch"
+AUVO_LINK_BASE = "https://app.auvo.com.br/local/"
+
+
+class LocalApi:
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.results: dict[tuple[str, str], dict] = {}
+        self.requests = 0
+        self.received_bytes = 0
+        self._lock = threading.Lock()
+
+    def save(self, test: dict, batch_number: str) -> dict:
+        mac = test.get("mac_address")
+        if not mac:
+            return {"batch_number": batch_number, "error": "mac_address ausente"}
+        with self._lock:
+            self.results[(mac.upper(), batch_number)] = test
+        return {
+            "mac_address": mac,
+            "batch_number": batch_number,
+            "auvoLink": AUVO_LINK_BASE + mac.replace(":", "").upper(),
+        }
+
+
+def make_handler(api: LocalApi):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with api._lock:
+                api.requests += 1
+                api.received_bytes += len(body)
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            if api.latency:
+                time.sleep(api.latency)
+            if random.random() < api.fail_rate:
+                return self._reply(503, {"error": "indisponivel (simulado)"})
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return self._reply(400, {"error": "JSON invalido"})
+            if self.path == SAVE_TESTS_PATH:
+                result = api.save(data.get("test") or {}, data.get("batch_number", ""))
+                return self._reply(400 if "error" in result else 200, result)
+            if self.path == BATCH_PATH:
+                results = [api.save(item.get("test") or {}, item.get("batch_number", "")) for item in data.get("items", [])]
+                return self._reply(200, {"results": results})
+            self._reply(404, {"error": "nao encontrado"})
+
+        def _reply(self, status: int, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080, latency: float = 0.0, fail_rate: float = 0.0):
+    api = LocalApi(latency, fail_rate)
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.api = api
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API local no lugar da Polus (testes offline).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="atraso (s) por requisicao")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fracao de respostas 503 (0 a 1)")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.fail_rate)
+    print(f"API local em http://{args.host}:{server.server_port} (Ctrl+C para sair)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api = server.api
+        print(f"{api.requests} requisicoes, {len(api.results)} resultados, {api.received_bytes} bytes recebidos")
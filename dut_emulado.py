@@ -0,0 +1,1136 @@
+# dut_emulado.py
+# ESP32 emulado (ROM + stub do esptool) para rodar e medir a gravacao sem hardware.
+#
+# Fala o protocolo SLIP do esptool.loader.ESPLoader o suficiente para o ciclo
+# do teste.py: sync, read/write_reg, mem_begin/data/end (upload do stub e o
+# "OHAI"), SPI attach/set params, change_baud, flash begin/data/end e as
+# variantes deflate, MD5, erase_flash/erase_region e read_flash. A flash de
+# 8 MB fica em memoria e sobrevive entre conexoes (mesmo DUT), a nao ser com
+# --fresh (cada conexao e um DUT novo, apagado).
+#
+# O transporte e RFC 2217 (rfc2217:// do pyserial): ao contrario do
+# socket://, ele leva DTR/RTS e o baud, entao os resets do esptool (bootloader
+# e hard reset para o app) e a troca de baud chegam ao DUT como na serial
+# real. Baud diferente entre host e DUT perde os bytes, como no fio.
+#
+# O tempo e modelado: cada byte custa 10 bits no baud atual, cada resposta
+# tem a latencia do conversor USB e erase/escrita/MD5 tem taxas da flash
+# SPI. O stub confirma um bloco ao recebe-lo e grava enquanto recebe o
+# proximo. --time-scale 0 tira todas as esperas (regressao rapida);
+# --max-baud faz leituras acima desse baud chegarem corrompidas (testa a
+# escada de baud).
+#
+# Depois do reset para o app roda o firmware FVT simulado (FvtFirmware): log
+# de boot e dos testes e o JSON de resultado, com tempo, reprovacoes, lixo
+# na UART e JSON aninhado configuraveis, ou o replay de capturas reais. O
+# comando station roda o ciclo inteiro do teste.py (um processo por porta,
+# como o estacao.py) contra esses DUTs, a API local e o backend de etiqueta
+# nulo, para achar gargalos de software com centenas de unidades por minuto.
+#
+# Uso:
+#   python dut_emulado.py serve [--port 4000] [--fresh] [--max-baud 921600] [--fvt-time 20]
+#   python teste.py --port rfc2217://127.0.0.1:4000 --api-url http://127.0.0.1:8080 --label-backend nulo
+#   python dut_emulado.py bench [--baud 921600 | --ladder] [--diff] [--full-erase] [--time-scale 0]
+#   python dut_emulado.py station --duts 4 --units 200 --time-scale 0 [--fail-rate 0.05] [--garbage-rate 0.1]
+#       [--nested] [--replay capturas/*.bin] [--api-latency 0.2] [<opcoes do teste.py>]
+
+from __future__ import annotations
+
+import errno
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import esptool.loader as esptool_loader
+import serial
+from serial import rfc2217
+from serial.serialutil import PortNotOpenError, SerialBase, SerialException, to_bytes
+
+ROM_BAUD = 115200
+FLASH_SIZE = 8 * 1024 * 1024
+SECTOR_SIZE = 0x1000
+# Valor lido em CHIP_DETECT_MAGIC_REG_ADDR por um ESP32
+ESP32_MAGIC = 0x00F01D83
+CHIP_DETECT_MAGIC_REG_ADDR = 0x40001000
+# eFuse do ESP32: MAC base em EFUSE_BLK0_RDATA1 (4 bytes baixos) e RDATA2 (2 bytes altos + CRC)
+EFUSE_MAC_LOW_REG = 0x3FF5A004
+EFUSE_MAC_HIGH_REG = 0x3FF5A008
+# val das respostas de sync da ROM (o stub responde 0)
+ROM_SYNC_VALUE = 0x20120707
+
+# Taxas aproximadas de uma flash SPI de 8 MB no ESP32 (bytes/s)
+ERASE_RATE = 300_000
+WRITE_RATE = 350_000
+MD5_RATE = 8_000_000
+# Latencia por resposta do conversor USB-serial (CP210x ~1 ms)
+USB_LATENCY = 0.001
+
+# Comandos do esptool.loader.ESPLoader
+FLASH_BEGIN = 0x02
+FLASH_DATA = 0x03
+FLASH_END = 0x04
+MEM_BEGIN = 0x05
+MEM_END = 0x06
+MEM_DATA = 0x07
+SYNC = 0x08
+WRITE_REG = 0x09
+READ_REG = 0x0A
+SPI_SET_PARAMS = 0x0B
+SPI_ATTACH = 0x0D
+CHANGE_BAUDRATE = 0x0F
+FLASH_DEFL_BEGIN = 0x10
+FLASH_DEFL_DATA = 0x11
+FLASH_DEFL_END = 0x12
+SPI_FLASH_MD5 = 0x13
+ERASE_FLASH = 0xD0
+ERASE_REGION = 0xD1
+READ_FLASH = 0xD2
+RUN_USER_CODE = 0xD3
+
+STUB_ONLY = {ERASE_FLASH, ERASE_REGION, READ_FLASH, RUN_USER_CODE}
+# Codigos de erro (segundo byte de status) usados pela ROM/stub
+ERR_INVALID_COMMAND = 0x05
+ERR_BAD_DATA_CHECKSUM = 0x07
+ERR_BAD_DATA_LEN = 0x06
+ERR_INFLATE = 0xC9
+
+# ClassicReset do esptool (DTR/RTS em sequencia) no formato do custom_reset_sequence
+CLASSIC_RESET_SEQUENCE = "D0|R1|W0.1|D1|R0|W0.05|D0"
+
+BANNER_RESET = b"ets Jun  8 2016 00:22:57\r\n\r\nrst:0x1 (POWERON_RESET),"
+BANNER_DOWNLOAD = BANNER_RESET + b"boot:0x3 (DOWNLOAD_BOOT(UART0/UART1/SDIO_REI_REO_V2))\r\nwaiting for download\r\n"
+BANNER_APP = BANNER_RESET + (
+    b"boot:0x13 (SPI_FAST_FLASH_BOOT)\r\n"
+    b"configsip: 0, SPIWP:0xee\r\n"
+    b"clk_drv:0x00,q_drv:0x00,d_drv:0x00,cs0_drv:0x00,hd_drv:0x00,wp_drv:0x00\r\n"
+    b"mode:DIO, clock div:2\r\n"
+    b"entry 0x40080604\r\n"
+)
+
+
+def slip_encode(packet: bytes) -> bytes:
+    return b"\xc0" + packet.replace(b"\xdb", b"\xdb\xdd").replace(b"\xc0", b"\xdb\xdc") + b"\xc0"
+
+
+class SlipDecoder:
+    """Separa os pacotes SLIP de um fluxo de bytes (pode vir picado)."""
+
+    def __init__(self):
+        self._packet = None
+        self._escaped = False
+
+    def reset(self):
+        self._packet = None
+        self._escaped = False
+
+    def feed(self, data: bytes) -> list[bytes]:
+        packets = []
+        for b in data:
+            if self._packet is None:
+                if b == 0xC0:
+                    self._packet = bytearray()
+                continue  # lixo fora de pacote (ex.: log do boot)
+            if self._escaped:
+                self._escaped = False
+                if b == 0xDC:
+                    self._packet.append(0xC0)
+                elif b == 0xDD:
+                    self._packet.append(0xDB)
+                else:
+                    self._packet = None  # escape invalido: descarta o pacote
+                continue
+            if b == 0xDB:
+                self._escaped = True
+            elif b == 0xC0:
+                if self._packet:
+                    packets.append(bytes(self._packet))
+                    self._packet = None
+                # 0xC0 0xC0: o segundo delimitador abre um pacote novo
+                else:
+                    self._packet = bytearray()
+            else:
+                self._packet.append(b)
+        return packets
+
+
+class FakeEsp32:
+    """ESP32 com flash em memoria falando o protocolo da ROM e do stub do esptool.
+
+    ``feed`` recebe os bytes do host; a saida vai para o callable registrado
+    com ``attach``. ``app`` (opcional) roda em uma thread quando o DUT
+    reinicia no firmware gravado: recebe o DUT e um Event que e ligado no
+    proximo reset; escreve na UART com ``emit``.
+    """
+
+    def __init__(
+        self,
+        flash_size: int = FLASH_SIZE,
+        time_scale: float = 1.0,
+        erase_rate: float = ERASE_RATE,
+        write_rate: float = WRITE_RATE,
+        md5_rate: float = MD5_RATE,
+        latency: float = USB_LATENCY,
+        max_baud: int | None = None,
+        app=None,
+        mac: str | None = None,
+        retest_rate: float = 0.0,
+    ):
+        self.flash = bytearray(b"\xff") * flash_size
+        self.mac = mac or random_mac()
+        self.time_scale = time_scale
+        self.erase_rate = erase_rate
+        self.write_rate = write_rate
+        self.md5_rate = md5_rate
+        self.latency = latency
+        self.max_baud = max_baud
+        self.app = app
+        self.retest_rate = retest_rate
+        self.mode = "app"  # "reset", "rom", "stub" ou "app"
+        self.device_baud = ROM_BAUD
+        self.host_baud = ROM_BAUD
+        self.dtr = False
+        self.rts = False
+        self.stats = {"bytes_in": 0, "bytes_out": 0, "commands": 0, "resets": 0, "flash_written": 0}
+        self._decoder = SlipDecoder()
+        self._output = None
+        self._lock = threading.RLock()
+        self._busy_until = 0.0  # fim da escrita em andamento na flash (modelo do stub)
+        self._write = None  # estado do flash_begin/defl_begin em andamento
+        self._regs: dict[int, int] = {CHIP_DETECT_MAGIC_REG_ADDR: ESP32_MAGIC}
+        self._app_stop = threading.Event()
+        self._app_thread = None
+
+    # ---- ligacao com o transporte -------------------------------------------
+
+    def attach(self, output):
+        with self._lock:
+            self._output = output
+
+    def detach(self):
+        with self._lock:
+            self._output = None
+        self._stop_app()
+
+    def set_host_baud(self, baud: int):
+        self.host_baud = baud
+
+    def set_lines(self, dtr: bool | None = None, rts: bool | None = None):
+        """DTR/RTS do conversor: RTS segura o EN (reset), DTR segura o GPIO0 (download)."""
+        with self._lock:
+            if dtr is not None:
+                self.dtr = dtr
+            if rts is None:
+                return
+            was_reset = self.rts
+            self.rts = rts
+            if rts and not was_reset:
+                self._enter_reset()
+            elif was_reset and not rts:
+                self._boot()
+
+    def new_dut(self):
+        """Troca de DUT: flash apagada, MAC novo e chip desligado ate o proximo reset."""
+        with self._lock:
+            self.flash[:] = b"\xff" * len(self.flash)
+            self.mac = random_mac()
+            self._enter_reset()
+
+    def next_unit(self):
+        """Proximo DUT no fixture: novo, ou (com ``retest_rate``) o mesmo de volta para reteste."""
+        if self.retest_rate and random.random() < self.retest_rate:
+            with self._lock:
+                self._enter_reset()
+            return
+        self.new_dut()
+
+    def _enter_reset(self):
+        self._stop_app()
+        self.mode = "reset"
+        self._write = None
+        self._decoder.reset()
+
+    def _boot(self):
+        self.stats["resets"] += 1
+        self.device_baud = ROM_BAUD
+        self._busy_until = 0.0
+        if self.dtr:
+            self.mode = "rom"
+            self.emit(BANNER_DOWNLOAD)
+            return
+        self.mode = "app"
+        self.emit(BANNER_APP)
+        if self.app is not None:
+            self._app_stop = threading.Event()
+            self._app_thread = threading.Thread(
+                target=self.app, args=(self, self._app_stop), name="dut-app", daemon=True
+            )
+            self._app_thread.start()
+
+    def _stop_app(self):
+        self._app_stop.set()
+
+    # ---- tempo --------------------------------------------------------------
+
+    def _sleep(self, seconds: float):
+        if seconds > 0 and self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def _wire_time(self, nbytes: int) -> float:
+        return nbytes * 10 / self.device_baud
+
+    def _wait_flash(self):
+        if self.time_scale > 0:
+            remaining = self._busy_until - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _flash_busy(self, seconds: float):
+        # A escrita roda "no chip" enquanto o proximo bloco chega pela UART
+        if self.time_scale > 0:
+            start = max(time.monotonic(), self._busy_until)
+            self._busy_until = start + seconds * self.time_scale
+
+    # ---- saida --------------------------------------------------------------
+
+    def emit(self, data: bytes):
+        """Escreve na UART do DUT (log do app ou resposta do loader)."""
+        if not data:
+            return
+        self._sleep(self._wire_time(len(data)))
+        with self._lock:
+            output = self._output
+            if output is None or self.mode == "reset":
+                return
+            if self.host_baud != self.device_baud:
+                return  # baud trocado: o host so veria lixo
+            self.stats["bytes_out"] += len(data)
+            output(data)
+
+    def _send_packet(self, packet: bytes):
+        self.emit(slip_encode(packet))
+
+    def _respond(self, op: int, val: int = 0, data: bytes = b"", error: int = 0):
+        status = bytes([1 if error else 0, error])
+        if self.mode == "rom":
+            status += b"\x00\x00"  # a ROM do ESP32 manda 4 bytes de status
+        payload = data + status
+        self._sleep(self.latency)
+        self._send_packet(struct.pack("<BBHI", 1, op, len(payload), val) + payload)
+
+    # ---- entrada ------------------------------------------------------------
+
+    def feed(self, data: bytes):
+        with self._lock:
+            if self.mode in ("reset", "app") or self.host_baud != self.device_baud:
+                return  # chip em reset, app rodando ou baud errado: o loader nao ve nada
+            self.stats["bytes_in"] += len(data)
+            packets = self._decoder.feed(data)
+        for packet in packets:
+            self._sleep(self._wire_time(len(packet) + 2))
+            self._handle(packet)
+
+    def _handle(self, packet: bytes):
+        if len(packet) < 8:
+            return  # acks do read_flash (contagem de bytes recebidos)
+        direction, op, size, chk = struct.unpack("<BBHI", packet[:8])
+        if direction != 0:
+            return
+        data = packet[8:8 + size]
+        self.stats["commands"] += 1
+        handler = self._handlers().get(op)
+        if handler is None or (op in STUB_ONLY and self.mode != "stub"):
+            self._respond(op, error=ERR_INVALID_COMMAND)
+            return
+        handler(op, data, chk)
+
+    def _handlers(self):
+        return {
+            SYNC: self._cmd_sync,
+            READ_REG: self._cmd_read_reg,
+            WRITE_REG: self._cmd_write_reg,
+            MEM_BEGIN: self._cmd_ok,
+            MEM_DATA: self._cmd_mem_data,
+            MEM_END: self._cmd_mem_end,
+            SPI_SET_PARAMS: self._cmd_ok,
+            SPI_ATTACH: self._cmd_ok,
+            CHANGE_BAUDRATE: self._cmd_change_baud,
+            FLASH_BEGIN: self._cmd_flash_begin,
+            FLASH_DATA: self._cmd_flash_data,
+            FLASH_END: self._cmd_flash_end,
+            FLASH_DEFL_BEGIN: self._cmd_flash_begin,
+            FLASH_DEFL_DATA: self._cmd_flash_data,
+            FLASH_DEFL_END: self._cmd_flash_end,
+            SPI_FLASH_MD5: self._cmd_md5,
+            ERASE_FLASH: self._cmd_erase_flash,
+            ERASE_REGION: self._cmd_erase_region,
+            READ_FLASH: self._cmd_read_flash,
+            RUN_USER_CODE: self._cmd_run_user_code,
+        }
+
+    # ---- comandos -----------------------------------------------------------
+
+    def _cmd_ok(self, op, data, chk):
+        self._respond(op)
+
+    def _cmd_sync(self, op, data, chk):
+        if data[:4] != b"\x07\x07\x12\x20":
+            return
+        # Uma resposta por pacote de sync mais 7 extras (o esptool le as 8)
+        val = 0 if self.mode == "stub" else ROM_SYNC_VALUE
+        for _ in range(8):
+            self._respond(op, val=val)
+
+    def _cmd_read_reg(self, op, data, chk):
+        (addr,) = struct.unpack("<I", data[:4])
+        mac = bytes.fromhex(self.mac.replace(":", ""))
+        if addr == EFUSE_MAC_LOW_REG:
+            value = int.from_bytes(mac[2:], "big")
+        elif addr == EFUSE_MAC_HIGH_REG:
+            value = int.from_bytes(mac[:2], "big")
+        else:
+            value = self._regs.get(addr, 0)
+        self._respond(op, val=value)
+
+    def _cmd_write_reg(self, op, data, chk):
+        addr, value, mask, _ = struct.unpack("<IIII", data[:16])
+        old = self._regs.get(addr, 0)
+        self._regs[addr] = (old & ~mask) | (value & mask) if mask != 0xFFFFFFFF else value
+        self._respond(op)
+
+    def _cmd_mem_data(self, op, data, chk):
+        size = struct.unpack("<I", data[:4])[0]
+        block = data[16:16 + size]
+        if len(block) != size:
+            return self._respond(op, error=ERR_BAD_DATA_LEN)
+        if _checksum(block) != chk:
+            return self._respond(op, error=ERR_BAD_DATA_CHECKSUM)
+        self._respond(op)
+
+    def _cmd_mem_end(self, op, data, chk):
+        no_entry, entry = struct.unpack("<II", data[:8])
+        self._respond(op)
+        if not no_entry and self.mode == "rom":
+            # O stub do esptool sobe e se anuncia
+            self.mode = "stub"
+            self._send_packet(b"OHAI")
+
+    def _cmd_change_baud(self, op, data, chk):
+        baud, _ = struct.unpack("<II", data[:8])
+        self._respond(op)
+        self.device_baud = baud
+
+    def _cmd_flash_begin(self, op, data, chk):
+        size, blocks, block_size, offset = struct.unpack("<IIII", data[:16])
+        if offset + size > len(self.flash):
+            return self._respond(op, error=ERR_BAD_DATA_LEN)
+        compressed = op == FLASH_DEFL_BEGIN
+        if self.mode == "rom":
+            # A ROM apaga tudo no begin; o stub apaga conforme grava
+            end = _align_up(offset + size, SECTOR_SIZE)
+            self.flash[offset:end] = b"\xff" * (end - offset)
+            self._sleep((end - offset) / self.erase_rate)
+        self._write = {
+            "offset": offset,
+            "size": size,
+            "pos": 0,
+            "seq": 0,
+            "inflate": zlib.decompressobj() if compressed else None,
+        }
+        self._respond(op)
+
+    def _cmd_flash_data(self, op, data, chk):
+        state = self._write
+        if state is None:
+            return self._respond(op, error=ERR_BAD_DATA_LEN)
+        size, seq = struct.unpack("<II", data[:8])
+        block = data[16:16 + size]
+        if len(block) != size:
+            return self._respond(op, error=ERR_BAD_DATA_LEN)
+        if _checksum(block) != chk:
+            return self._respond(op, error=ERR_BAD_DATA_CHECKSUM)
+        if state["inflate"] is not None:
+            try:
+                block = state["inflate"].decompress(block)
+            except zlib.error:
+                return self._respond(op, error=ERR_INFLATE)
+        start = state["offset"] + state["pos"]
+        block = block[:max(0, state["size"] - state["pos"])] if state["inflate"] is not None else block
+        self.flash[start:start + len(block)] = block
+        state["pos"] += len(block)
+        state["seq"] = seq + 1
+        self.stats["flash_written"] += len(block)
+        # Ack ao receber; a escrita (com o erase dos setores) segue em paralelo
+        self._wait_flash()
+        self._respond(op)
+        erase = len(block) if self.mode == "stub" else 0
+        self._flash_busy(len(block) / self.write_rate + erase / self.erase_rate)
+
+    def _cmd_flash_end(self, op, data, chk):
+        self._wait_flash()
+        self._write = None
+        self._respond(op)
+        stay = struct.unpack("<I", data[:4])[0] if len(data) >= 4 else 1
+        if not stay:
+            self._reboot_to_app()
+
+    def _cmd_md5(self, op, data, chk):
+        self._wait_flash()
+        addr, size = struct.unpack("<II", data[:8])
+        if addr + size > len(self.flash):
+            return self._respond(op, error=ERR_BAD_DATA_LEN)
+        digest = hashlib.md5(self.flash[addr:addr + size]).digest()
+        self._sleep(size / self.md5_rate)
+        # A ROM devolve o MD5 em hex (32 bytes); o stub, os 16 bytes crus
+        self._respond(op, data=digest.hex().encode() if self.mode == "rom" else digest)
+
+    def _cmd_erase_flash(self, op, data, chk):
+        self._wait_flash()
+        self.flash[:] = b"\xff" * len(self.flash)
+        self._sleep(len(self.flash) / self.erase_rate)
+        self._respond(op)
+
+    def _cmd_erase_region(self, op, data, chk):
+        self._wait_flash()
+        offset, size = struct.unpack("<II", data[:8])
+        if offset % SECTOR_SIZE or size % SECTOR_SIZE or offset + size > len(self.flash):
+            return self._respond(op, error=ERR_BAD_DATA_LEN)
+        self.flash[offset:offset + size] = b"\xff" * size
+        self._sleep(size / self.erase_rate)
+        self._respond(op)
+
+    def _cmd_read_flash(self, op, data, chk):
+        self._wait_flash()
+        offset, length, packet_size, _ = struct.unpack("<IIII", data[:16])
+        if offset + length > len(self.flash):
+            return self._respond(op, error=ERR_BAD_DATA_LEN)
+        self._respond(op)
+        content = bytes(self.flash[offset:offset + length])
+        noisy = self.max_baud is not None and self.device_baud > self.max_baud
+        for pos in range(0, length, packet_size):
+            chunk = content[pos:pos + packet_size]
+            if noisy:
+                # Baud acima do que o cabo aguenta: bytes trocados no caminho
+                chunk = bytes([chunk[0] ^ 0x5A]) + chunk[1:]
+            self._send_packet(chunk)
+        self._send_packet(hashlib.md5(content).digest())
+
+    def _cmd_run_user_code(self, op, data, chk):
+        self._reboot_to_app()
+
+    def _reboot_to_app(self):
+        self._enter_reset()
+        dtr, self.dtr = self.dtr, False
+        self._boot()
+        self.dtr = dtr
+
+
+def random_mac() -> str:
+    # OUI da Espressif + 3 bytes aleatorios (um DUT novo por chamada)
+    return "24:0A:C4:" + ":".join(f"{b:02X}" for b in os.urandom(3))
+
+
+def _checksum(data: bytes, state: int = 0xEF) -> int:
+    for b in data:
+        state ^= b
+    return state
+
+
+def _align_up(value: int, align: int) -> int:
+    return (value + align - 1) // align * align
+
+
+class FvtFirmware:
+    """Firmware FVT simulado: log de boot e dos testes e o JSON de resultado na UART.
+
+    Serve de ``app`` do FakeEsp32. ``duration`` (s, escalado pelo time_scale
+    do DUT) e o tempo do boot ate o JSON; ``fail_rate`` e a fracao de
+    unidades com um teste reprovado; ``garbage_rate`` a chance de lixo
+    binario (ruido na UART, sem chaves) antes de cada linha; ``nested``
+    acrescenta objetos aninhados ao resultado e um frame JSON de telemetria
+    antes dele. Com ``replay`` (capturas do teste.py --capture-serial) os
+    bytes gravados sao reenviados no lugar do log sintetico, com o MAC do DUT.
+    """
+
+    CHUNK = 64  # bytes por escrita na UART (como os blocos do FIFO)
+
+    def __init__(self, duration: float = 20.0, fail_rate: float = 0.0, garbage_rate: float = 0.0,
+                 nested: bool = False, replay: list[str] | None = None, seed: int | None = None):
+        from teste import REQUIRED_KEYS
+
+        self.tests = [key for key in REQUIRED_KEYS if key != "mac_address"]
+        self.duration = duration
+        self.fail_rate = fail_rate
+        self.garbage_rate = garbage_rate
+        self.nested = nested
+        self.captures = []
+        for path in replay or ():
+            with open(path, "rb") as f:
+                self.captures.append(f.read())
+        self._rng = random.Random(seed)
+
+    def __call__(self, dut: FakeEsp32, stop: threading.Event):
+        if self.captures:
+            self._replay(dut, stop)
+        else:
+            self._synthesize(dut, stop)
+
+    def result(self, mac: str) -> dict:
+        result = {"mac_address": mac}
+        failed = self._rng.choice(self.tests) if self._rng.random() < self.fail_rate else None
+        for key in self.tests:
+            result[key] = key != failed
+        if self.nested:
+            result["detalhes"] = {
+                "wifi": {"ssid": "RCD-FVT", "rssi": self._rng.randint(-80, -40), "canais": [1, 6, 11]},
+                "dht22": {"temperatura": round(self._rng.uniform(20, 30), 1),
+                          "umidade": round(self._rng.uniform(40, 70), 1)},
+                "versao": {"fvt": "1.3.0", "idf": "v5.1.2", "nota": "chaves {dentro} de string"},
+            }
+        return result
+
+    def _synthesize(self, dut, stop):
+        result = self.result(dut.mac)
+        lines = [
+            b"I (29) boot: ESP-IDF v5.1.2 2nd stage bootloader",
+            b"I (312) cpu_start: Starting scheduler on PRO CPU.",
+            f"I (320) fvt: MAC {dut.mac}".encode(),
+        ]
+        if self.nested:
+            lines.append(b"I (325) fvt: config {modo=fvt, retries=3}")
+        steps = []
+        clock_ms = 330
+        for key in self.tests:
+            name = key[: -len("_passed")]
+            clock_ms += self._rng.randint(50, 900)
+            verdict = "OK" if result[key] else "FALHA"
+            steps.append([f"I ({clock_ms}) fvt: {name}... {verdict}".encode()])
+        if self.nested:
+            telemetry = {"evento": "wifi_scan", "scan": result["detalhes"]["wifi"]}
+            steps[-1].append(json.dumps(telemetry).encode())
+        steps.append([json.dumps(result).encode()])
+        if self._write_lines(dut, stop, lines):
+            return
+        step_time = self.duration / len(steps)
+        for step in steps:
+            # Duracao de cada teste com +-30% de variacao
+            if stop.wait(step_time * self._rng.uniform(0.7, 1.3) * dut.time_scale):
+                return
+            if self._write_lines(dut, stop, step):
+                return
+
+    def _write_lines(self, dut, stop, lines) -> bool:
+        for line in lines:
+            if self.garbage_rate and self._rng.random() < self.garbage_rate:
+                noise = bytes(self._rng.randrange(256) for _ in range(self._rng.randint(1, 32)))
+                line = noise.replace(b"{", b"").replace(b"}", b"") + b"\r\n" + line
+            if self._write(dut, stop, line + b"\r\n"):
+                return True
+        return False
+
+    def _write(self, dut, stop, data: bytes) -> bool:
+        for pos in range(0, len(data), self.CHUNK):
+            if stop.is_set():
+                return True
+            dut.emit(data[pos:pos + self.CHUNK])
+        return False
+
+    def _replay(self, dut, stop):
+        data = self._rng.choice(self.captures)
+        data = re.sub(rb'"mac_address"\s*:\s*"[^"]*"', f'"mac_address": "{dut.mac}"'.encode(), data)
+        chunks = max(1, len(data) // self.CHUNK)
+        pause = self.duration / chunks * dut.time_scale
+        for pos in range(0, len(data), self.CHUNK):
+            if stop.wait(pause) or self._write(dut, stop, data[pos:pos + self.CHUNK]):
+                return
+
+
+class _SerialLines:
+    """Lado "porta fisica" do PortManager do pyserial: repassa baud e DTR/RTS ao DUT."""
+
+    bytesize = 8
+    parity = "N"
+    stopbits = 1
+    xonxoff = False
+    rtscts = False
+    break_condition = False
+    cts = dsr = ri = cd = False
+
+    def __init__(self, dut: FakeEsp32):
+        self._dut = dut
+
+    @property
+    def baudrate(self):
+        return self._dut.host_baud
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self._dut.set_host_baud(value)
+
+    @property
+    def dtr(self):
+        return self._dut.dtr
+
+    @dtr.setter
+    def dtr(self, value):
+        self._dut.set_lines(dtr=value)
+
+    @property
+    def rts(self):
+        return self._dut.rts
+
+    @rts.setter
+    def rts(self, value):
+        self._dut.set_lines(rts=value)
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+
+class _Connection:
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes):
+        with self._lock:
+            self._sock.sendall(data)
+
+
+def _telnet_filter(manager: rfc2217.PortManager, data: bytes) -> bytes:
+    # Fora de comandos telnet os bytes passam direto; so o trecho a partir de um IAC
+    # (e o conteudo das subnegociacoes) vai ao filtro, byte a byte
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        if manager.mode == rfc2217.M_NORMAL and manager.suboption is None:
+            j = data.find(rfc2217.IAC, i)
+            if j < 0:
+                out += data[i:]
+                break
+            out += data[i:j]
+            i = j
+        out += b"".join(manager.filter(data[i:i + 1]))
+        i += 1
+    return bytes(out)
+
+
+class Rfc2217Server:
+    """Serve o DUT em rfc2217://host:porta (uma conexao por vez, como uma COM)."""
+
+    def __init__(self, dut: FakeEsp32, host: str = "127.0.0.1", port: int = 0, fresh: bool = False):
+        self.dut = dut
+        self.fresh = fresh
+        self.connections = 0
+        self._sock = socket.create_server((host, port))
+        self.host, self.port = self._sock.getsockname()[:2]
+        self._thread = None
+        self._closed = False
+
+    @property
+    def url(self) -> str:
+        return f"rfc2217://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="dut-rfc2217", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        while not self._closed:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            self.connections += 1
+            if self.fresh and self.connections > 1:
+                self.dut.new_dut()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                self._serve(conn)
+            finally:
+                conn.close()
+
+    def _serve(self, conn: socket.socket):
+        connection = _Connection(conn)
+        manager = rfc2217.PortManager(_SerialLines(self.dut), connection)
+        self.dut.attach(lambda data: connection.write(data.replace(rfc2217.IAC, rfc2217.IAC + rfc2217.IAC)))
+        try:
+            while True:
+                try:
+                    data = conn.recv(65536)
+                except OSError:
+                    break
+                if not data:
+                    break
+                payload = _telnet_filter(manager, data)
+                if payload:
+                    self.dut.feed(payload)
+        finally:
+            self.dut.detach()
+
+    def close(self):
+        self._closed = True
+        self._sock.close()
+
+
+class EmulatedSerial(SerialBase):
+    """Porta ``esp32emu://nome`` do pyserial ligada direto a um FakeEsp32 do mesmo processo.
+
+    Sem o vaivem de subnegociacoes do cliente RFC 2217 (que espera ~50 ms a
+    cada troca de timeout/DTR/RTS), os tempos medidos sao so os do modelo.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._dut = None
+        self._rx = bytearray()
+        self._rx_ready = threading.Condition()
+        super().__init__(*args, **kwargs)
+
+    def open(self):
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        name = self.portstr.split("://", 1)[1].split("?", 1)[0]
+        entry = EMULATED_DUTS.get(name)
+        if entry is None:
+            raise SerialException(f"DUT emulado {name!r} nao registrado (register_dut).")
+        self._dut, fresh = entry
+        if fresh:
+            # Cada abertura da porta (um ciclo do teste.py) e o proximo DUT no fixture
+            self._dut.next_unit()
+        self._dut.attach(self._receive)
+        self.is_open = True
+        self._reconfigure_port()
+        self._update_dtr_state()
+        self._update_rts_state()
+        self.reset_input_buffer()
+
+    def close(self):
+        if self.is_open:
+            self._dut.detach()
+            self.is_open = False
+
+    def _receive(self, data: bytes):
+        with self._rx_ready:
+            self._rx += data
+            self._rx_ready.notify_all()
+
+    def _reconfigure_port(self):
+        if self._dut is not None:
+            self._dut.set_host_baud(self._baudrate)
+
+    def fileno(self):
+        # Sem ioctl de linhas de modem: o esptool cai no ClassicReset (DTR/RTS pelo pyserial)
+        raise OSError(errno.ENOTTY, "porta emulada sem TIOCMSET")
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise PortNotOpenError()
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        with self._rx_ready:
+            while len(self._rx) < size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._rx_ready.wait(remaining)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+        return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = to_bytes(data)
+        self._dut.feed(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self._rx_ready:
+            self._rx.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def _update_rts_state(self):
+        if self._dut is not None:
+            self._dut.set_lines(rts=self._rts_state)
+
+    def _update_dtr_state(self):
+        if self._dut is not None:
+            self._dut.set_lines(dtr=self._dtr_state)
+
+    def _update_break_state(self):
+        pass
+
+    @property
+    def cts(self):
+        return False
+
+    @property
+    def dsr(self):
+        return False
+
+    @property
+    def ri(self):
+        return False
+
+    @property
+    def cd(self):
+        return False
+
+
+EMULATED_DUTS: dict[str, tuple[FakeEsp32, bool]] = {}
+
+
+def serial_class_for_url(url):
+    # Gancho de protocolo do serial_for_url (este modulo faz o papel de protocol_esp32emu)
+    return url, EmulatedSerial
+
+
+def register_dut(name: str, dut: FakeEsp32, fresh: bool = False) -> str:
+    """Publica o DUT como ``esp32emu://nome`` para o serial_for_url (esptool) deste processo.
+
+    Com ``fresh`` cada abertura da porta troca o DUT (flash apagada, MAC novo).
+    """
+    EMULATED_DUTS[name] = (dut, fresh)
+    # A porta emulada nao tem ioctl de linhas de modem (UnixTightReset): mesma sequencia
+    # do ClassicReset pelo custom_reset_sequence do esptool.cfg, so neste processo
+    esptool_loader.cfg["custom_reset_sequence"] = CLASSIC_RESET_SEQUENCE
+    handler = f"{__name__}.protocol_esp32emu"
+    if handler not in sys.modules:
+        sys.modules[handler] = sys.modules[__name__]
+        serial.protocol_handler_packages.append(__name__)
+    return f"esp32emu://{name}"
+
+
+def run_flash_bench(args) -> bool:
+    """Ciclo de gravacao do teste.py contra o DUT emulado; confere a flash no fim."""
+    import teste
+    from gravacao import BAUD_LADDER, BaudMemory, FlashSession, read_files
+
+    dut = FakeEsp32(time_scale=args.time_scale, max_baud=args.max_baud)
+    server = None
+    if args.rfc2217:
+        server = Rfc2217Server(dut).start()
+        url = server.url
+    else:
+        url = register_dut("bench", dut)
+    if args.ladder:
+        session = FlashSession(url, diff=args.diff, ladder=BAUD_LADDER,
+                               baud_memory=BaudMemory(args.baud_state) if args.baud_state else None)
+    else:
+        session = FlashSession(url, baud=args.baud, diff=args.diff)
+    expected = list(read_files(teste.FVT_IMAGES))
+    stages = {}
+    t_cycle = time.monotonic()
+    try:
+        for repeat in range(args.cycles):
+            t0 = time.monotonic()
+            session.connect()
+            stages["connect"] = time.monotonic() - t0
+            t0 = time.monotonic()
+            if args.full_erase:
+                session.erase_flash()
+            else:
+                session.erase_regions(teste.fvt_erase_plan())
+            stages["erase"] = time.monotonic() - t0
+            t0 = time.monotonic()
+            session.write_files(teste.FVT_IMAGES, stage="fvt_flash")
+            stages["fvt_flash"] = time.monotonic() - t0
+            t0 = time.monotonic()
+            ser = session.run_app()
+            teste.wait_for_boot(ser, 5.0)
+            stages["boot"] = time.monotonic() - t0
+            if not args.skip_final:
+                sparse = teste.get_final_firmware()
+                t0 = time.monotonic()
+                session.enter_bootloader()
+                teste.flash_decrypted_image(session, sparse)
+                stages["final_flash"] = time.monotonic() - t0
+                # Padding da imagem combinada: so apagado, tem que ler 0xFF
+                expected = list(sparse.segments) + [(offset, b"\xff" * size) for offset, size in sparse.blank]
+            session.close()
+            print(f"\nCiclo {repeat + 1}: " + ", ".join(f"{k} {v:.2f} s" for k, v in stages.items()))
+    finally:
+        session.close()
+        session.print_report()
+        if server is not None:
+            server.close()
+    print(f"Total {time.monotonic() - t_cycle:.2f} s | {dut.stats}")
+
+    ok = True
+    for offset, image in expected:
+        if bytes(dut.flash[offset:offset + len(image)]) != bytes(image):
+            ok = False
+            print(f"DIVERGENCIA na flash emulada em 0x{offset:08x} ({len(image)} bytes)")
+    print("Flash emulada confere com as imagens gravadas." if ok else "Flash emulada NAO confere.")
+    return ok
+
+
+def _fvt_app(args) -> FvtFirmware:
+    return FvtFirmware(duration=args.fvt_time, fail_rate=args.fail_rate, garbage_rate=args.garbage_rate,
+                       nested=args.nested, replay=args.replay)
+
+
+def _station_worker(index: int, args, teste_args: list[str], out_dir: str, api_url: str, units: int, results_q):
+    # Um processo por porta, como o estacao.py: cada um com o seu teste.py (spool, pos-teste, caches)
+    port_name = f"dut{index}"
+    log = open(os.path.join(out_dir, f"{port_name}.log"), "a", encoding="utf-8", buffering=1)
+    sys.stdout = log
+    sys.stderr = log
+
+    import teste
+
+    # Spool, arquivo de QR e memoria de baud da simulacao ficam fora dos arquivos da estacao real
+    teste.UPLOAD_SPOOL_PATH = os.path.join(out_dir, "spool", f"uploads_{port_name}.sqlite3")
+    teste.QR_ARCHIVE_PATH = os.path.join(out_dir, "spool", f"qrcodes_{port_name}.sqlite3")
+    teste.BAUD_STATE_PATH = os.path.join(out_dir, "baud-state.json")
+
+    dut = FakeEsp32(time_scale=args.time_scale, max_baud=args.max_baud, app=_fvt_app(args),
+                    retest_rate=args.retest_rate)
+    port = register_dut(port_name, dut, fresh=True)
+    options = teste.build_parser().parse_args([
+        "--api-url", api_url,
+        "--label-backend", "nulo",
+        "--metrics-dir", os.path.join(out_dir, "metricas"),
+        "--results-db", os.path.join(out_dir, "spool", "resultados.sqlite3"),
+        # O reteste rapido e opt-in no teste.py; com --retest-rate a simulacao o liga
+        *(["--retest-window", "24", "--reprint-label"] if args.retest_rate else []),
+        *teste_args,
+    ])
+    teste.prepare_station(options)
+    try:
+        for _ in range(units):
+            try:
+                result = teste.run_dut_cycle(port, options)
+            except Exception as e:
+                print(f"Erro inesperado no ciclo: {e}")
+                result = {"mac_address": None, "outcome": "error"}
+            results_q.put((port, result["outcome"], result.get("mode", ""), result.get("mac_address") or ""))
+    finally:
+        teste.flush_qr_archive()
+        results_q.put((port, None, "", ""))
+        log.close()
+
+
+def run_station_load(args, teste_args: list[str]) -> dict:
+    """Roda o ciclo completo do teste.py em N DUTs emulados contra a API local, sem impressora."""
+    import multiprocessing as mp
+
+    import api_local
+    from metricas import MetricsLog, format_summary, summarize
+
+    out_dir = os.path.abspath(args.out or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "logs", "simulacao", time.strftime("%Y%m%d-%H%M%S")))
+    os.makedirs(out_dir, exist_ok=True)
+    api = api_local.serve("127.0.0.1", 0, args.api_latency, args.api_fail_rate)
+    threading.Thread(target=api.serve_forever, name="api-local", daemon=True).start()
+    api_url = f"http://127.0.0.1:{api.server_port}"
+
+    results_q = mp.Queue()
+    shares = [args.units // args.duts + (1 if i < args.units % args.duts else 0) for i in range(args.duts)]
+    t0 = time.time()
+    workers = []
+    for index, units in enumerate(shares):
+        proc = mp.Process(target=_station_worker, name=f"sim-dut{index}", daemon=True,
+                          args=(index, args, teste_args, out_dir, api_url, units, results_q))
+        proc.start()
+        workers.append(proc)
+
+    outcomes: dict[str, int] = {}
+    running = len(workers)
+    done = 0
+    while running:
+        port, outcome, mode, mac = results_q.get()
+        if outcome is None:
+            running -= 1
+            continue
+        done += 1
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        rate = done / max(time.time() - t0, 1e-9) * 60
+        print(f"[{done}/{args.units}] {port:<16} {outcome:<5} {mode:<8} {mac:<17} | {rate:6.1f} un/min")
+    for proc in workers:
+        proc.join()
+    elapsed = time.time() - t0
+    api.shutdown()
+
+    print(f"\n{done} ciclos em {elapsed:.1f} s ({done / elapsed * 60:.1f} un/min) | "
+          + ", ".join(f"{k} {v}" for k, v in sorted(outcomes.items())))
+    print(f"API local: {api.api.requests} requisicoes, {len(api.api.results)} resultados")
+    print(format_summary(summarize(MetricsLog(os.path.join(out_dir, "metricas")).records(since=t0))))
+    print(f"\nLogs, metricas e spool da simulacao em {out_dir}")
+    return outcomes
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="ESP32 emulado (ROM/stub do esptool) em rfc2217:// ou esp32emu://.",
+        epilog="station: argumentos desconhecidos vao para o teste.py (ex.: --no-pipeline --baud 921600)",
+    )
+    parser.add_argument("command", choices=["serve", "bench", "station"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000, help="serve: porta TCP")
+    parser.add_argument("--fresh", action="store_true", help="serve: cada conexao e um DUT novo (flash apagada)")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="multiplica os tempos modelados (0: sem esperas)")
+    parser.add_argument("--max-baud", type=int, help="leituras acima deste baud chegam corrompidas")
+    parser.add_argument("--baud", type=int, default=921600, help="bench: baud fixo de gravacao")
+    parser.add_argument("--ladder", action="store_true", help="bench: negocia a escada de baud do teste.py")
+    parser.add_argument("--baud-state", help="bench: arquivo BaudMemory (com --ladder)")
+    parser.add_argument("--diff", action="store_true", help="bench: gravacao diff (--diff-flash)")
+    parser.add_argument("--full-erase", action="store_true", help="bench: erase_flash em vez do erase por regiao")
+    parser.add_argument("--skip-final", action="store_true", help="bench: sem a gravacao do firmware final")
+    parser.add_argument("--rfc2217", action="store_true",
+                        help="bench: passa pelo servidor rfc2217:// em vez da porta esp32emu:// no processo")
+    parser.add_argument("--cycles", type=int, default=1, help="bench: ciclos no mesmo DUT")
+    fvt = parser.add_argument_group("firmware FVT simulado (serve/station)")
+    fvt.add_argument("--fvt-time", type=float, default=20.0, help="segundos do boot ate o JSON (escalado)")
+    fvt.add_argument("--fail-rate", type=float, default=0.05, help="fracao de unidades com um teste reprovado")
+    fvt.add_argument("--garbage-rate", type=float, default=0.0, help="chance de lixo binario antes de cada linha")
+    fvt.add_argument("--nested", action="store_true", help="JSON aninhado e frame de telemetria antes do resultado")
+    fvt.add_argument("--replay", nargs="+", metavar="CAPTURA",
+                     help="reenvia capturas do teste.py --capture-serial no lugar do log sintetico")
+    station = parser.add_argument_group("carga (station)")
+    station.add_argument("--duts", type=int, default=4, help="portas emuladas (um processo por porta)")
+    station.add_argument("--units", type=int, default=100, help="total de ciclos a rodar")
+    station.add_argument("--retest-rate", type=float, default=0.0,
+                         help="fracao de ciclos com o mesmo DUT de volta (exercita o reteste rapido)")
+    station.add_argument("--api-latency", type=float, default=0.0, help="atraso (s) da API local")
+    station.add_argument("--api-fail-rate", type=float, default=0.0, help="fracao de 503 da API local")
+    station.add_argument("--out", help="pasta de logs/metricas/spool (padrao: logs/simulacao/<data>)")
+    args, teste_args = parser.parse_known_args()
+    if teste_args and args.command != "station":
+        parser.error(f"argumentos desconhecidos: {' '.join(teste_args)}")
+
+    if args.command == "bench":
+        sys.exit(0 if run_flash_bench(args) else 1)
+    if args.command == "station":
+        outcomes = run_station_load(args, teste_args)
+        sys.exit(1 if outcomes.get("error") else 0)
+
+    dut = FakeEsp32(time_scale=args.time_scale, max_baud=args.max_baud, app=_fvt_app(args))
+    server = Rfc2217Server(dut, args.host, args.port, fresh=args.fresh)
+    print(f"ESP32 emulado em {server.url} (Ctrl+C para sair)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"{server.connections} conexao(oes) | {dut.stats}")
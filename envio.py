@@ -0,0 +1,574 @@
+# envio.py
+# Fila duravel (SQLite) dos resultados enviados para a API da Polus.
+#
+# O ciclo do DUT so grava o resultado no spool (enqueue) e segue; uma thread
+# em segundo plano (UploadWorker) envia os pendentes, com retry e backoff
+# exponencial. Nada se perde se a API estiver lenta ou fora do ar: o que nao
+# foi enviado continua no spool e sai na proxima partida da estacao.
+#
+# Idempotencia: cada resultado e identificado por MAC + lote. Reenfileirar o
+# mesmo resultado ja enviado nao gera novo POST (a resposta guardada e
+# reaproveitada); um resultado diferente (reteste) substitui o anterior.
+#
+# Uso (teste.py):
+#   spool = UploadSpool(".../spool/uploads.sqlite3")
+#   worker = UploadWorker(spool, send)    # send(payload, key) -> dict da API
+#   worker.start()
+#   key = spool.enqueue(mac, lote, payload)
+#   resposta = worker.wait_response(key, timeout=15)   # ex.: auvoLink
+#
+# HTTP: uma requests.Session compartilhada (create_http_session) mantem a
+# conexao TLS viva entre DUTs; prewarm() abre essa conexao enquanto o JSON
+# do FVT ainda chega pela serial, logo antes do POST. Cada resposta traz ``timing`` com o tempo de conexao
+# (DNS + TCP + TLS, zero quando a conexao foi reaproveitada) e o do servidor.
+#
+# Backlog (API fora por um turno): o worker envia com concorrencia limitada
+# e, com um send_batch (BatchSender), agrupa os pendentes em lotes JSON
+# comprimidos com gzip. Os auvoLinks devolvidos ficam no spool por MAC, para
+# reimprimir as etiquetas depois.
+#
+# Uso:
+#   python envio.py status [spool.sqlite3]
+#   python envio.py drain [--batch] [--batch-size 50] [--concurrency 4] [--api-url URL]
+#   python envio.py links [--out links.csv]        # MAC -> auvoLink dos enviados
+# Servidor local no lugar da API (teste offline): python api_local.py
+
+from __future__ import annotations
+
+import csv
+import gzip
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metricas import TRACER
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_REJECTED = "rejected"
+
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+# Um envio "sending" sem resposta depois disso (processo morto) volta a ser pendente
+SEND_LEASE = 120.0
+# Respostas HTTP que valem nova tentativa; outros 4xx sao rejeicao definitiva
+RETRYABLE_STATUS = {408, 425, 429}
+HTTP_POOL_SIZE = 4
+BATCH_SIZE = 50
+DRAIN_CONCURRENCY = 4
+GZIP_LEVEL = 6
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    key TEXT PRIMARY KEY,
+    mac TEXT NOT NULL,
+    batch TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    response TEXT,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS uploads_due ON uploads (status, next_attempt);
+"""
+
+
+def upload_key(mac: str, batch: str) -> str:
+    return f"{mac.upper()}|{batch}"
+
+
+def split_key(key: str) -> tuple[str, str]:
+    mac, _, batch = key.partition("|")
+    return mac, batch
+
+
+def retry_delay(attempts: int) -> float:
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def is_retryable(exc: Exception) -> bool:
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        # Timeout, conexao recusada, DNS...: tenta de novo
+        return True
+    return status >= 500 or status in RETRYABLE_STATUS
+
+
+_connect_times = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        t0 = time.monotonic()
+        super().connect()
+        _connect_times.seconds = getattr(_connect_times, "seconds", 0.0) + time.monotonic() - t0
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        t0 = time.monotonic()
+        super().connect()
+        _connect_times.seconds = getattr(_connect_times, "seconds", 0.0) + time.monotonic() - t0
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter que anota em ``response.timing`` conexao x servidor."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        _connect_times.seconds = 0.0
+        t0 = time.monotonic()
+        response = super().send(request, *args, **kwargs)
+        total = time.monotonic() - t0
+        connect = _connect_times.seconds
+        response.timing = {
+            "connect": connect,
+            # Ate os cabecalhos da resposta: envio do corpo + processamento no servidor
+            "server": max(0.0, total - connect),
+            "total": total,
+            "reused": connect == 0.0,
+        }
+        return response
+
+
+def create_http_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    # Sem retry no urllib3: quem repete e o UploadWorker, com backoff e spool
+    session = requests.Session()
+    adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def format_timing(timing: dict) -> str:
+    conn = "reutilizada" if timing["reused"] else f"{timing['connect'] * 1000:.0f} ms"
+    return (f"conexao {conn}, servidor {timing['server'] * 1000:.0f} ms, "
+            f"total {timing['total'] * 1000:.0f} ms")
+
+
+def prewarm(session: requests.Session, url: str, timeout) -> threading.Thread:
+    """Abre (em segundo plano) a conexao TLS com o host de ``url``.
+
+    Qualquer resposta serve: o objetivo e deixar a conexao no pool para o
+    proximo POST. Erros sao ignorados (o envio real trata falhas).
+    """
+
+    def run():
+        try:
+            response = session.head(url, timeout=timeout, allow_redirects=False)
+            response.close()
+            timing = getattr(response, "timing", None)
+            if timing and not timing["reused"]:
+                print(f"Conexao com a API aquecida ({format_timing(timing)}).")
+        except requests.exceptions.RequestException:
+            pass
+
+    thread = threading.Thread(target=run, name="envio-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+class BatchSender:
+    """Envia varios resultados em um POST JSON comprimido com gzip.
+
+    Corpo: ``{"items": [{"test": ..., "batch_number": ...}, ...]}``.
+    Resposta esperada: ``{"results": [{"mac_address", "batch_number",
+    "auvoLink"?, "error"?}, ...]}``; devolve ``{chave: resposta}`` so para os
+    itens aceitos (os ausentes voltam para a fila).
+    """
+
+    def __init__(self, session: requests.Session, url: str, headers: dict, timeout, level: int = GZIP_LEVEL):
+        self.session = session
+        self.url = url
+        self.headers = headers
+        self.timeout = timeout
+        self.level = level
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, items: list[tuple[str, dict]]) -> dict[str, dict]:
+        body = json.dumps({
+            "items": [{"test": payload, "batch_number": split_key(key)[1]} for key, payload in items]
+        }).encode("utf-8")
+        wire = gzip.compress(body, self.level)
+        with self._lock:
+            self.raw_bytes += len(body)
+            self.wire_bytes += len(wire)
+        headers = dict(self.headers, **{"Content-Type": "application/json", "Content-Encoding": "gzip"})
+        with TRACER.span("POST lote", "http", items=len(items), bytes=len(wire)):
+            response = self.session.post(self.url, data=wire, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        accepted = {}
+        for result in response.json().get("results", []):
+            if result.get("error"):
+                continue
+            key = upload_key(result.get("mac_address", ""), result.get("batch_number", ""))
+            accepted[key] = result
+        return accepted
+
+
+class UploadSpool:
+    """Resultados a enviar, persistidos em SQLite (seguro entre processos)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self._connect()
+        try:
+            db.executescript(_SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Uma conexao por operacao: workers da estacao sao processos diferentes
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=FULL")
+        db.row_factory = sqlite3.Row
+        return db
+
+    def enqueue(self, mac: str, batch: str, payload: dict) -> str:
+        key = upload_key(mac, batch)
+        text = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT payload, status FROM uploads WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                db.execute(
+                    "INSERT INTO uploads (key, mac, batch, payload, status, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, mac, batch, text, STATUS_PENDING, time.time()),
+                )
+            elif row["payload"] != text or row["status"] == STATUS_REJECTED:
+                # Reteste (resultado novo) ou reenvio manual de um rejeitado
+                db.execute(
+                    "UPDATE uploads SET payload = ?, status = ?, attempts = 0, next_attempt = 0, "
+                    "response = NULL, last_error = NULL, sent_at = NULL WHERE key = ?",
+                    (text, STATUS_PENDING, key),
+                )
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        return key
+
+    def claim_due(self, limit: int = 10, ignore_backoff: bool = False) -> list[tuple[str, dict]]:
+        """Marca como 'sending' e devolve os envios vencidos.
+
+        Com ``ignore_backoff`` (drain manual) todo pendente entra, mesmo fora
+        da janela de backoff; envios de outro processo em andamento nao.
+        """
+        now = time.time()
+        due = float("inf") if ignore_backoff else now
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute(
+                "SELECT key, payload FROM uploads WHERE (status = ? AND next_attempt <= ?) "
+                "OR (status = ? AND next_attempt <= ?) ORDER BY created_at LIMIT ?",
+                (STATUS_PENDING, due, STATUS_SENDING, now, limit),
+            ).fetchall()
+            for row in rows:
+                db.execute(
+                    "UPDATE uploads SET status = ?, next_attempt = ? WHERE key = ?",
+                    (STATUS_SENDING, now + SEND_LEASE, row["key"]),
+                )
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        return [(row["key"], json.loads(row["payload"])) for row in rows]
+
+    def mark_sent(self, key: str, response: dict):
+        self._update(
+            key,
+            "status = ?, sent_at = ?, response = ?, last_error = NULL, attempts = attempts + 1",
+            (STATUS_SENT, time.time(), json.dumps(response, ensure_ascii=False)),
+        )
+
+    def mark_failed(self, key: str, error: str, retry: bool):
+        db = self._connect()
+        try:
+            row = db.execute("SELECT attempts FROM uploads WHERE key = ?", (key,)).fetchone()
+            attempts = (row["attempts"] if row else 0) + 1
+            status = STATUS_PENDING if retry else STATUS_REJECTED
+            db.execute(
+                "UPDATE uploads SET status = ?, attempts = ?, next_attempt = ?, last_error = ? "
+                "WHERE key = ? AND status = ?",
+                (status, attempts, time.time() + retry_delay(attempts), error, key, STATUS_SENDING),
+            )
+        finally:
+            db.close()
+
+    def _update(self, key: str, assignments: str, values: tuple):
+        db = self._connect()
+        try:
+            # So conclui se ninguem reenfileirou um resultado novo durante o envio
+            db.execute(
+                f"UPDATE uploads SET {assignments} WHERE key = ? AND status = ?",
+                values + (key, STATUS_SENDING),
+            )
+        finally:
+            db.close()
+
+    def get(self, key: str) -> dict | None:
+        db = self._connect()
+        try:
+            row = db.execute("SELECT * FROM uploads WHERE key = ?", (key,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["response"] = json.loads(entry["response"]) if entry["response"] else None
+        return entry
+
+    def links(self) -> list[dict]:
+        """MAC -> auvoLink dos resultados ja enviados (para reimprimir etiquetas)."""
+        db = self._connect()
+        try:
+            rows = db.execute(
+                "SELECT mac, batch, response, sent_at FROM uploads WHERE status = ? ORDER BY sent_at",
+                (STATUS_SENT,),
+            ).fetchall()
+        finally:
+            db.close()
+        links = []
+        for row in rows:
+            response = json.loads(row["response"]) if row["response"] else {}
+            links.append({
+                "mac_address": row["mac"],
+                "batch_number": row["batch"],
+                "auvoLink": response.get("auvoLink") or "",
+                "sent_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["sent_at"])),
+            })
+        return links
+
+    def counts(self) -> dict[str, int]:
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT status, COUNT(*) FROM uploads GROUP BY status").fetchall()
+        finally:
+            db.close()
+        return {status: count for status, count in rows}
+
+    def next_due(self) -> float | None:
+        db = self._connect()
+        try:
+            row = db.execute(
+                "SELECT MIN(next_attempt) FROM uploads WHERE status IN (?, ?)",
+                (STATUS_PENDING, STATUS_SENDING),
+            ).fetchone()
+        finally:
+            db.close()
+        return row[0]
+
+
+class DrainStats:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.requests = 0
+        self.seconds = 0.0
+
+    def report(self, sender=None) -> str:
+        rate = self.sent / self.seconds if self.seconds else 0.0
+        text = (f"{self.sent} enviados, {self.failed} falhas, {self.requests} requisicoes "
+                f"em {self.seconds:.1f} s ({rate:.1f} resultados/s)")
+        if sender is not None and getattr(sender, "raw_bytes", 0):
+            text += f", {sender.raw_bytes} -> {sender.wire_bytes} bytes com gzip"
+        return text
+
+
+class UploadWorker:
+    """Thread que esvazia o spool chamando ``send(payload, key)``.
+
+    ``send`` devolve o JSON da API (dict) ou levanta excecao; falhas
+    transitorias voltam para a fila com backoff, 4xx definitivos ficam como
+    'rejected'. Com ``send_batch(itens) -> {chave: resposta}`` os pendentes
+    saem em lotes de ``batch_size``. Ate ``concurrency`` requisicoes rodam
+    ao mesmo tempo.
+    """
+
+    def __init__(
+        self,
+        spool: UploadSpool,
+        send,
+        poll_interval: float = 5.0,
+        send_batch=None,
+        batch_size: int = BATCH_SIZE,
+        concurrency: int = DRAIN_CONCURRENCY,
+    ):
+        self.spool = spool
+        self.send = send
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.stats = DrainStats()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="envio")
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._done = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="envio-polus", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._executor.shutdown(wait=False)
+
+    def notify(self):
+        """Acorda a thread (chamado logo apos um enqueue)."""
+        self._wake.set()
+
+    def wait_response(self, key: str, timeout: float) -> dict | None:
+        """Espera o envio de ``key`` por ate ``timeout`` s; devolve a resposta da API ou None."""
+        self.notify()
+        deadline = time.monotonic() + timeout
+        with self._done:
+            while True:
+                entry = self.spool.get(key)
+                if entry and entry["status"] == STATUS_SENT:
+                    return entry["response"] or {}
+                if entry and entry["status"] == STATUS_REJECTED:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._done.wait(min(remaining, 1.0))
+
+    def drain_once(self, ignore_backoff: bool = False) -> int:
+        t0 = time.monotonic()
+        batch_size = self.batch_size if self.send_batch else 1
+        items = self.spool.claim_due(batch_size * self.concurrency, ignore_backoff=ignore_backoff)
+        groups = [items[pos:pos + batch_size] for pos in range(0, len(items), batch_size)]
+        sent = 0
+        for group, future in [(g, self._executor.submit(self._send_group, g)) for g in groups]:
+            try:
+                responses = future.result()
+                error = None
+            except Exception as e:
+                responses, error = {}, e
+            self.stats.requests += 1
+            for key, _ in group:
+                if key in responses:
+                    self.spool.mark_sent(key, responses[key])
+                    sent += 1
+                    continue
+                exc = error or RuntimeError("resultado ausente na resposta do lote")
+                retry = is_retryable(exc)
+                self.spool.mark_failed(key, str(exc), retry)
+                self.stats.failed += 1
+                action = "nova tentativa com backoff" if retry else "rejeitado pela API"
+                print(f"Envio de {key} falhou ({action}): {exc}")
+            with self._done:
+                self._done.notify_all()
+        self.stats.sent += sent
+        if items:
+            self.stats.seconds += time.monotonic() - t0
+        return sent
+
+    def _send_group(self, group: list[tuple[str, dict]]) -> dict[str, dict]:
+        if self.send_batch is not None and len(group) > 1:
+            return self.send_batch(group)
+        key, payload = group[0]
+        response = self.send(payload, key)
+        return {key: response if isinstance(response, dict) else {}}
+
+    def drain(self) -> DrainStats:
+        """Esvazia o spool agora (ignora o backoff); devolve as estatisticas."""
+        self.stats = DrainStats()
+        while self.drain_once(ignore_backoff=True):
+            pass
+        return self.stats
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.drain_once()
+                due = self.spool.next_due()
+            except sqlite3.Error as e:
+                print(f"Erro no spool de envios: {e}")
+                due = None
+            wait = self.poll_interval if due is None else max(0.0, min(self.poll_interval, due - time.time()))
+            self._wake.wait(wait)
+            self._wake.clear()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import teste
+
+    parser = argparse.ArgumentParser(description="Spool de envios para a API da Polus.")
+    parser.add_argument("command", choices=["status", "drain", "links"])
+    parser.add_argument("--spool", default=teste.UPLOAD_SPOOL_PATH, help="arquivo SQLite do spool")
+    parser.add_argument("--api-url", help=f"URL base da API (padrao: {teste.API_BASE_URL})")
+    parser.add_argument("--batch", action="store_true", help="envia em lotes gzip (endpoint de lote)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=DRAIN_CONCURRENCY)
+    parser.add_argument("--out", help="links: grava CSV (mac_address,auvoLink,...) em vez de imprimir")
+    args = parser.parse_args()
+
+    spool = UploadSpool(args.spool)
+    if args.command == "status":
+        for status, count in sorted(spool.counts().items()):
+            print(f"{status:<10} {count}")
+    elif args.command == "links":
+        links = spool.links()
+        out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+        writer = csv.DictWriter(out, fieldnames=["mac_address", "auvoLink", "batch_number", "sent_at"])
+        writer.writeheader()
+        writer.writerows(links)
+        if args.out:
+            out.close()
+            print(f"{len(links)} links gravados em {args.out}")
+    else:
+        if args.api_url:
+            teste.API_BASE_URL = args.api_url.rstrip("/")
+        worker = teste.build_upload_worker(
+            spool, batch=args.batch, batch_size=args.batch_size, concurrency=args.concurrency
+        )
+        print(f"Pendentes: {spool.counts().get(STATUS_PENDING, 0)}")
+        stats = worker.drain()
+        print(f"Drain: {stats.report(worker.send_batch)}")
+        for status, count in sorted(spool.counts().items()):
+            print(f"  {status:<10} {count}")
@@ -0,0 +1,211 @@
+# estacao.py
+# Modo estacao: um worker (processo) por porta COM, cada um rodando o ciclo
+# completo do teste.py (erase, FVT, serial, API, etiqueta, gravacao final).
+# Uso:
+#   python teste.py --ports COM4 COM5 COM6 COM7
+#   python teste.py --discover
+#
+# Cada worker grava a saida (prints + esptool) em logs/<PORTA>.log e envia o
+# status para o processo principal, que mostra uma linha por porta.
+# Comandos do operador (digitar e Enter):
+#   <Enter>          inicia todas as portas ociosas
+#   COM5 (ou 2)      inicia so a porta indicada (nome ou numero da linha)
+#   q                encerra a estacao quando os ciclos em andamento terminarem
+
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+
+# VID/PID dos conversores USB-serial usados nos fixtures (CP210x, CH340/CH9102, FTDI, ESP USB-JTAG)
+KNOWN_USB_SERIAL_IDS = {
+    (0x10C4, 0xEA60),
+    (0x1A86, 0x7523),
+    (0x1A86, 0x55D4),
+    (0x0403, 0x6001),
+    (0x0403, 0x6010),
+    (0x0403, 0x6014),
+    (0x0403, 0x6015),
+    (0x303A, 0x1001),
+}
+
+STATE_IDLE = "ocioso"
+STATE_RUNNING = "rodando"
+STATE_DONE = "concluido"
+STATE_STOPPED = "parado"
+
+
+def discover_ports() -> list[str]:
+    # So lista as portas pelo VID/PID; nao abre a serial para nao resetar DUTs em teste
+    from serial.tools import list_ports
+
+    ports = []
+    for info in list_ports.comports():
+        if (info.vid, info.pid) in KNOWN_USB_SERIAL_IDS:
+            ports.append(info.device)
+    return sorted(ports)
+
+
+def port_log_path(log_dir: str, port: str) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in port.strip("/\\"))
+    return os.path.join(log_dir, f"{safe}.log")
+
+
+def _worker_main(port: str, options, log_dir: str, status_q, go_event, stop_event):
+    # Saida isolada: tudo que o ciclo (e o esptool) imprime vai para o log da porta
+    os.makedirs(log_dir, exist_ok=True)
+    log = open(port_log_path(log_dir, port), "a", encoding="utf-8", buffering=1)
+    sys.stdout = log
+    sys.stderr = log
+
+    import teste
+
+    def on_stage(stage: str, detail: str = ""):
+        status_q.put((port, STATE_RUNNING, stage, detail))
+
+    try:
+        # Dentro do try: se a carga falhar o painel ainda recebe STATE_STOPPED
+        try:
+            teste.prepare_station(options)
+        except Exception as e:
+            print(f"Erro ao preparar a estacao: {e}")
+            raise
+        status_q.put((port, STATE_IDLE, "", ""))
+        while not stop_event.is_set():
+            if not go_event.wait(timeout=0.5):
+                continue
+            go_event.clear()
+            print(f"\n===== {time.strftime('%Y-%m-%d %H:%M:%S')} novo ciclo em {port} =====")
+            status_q.put((port, STATE_RUNNING, "start", ""))
+            try:
+                result = teste.run_dut_cycle(port, options, on_stage=on_stage)
+            except Exception as e:
+                print(f"Erro inesperado no ciclo: {e}")
+                result = {"mac_address": None, "outcome": "error"}
+            status_q.put((port, STATE_DONE, result["outcome"], result.get("mac_address") or ""))
+    finally:
+        # O processo do worker sai via os._exit (multiprocessing): o atexit do arquivo de QR nao roda
+        teste.flush_qr_archive()
+        status_q.put((port, STATE_STOPPED, "", ""))
+        log.close()
+
+
+class PortStatus:
+    def __init__(self, port: str):
+        self.port = port
+        self.state = "iniciando"
+        self.stage = ""
+        self.detail = ""
+        self.last_result = ""
+        self.passed = 0
+        self.failed = 0
+        self.started_at = None
+
+    def line(self, index: int) -> str:
+        if self.state == STATE_RUNNING:
+            elapsed = f" {time.monotonic() - self.started_at:5.0f}s" if self.started_at else ""
+            now = f"{self.state}: {self.stage}{elapsed}"
+        else:
+            now = self.state
+        last = f" | ultimo: {self.last_result}" if self.last_result else ""
+        return (f"[{index}] {self.port:<12} | {now:<28} | ok {self.passed:>4} "
+                f"| falha {self.failed:>4}{last}")
+
+
+def _apply_status(status: PortStatus, state: str, stage: str, detail: str):
+    if state == STATE_RUNNING:
+        if status.state != STATE_RUNNING:
+            status.started_at = time.monotonic()
+        status.stage = stage
+        status.detail = detail
+    elif state == STATE_DONE:
+        if stage == "pass":
+            status.passed += 1
+        else:
+            status.failed += 1
+        status.last_result = f"{stage.upper()} {detail}".strip()
+        status.stage = ""
+    status.state = state
+
+
+def _render(statuses: list[PortStatus], log_dir: str):
+    if os.name == "nt":
+        os.system("cls")
+    else:
+        os.system("clear")
+    out = sys.__stdout__
+    out.write("=== Estacao RCD: um worker por porta ===\n")
+    for i, st in enumerate(statuses, 1):
+        out.write(st.line(i) + "\n")
+    out.write(f"\nLogs por porta em: {log_dir}\n")
+    out.write("<Enter> inicia portas ociosas | <porta ou numero> inicia uma porta | q sai\n> ")
+    out.flush()
+
+
+def run_station(ports: list[str], options, log_dir: str = "logs"):
+    log_dir = os.path.abspath(log_dir)
+    os.makedirs(log_dir, exist_ok=True)
+    status_q = mp.Queue()
+    stop_event = mp.Event()
+    statuses = [PortStatus(p) for p in ports]
+    by_port = {st.port: st for st in statuses}
+    go_events = {}
+    workers = []
+    for port in ports:
+        go_events[port] = mp.Event()
+        proc = mp.Process(
+            target=_worker_main,
+            args=(port, options, log_dir, status_q, go_events[port], stop_event),
+            name=f"rcd-{port}",
+            daemon=True,
+        )
+        proc.start()
+        workers.append(proc)
+
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def status_loop():
+        # Redesenha o painel a cada mudanca de status (e a cada segundo, para o tempo decorrido)
+        while not done.is_set():
+            try:
+                port, state, stage, detail = status_q.get(timeout=1)
+            except queue.Empty:
+                if any(st.state == STATE_RUNNING for st in statuses):
+                    with lock:
+                        _render(statuses, log_dir)
+                continue
+            with lock:
+                _apply_status(by_port[port], state, stage, detail)
+                _render(statuses, log_dir)
+
+    threading.Thread(target=status_loop, name="estacao-status", daemon=True).start()
+
+    try:
+        while True:
+            cmd = input().strip()
+            if cmd.lower() == "q":
+                break
+            if not cmd:
+                targets = [st for st in statuses if st.state in (STATE_IDLE, STATE_DONE)]
+            elif cmd.isdigit() and 1 <= int(cmd) <= len(statuses):
+                targets = [statuses[int(cmd) - 1]]
+            else:
+                targets = [st for st in statuses if st.port.lower() == cmd.lower()]
+            for st in targets:
+                if st.state in (STATE_IDLE, STATE_DONE):
+                    go_events[st.port].set()
+            with lock:
+                _render(statuses, log_dir)
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        stop_event.set()
+        print("Aguardando os ciclos em andamento terminarem...")
+        for proc in workers:
+            proc.join()
+        done.set()
@@ -0,0 +1,332 @@
+# etiqueta.py
+# Renderizador nativo (Pillow) do template LBX, sem b-PAC.
+#
+# O .lbx e um zip com label.xml (layout em pt), prop.xml e as imagens
+# (Object0.bmp). O layout e lido uma vez; o fundo estatico (moldura, logo,
+# textos fixos) e desenhado uma vez na resolucao da impressora e fica em
+# cache. Por etiqueta so o QR e o texto dinamico sao compostos por cima de
+# uma copia do fundo. A imagem resultante vai para o spooler pelo mesmo
+# caminho do PNG (imprimir.print_image).
+#
+# Uso:
+#   python etiqueta.py render --qr "https://..." --text "MAC:..." --out etiqueta.png
+#   python etiqueta.py bench [--n 200] [--dpi 300]
+
+from __future__ import annotations
+
+import io
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import NamedTuple
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+from qr_store import matrix_image, qr_matrix
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "RCD_v1.3_template.lbx")
+# QL-800: 300 dpi
+PRINTER_DPI = 300
+POINTS_PER_INCH = 72.0
+
+NS = {
+    "pt": "http://schemas.brother.info/ptouch/2007/lbx/main",
+    "style": "http://schemas.brother.info/ptouch/2007/lbx/style",
+    "text": "http://schemas.brother.info/ptouch/2007/lbx/text",
+    "draw": "http://schemas.brother.info/ptouch/2007/lbx/draw",
+    "image": "http://schemas.brother.info/ptouch/2007/lbx/image",
+    "barcode": "http://schemas.brother.info/ptouch/2007/lbx/barcode",
+}
+
+QR_ECC = {
+    "7%": qrcode.constants.ERROR_CORRECT_L,
+    "15%": qrcode.constants.ERROR_CORRECT_M,
+    "25%": qrcode.constants.ERROR_CORRECT_Q,
+    "30%": qrcode.constants.ERROR_CORRECT_H,
+}
+
+# Pastas onde procurar a fonte do template (Windows e Linux)
+FONT_DIRS = [
+    os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts"),
+    os.path.join(os.environ.get("LOCALAPPDATA", ""), "Microsoft", "Windows", "Fonts"),
+    "/usr/share/fonts",
+    "/usr/local/share/fonts",
+    os.path.expanduser("~/.fonts"),
+]
+
+
+def pt(value: str) -> float:
+    return float(value[:-2]) if value.endswith("pt") else float(value)
+
+
+class LbxObject(NamedTuple):
+    kind: str  # "frame", "text", "image", "qr"
+    name: str
+    x: float  # pt
+    y: float
+    width: float
+    height: float
+    attrs: dict
+
+
+class LbxTemplate(NamedTuple):
+    path: str
+    width: float  # pt
+    height: float
+    objects: list[LbxObject]
+    files: dict[str, bytes]
+
+    def get(self, name: str) -> LbxObject:
+        for obj in self.objects:
+            if obj.name == name:
+                return obj
+        names = ", ".join(o.name for o in self.objects)
+        raise KeyError(f"Objeto '{name}' nao encontrado no template. Objetos disponiveis: {names}")
+
+
+def _object_style(node):
+    style = node.find("pt:objectStyle", NS)
+    expanded = style.find("pt:expanded", NS)
+    return style, expanded.get("objectName", "")
+
+
+def load_lbx(path: str) -> LbxTemplate:
+    with zipfile.ZipFile(path) as z:
+        root = ET.fromstring(z.read("label.xml"))
+        files = {n: z.read(n) for n in z.namelist() if n not in ("label.xml", "prop.xml")}
+    sheet = root.find("pt:body/style:sheet", NS)
+    paper = sheet.find("style:paper", NS)
+    objects = []
+    for node in sheet.find("pt:objects", NS):
+        tag = node.tag.split("}")[1]
+        style, name = _object_style(node)
+        box = [pt(style.get(k)) for k in ("x", "y", "width", "height")]
+        attrs = {}
+        if tag == "frame":
+            pen = style.find("pt:pen", NS)
+            attrs["pen"] = pt(pen.get("widthX", "0.5pt"))
+            kind = "frame"
+        elif tag == "text":
+            font = node.find("text:ptFontInfo/text:logFont", NS)
+            ext = node.find("text:ptFontInfo/text:fontExt", NS)
+            align = node.find("text:textAlign", NS)
+            text_style = node.find("text:textStyle", NS)
+            attrs.update(
+                font=font.get("name"),
+                weight=int(font.get("weight", "400")),
+                size=pt(ext.get("size")),
+                halign=align.get("horizontalAlignment"),
+                valign=align.get("verticalAlignment"),
+                line_space=int(text_style.get("lineSpace", "0")),
+                data=node.findtext("pt:data", "", NS),
+            )
+            kind = "text"
+        elif tag == "image":
+            image_style = node.find("image:imageStyle", NS)
+            mono = image_style.find("image:mono", NS)
+            attrs.update(
+                file=image_style.get("fileName"),
+                threshold=int(mono.get("threshold", "128")) if mono is not None else 128,
+            )
+            kind = "image"
+        elif tag == "barcode":
+            barcode = node.find("barcode:barcodeStyle", NS)
+            if barcode.get("protocol") != "QRCODE":
+                continue
+            qr_style = node.find("barcode:qrcodeStyle", NS)
+            attrs.update(
+                ecc=QR_ECC.get(qr_style.get("eccLevel"), qrcode.constants.ERROR_CORRECT_M),
+                margin=barcode.get("margin") == "true",
+                data=node.findtext("pt:data", "", NS),
+            )
+            kind = "qr"
+        else:
+            continue
+        objects.append(LbxObject(kind, name, *box, attrs))
+    return LbxTemplate(path, pt(paper.get("width")), pt(paper.get("height")), objects, files)
+
+
+def find_font(name: str, weight: int = 400) -> str | None:
+    """Arquivo .ttf/.otf da fonte do template (ex.: 'Rubik SemiBold' -> Rubik-SemiBold.ttf)."""
+    compact = name.replace(" ", "").lower()
+    wanted = {compact, name.replace(" ", "-").lower(), f"{compact.replace('semibold', '')}-semibold"}
+    for folder in FONT_DIRS:
+        if not folder or not os.path.isdir(folder):
+            continue
+        for dirpath, _, filenames in os.walk(folder):
+            for filename in filenames:
+                stem, ext = os.path.splitext(filename)
+                if ext.lower() in (".ttf", ".otf") and stem.replace("_", "-").lower() in wanted:
+                    return os.path.join(dirpath, filename)
+    return None
+
+
+def load_font(name: str, weight: int, size_px: int):
+    path = find_font(name, weight)
+    if path is None:
+        fallback = "DejaVuSans-Bold.ttf" if weight >= 600 else "DejaVuSans.ttf"
+        try:
+            return ImageFont.truetype(fallback, size_px)
+        except OSError:
+            # Fonte embutida no Pillow (>= 10.1)
+            return ImageFont.load_default(size_px)
+    return ImageFont.truetype(path, size_px)
+
+
+class LabelRenderer:
+    """Desenha etiquetas do template na resolucao da impressora."""
+
+    def __init__(self, template: LbxTemplate, dpi: int = PRINTER_DPI,
+                 qr_field: str = "qr", text_field: str | None = "Texto3"):
+        self.template = template
+        self.dpi = dpi
+        self.qr_obj = template.get(qr_field)
+        self.text_obj = template.get(text_field) if text_field else None
+        self.size = (self.px(template.width), self.px(template.height))
+        self._fonts = {}
+        self.background = self._render_background()
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_TEMPLATE, **kwargs) -> "LabelRenderer":
+        return cls(load_lbx(path), **kwargs)
+
+    def px(self, points: float) -> int:
+        return int(round(points * self.dpi / POINTS_PER_INCH))
+
+    def box(self, obj: LbxObject) -> tuple[int, int, int, int]:
+        x, y = self.px(obj.x), self.px(obj.y)
+        return x, y, x + self.px(obj.width), y + self.px(obj.height)
+
+    def font(self, obj: LbxObject, size_px: int | None = None):
+        size_px = size_px or self.px(obj.attrs["size"])
+        key = (obj.attrs["font"], obj.attrs["weight"], size_px)
+        font = self._fonts.get(key)
+        if font is None:
+            font = self._fonts[key] = load_font(obj.attrs["font"], obj.attrs["weight"], size_px)
+        return font
+
+    def _render_background(self) -> Image.Image:
+        # Tudo o que nao muda entre etiquetas: moldura, logo e textos fixos
+        image = Image.new("L", self.size, 255)
+        draw = ImageDraw.Draw(image)
+        for obj in self.template.objects:
+            if obj.kind == "frame":
+                draw.rectangle(self.box(obj), outline=0, width=max(1, self.px(obj.attrs["pen"])))
+            elif obj.kind == "image":
+                data = self.template.files.get(obj.attrs["file"])
+                if data is None:
+                    continue
+                x0, y0, x1, y1 = self.box(obj)
+                logo = Image.open(io.BytesIO(data)).convert("L").resize((x1 - x0, y1 - y0), Image.LANCZOS)
+                threshold = obj.attrs["threshold"]
+                logo = logo.point(lambda v: 0 if v < threshold else 255)
+                image.paste(logo, (x0, y0))
+            elif obj.kind == "text" and obj is not self.text_obj:
+                self._draw_text(draw, obj, obj.attrs["data"])
+        return image
+
+    def _draw_text(self, draw: ImageDraw.ImageDraw, obj: LbxObject, text: str):
+        font = self.font(obj)
+        x0, y0, x1, y1 = self.box(obj)
+        lines = text.replace("\r\n", "\n").split("\n")
+        widest = max(draw.textlength(line, font=font) for line in lines)
+        if widest > x1 - x0:
+            # Fonte substituta mais larga que a do template: reduz para caber na caixa
+            font = self.font(obj, int(font.size * (x1 - x0) / widest))
+        ascent, descent = font.getmetrics()
+        # lineSpace do P-touch e percentual sobre a altura da linha
+        step = int(round((ascent + descent) * (1 + obj.attrs["line_space"] / 100.0)))
+        height = step * (len(lines) - 1) + ascent + descent
+        if obj.attrs["valign"] == "CENTER":
+            y = y0 + (y1 - y0 - height) // 2
+        elif obj.attrs["valign"] == "BOTTOM":
+            y = y1 - height
+        else:
+            y = y0
+        for line in lines:
+            width = draw.textlength(line, font=font)
+            if obj.attrs["halign"] == "CENTER":
+                x = x0 + (x1 - x0 - width) / 2
+            elif obj.attrs["halign"] == "RIGHT":
+                x = x1 - width
+            else:
+                x = x0
+            draw.text((x, y), line, fill=0, font=font)
+            y += step
+
+    def qr_image(self, text: str) -> Image.Image:
+        obj = self.qr_obj
+        # Matriz em cache por link (qr_store): reimpressao nao refaz o QR
+        matrix = qr_matrix(text, obj.attrs["ecc"], 4 if obj.attrs["margin"] else 0)
+        modules = len(matrix)
+        x0, y0, x1, y1 = self.box(obj)
+        # Modulo inteiro em pixels (QR nitido); o P-touch tambem ajusta o QR a caixa
+        scale = max(1, min(x1 - x0, y1 - y0) // modules)
+        return matrix_image(matrix, scale)
+
+    def render(self, qr_text: str, text_value: str | None = None) -> Image.Image:
+        image = self.background.copy()
+        if qr_text:
+            code = self.qr_image(qr_text)
+            image.paste(code, self.box(self.qr_obj)[:2])
+        if self.text_obj is not None:
+            text = self.text_obj.attrs["data"] if text_value is None else text_value
+            self._draw_text(ImageDraw.Draw(image), self.text_obj, text)
+        return image.convert("1", dither=Image.NONE)
+
+
+_renderers: dict[tuple, LabelRenderer] = {}
+
+
+def get_renderer(path: str = DEFAULT_TEMPLATE, dpi: int = PRINTER_DPI,
+                 qr_field: str = "qr", text_field: str | None = "Texto3") -> LabelRenderer:
+    """Renderer em cache por template; refeito se o .lbx mudar no disco."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (path, dpi, qr_field, text_field)
+    renderer = _renderers.get(key)
+    stamp = (st.st_mtime_ns, st.st_size)
+    if renderer is None or getattr(renderer, "_stamp", None) != stamp:
+        renderer = LabelRenderer.from_file(path, dpi=dpi, qr_field=qr_field, text_field=text_field)
+        renderer._stamp = stamp
+        _renderers[key] = renderer
+    return renderer
+
+
+def benchmark(path: str, n: int, dpi: int):
+    t0 = time.perf_counter()
+    renderer = LabelRenderer.from_file(path, dpi=dpi)
+    setup = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for i in range(n):
+        mac = f"00:4B:12:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}"
+        renderer.render(f"https://app.auvo.com.br/equipamento/{mac.replace(':', '')}", f"MAC:{mac}\nSSID: RCD-{mac[-8:]}")
+    per_label = (time.perf_counter() - t0) / n
+    print(f"Template: {path} ({renderer.size[0]}x{renderer.size[1]} px @ {dpi} dpi)")
+    print(f"  carga + fundo estatico: {setup * 1000:8.1f} ms (uma vez)")
+    print(f"  por etiqueta          : {per_label * 1000:8.2f} ms ({n} etiquetas)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Renderizador nativo do template LBX.")
+    parser.add_argument("command", choices=["render", "bench"])
+    parser.add_argument("--lbx", default=DEFAULT_TEMPLATE)
+    parser.add_argument("--dpi", type=int, default=PRINTER_DPI)
+    parser.add_argument("--qr", default="https://app.auvo.com.br/")
+    parser.add_argument("--text", help="texto do campo Texto3 (\\n quebra a linha)")
+    parser.add_argument("--out", default="etiqueta.png")
+    parser.add_argument("--n", type=int, default=200, help="bench: numero de etiquetas")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        benchmark(args.lbx, args.n, args.dpi)
+    else:
+        text = args.text.replace("\\n", "\n") if args.text else None
+        LabelRenderer.from_file(args.lbx, dpi=args.dpi).render(args.qr, text).save(args.out, dpi=(args.dpi, args.dpi))
+        print(f"Etiqueta salva em {args.out}")
+    sys.exit(0)
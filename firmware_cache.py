@@ -0,0 +1,242 @@
+# firmware_cache.py
+# Cache em memoria do firmware final decriptado.
+#
+# O .enc e decriptado e validado uma unica vez (na partida da estacao) e o
+# texto claro fica em memoria, ja dividido em segmentos para a gravacao
+# esparsa; nada e escrito em disco. O SHA-256 do .enc e conferido a cada uso:
+# se o arquivo mudar, o cache e refeito automaticamente.
+#
+# Com lock_memory=True o buffer e travado na RAM (VirtualLock/mlock) para nao
+# ir para o swap, e e zerado ao fechar. Os payloads comprimidos da gravacao
+# (``payloads``) seguem a mesma regra e sao descartados quando o .enc muda.
+
+from __future__ import annotations
+
+import ctypes
+import hashlib
+import os
+import struct
+import sys
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from gravacao import PayloadCache
+
+from particoes import (
+    PARTITION_TABLE_SIZE,
+    TYPE_APP,
+    find_partition_table,
+    parse_partition_table,
+    split_image_segments,
+)
+
+BOOTLOADER_OFFSET = 0x1000
+ESP_IMAGE_MAGIC = 0xE9
+# Cabecalho de app: magic, segmentos, flash mode, tamanho/freq, entry + 16 bytes estendidos
+_APP_HEADER = struct.Struct("<BBBBI")
+_APP_HEADER_SIZE = _APP_HEADER.size + 16
+_SEGMENT_HEADER = struct.Struct("<II")
+MAX_APP_SEGMENTS = 16
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def decrypt_into(enc_path: str, key: bytes, iv: bytes, out: bytearray) -> int:
+    """Decripta o .enc (AES-256-CBC sem padding) direto no buffer ``out``."""
+    size = os.path.getsize(enc_path)
+    if size == 0 or size % 16 != 0:
+        raise ValueError(
+            f"Tamanho invalido do arquivo cifrado ({size} bytes). "
+            "O arquivo deve ser multiplo de 16 para AES-CBC sem padding."
+        )
+    if len(out) < size:
+        raise ValueError("Buffer menor que o firmware cifrado.")
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    pos = 0
+    with open(enc_path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(64 * 1024), b""):
+            plain = decryptor.update(chunk)
+            out[pos:pos + len(plain)] = plain
+            pos += len(plain)
+        tail = decryptor.finalize()
+        out[pos:pos + len(tail)] = tail
+        pos += len(tail)
+    return pos
+
+
+def _check_app_image(image, offset: int, name: str):
+    """Confere cabecalho, segmentos e SHA-256 anexado de uma app, no lugar.
+
+    Mesmas checagens do ESP32FirmwareImage do esptool, mas sobre um
+    memoryview: o esptool copiaria cada segmento (texto claro) para o heap.
+    """
+    view = memoryview(image)[offset:]
+
+    def invalid(reason: str):
+        return ValueError(f"Imagem '{name}' invalida em 0x{offset:x}: {reason}")
+
+    if len(view) < _APP_HEADER_SIZE:
+        raise invalid("cabecalho truncado")
+    magic, segments, _, _, _ = _APP_HEADER.unpack_from(view, 0)
+    if magic != ESP_IMAGE_MAGIC:
+        raise invalid(f"byte magico 0x{magic:02x}")
+    if segments > MAX_APP_SEGMENTS:
+        raise invalid(f"{segments} segmentos (maximo {MAX_APP_SEGMENTS})")
+    append_digest = view[_APP_HEADER_SIZE - 1]
+    if append_digest not in (0, 1):
+        raise invalid(f"campo append_digest 0x{append_digest:02x}")
+    pos = _APP_HEADER_SIZE
+    for _ in range(segments):
+        if pos + _SEGMENT_HEADER.size > len(view):
+            raise invalid("segmento truncado")
+        _, length = _SEGMENT_HEADER.unpack_from(view, pos)
+        pos += _SEGMENT_HEADER.size + length
+    # Checksum no ultimo byte do bloco de 16 seguinte; o SHA-256 cobre tudo ate ele
+    end = (pos | 15) + 1
+    if end > len(view):
+        raise invalid("segmento truncado")
+    if append_digest:
+        stored = view[end:end + 32]
+        if len(stored) != 32 or hashlib.sha256(view[:end]).digest() != stored:
+            raise ValueError(f"SHA-256 da imagem '{name}' em 0x{offset:x} nao confere.")
+
+
+def validate_combined_image(image):
+    """Validacao completa da imagem combinada decriptada.
+
+    Confere o byte magico e o checksum/SHA-256 do bootloader, a tabela de
+    particoes (incluindo o MD5 gravado nela) e cada app presente na imagem.
+    """
+    if len(image) <= BOOTLOADER_OFFSET or image[BOOTLOADER_OFFSET] != ESP_IMAGE_MAGIC:
+        raise ValueError(
+            "Arquivo decriptado invalido: byte magico 0xE9 nao encontrado no offset do bootloader."
+        )
+    _check_app_image(image, BOOTLOADER_OFFSET, "bootloader")
+
+    table_offset = find_partition_table(image)
+    # memoryview: a tabela e conferida no buffer travado, sem copia
+    table = memoryview(image)[table_offset:table_offset + PARTITION_TABLE_SIZE]
+    partitions = parse_partition_table(table)
+    md5_pos = len(partitions) * 32
+    if table[md5_pos:md5_pos + 2] == b"\xEB\xEB":
+        if hashlib.md5(table[:md5_pos]).digest() != table[md5_pos + 16:md5_pos + 32]:
+            raise ValueError("MD5 da tabela de particoes nao confere.")
+
+    apps = 0
+    for p in partitions:
+        if p.type == TYPE_APP and p.offset < len(image) and image[p.offset] == ESP_IMAGE_MAGIC:
+            _check_app_image(image, p.offset, p.label)
+            apps += 1
+    if not apps:
+        raise ValueError("Nenhuma aplicacao encontrada na imagem combinada.")
+
+
+class _LockedBuffer:
+    def __init__(self, size: int, lock: bool):
+        self.data = bytearray(size)
+        self.locked = False
+        if lock and size:
+            self.locked = self._lock()
+
+    def _address(self):
+        return ctypes.addressof((ctypes.c_char * len(self.data)).from_buffer(self.data))
+
+    def _lock(self) -> bool:
+        size = len(self.data)
+        try:
+            if os.name == "nt":
+                kernel32 = ctypes.windll.kernel32
+                # O working set minimo padrao e pequeno demais para travar 4 MB
+                proc = kernel32.GetCurrentProcess()
+                min_ws, max_ws = ctypes.c_size_t(), ctypes.c_size_t()
+                kernel32.GetProcessWorkingSetSize(proc, ctypes.byref(min_ws), ctypes.byref(max_ws))
+                kernel32.SetProcessWorkingSetSize(
+                    proc, ctypes.c_size_t(min_ws.value + 2 * size), ctypes.c_size_t(max_ws.value + 2 * size)
+                )
+                return bool(kernel32.VirtualLock(ctypes.c_void_p(self._address()), ctypes.c_size_t(size)))
+            libc = ctypes.CDLL(None, use_errno=True)
+            return libc.mlock(ctypes.c_void_p(self._address()), ctypes.c_size_t(size)) == 0
+        except (AttributeError, OSError):
+            return False
+
+    def wipe(self):
+        size = len(self.data)
+        self.data[:] = bytes(size)
+        if self.locked:
+            try:
+                if os.name == "nt":
+                    ctypes.windll.kernel32.VirtualUnlock(ctypes.c_void_p(self._address()), ctypes.c_size_t(size))
+                else:
+                    ctypes.CDLL(None).munlock(ctypes.c_void_p(self._address()), ctypes.c_size_t(size))
+            except (AttributeError, OSError):
+                pass
+            self.locked = False
+
+
+class FinalFirmwareCache:
+    def __init__(self, enc_path: str, key: bytes, iv: bytes, lock_memory: bool = False):
+        self.enc_path = enc_path
+        self.key = key
+        self.iv = iv
+        self.lock_memory = lock_memory
+        self.sha256 = None
+        self.sparse = None
+        self._buffer = None
+        # Texto claro comprimido: fora do PAYLOAD_CACHE global, travado e zerado com o cache
+        self.payloads = PayloadCache(buffer_factory=self._locked_buffer)
+
+    def _locked_buffer(self, size: int) -> _LockedBuffer:
+        return _LockedBuffer(size, self.lock_memory)
+
+    def get(self):
+        """Devolve a imagem esparsa (particoes.SparseImage) pronta para gravar."""
+        sha = file_sha256(self.enc_path)
+        if sha != self.sha256 or self.sparse is None:
+            if self.sha256 is not None:
+                print("Firmware final mudou no disco (SHA-256 diferente); recarregando o cache.")
+            self._load(sha)
+        return self.sparse
+
+    def _load(self, sha: str):
+        self.close()
+        print(f"Decriptando firmware final de {self.enc_path} ...")
+        buffer = _LockedBuffer(os.path.getsize(self.enc_path), self.lock_memory)
+        if self.lock_memory and not buffer.locked:
+            print("Aviso: nao foi possivel travar o firmware na RAM; seguindo sem lock.")
+        try:
+            size = decrypt_into(self.enc_path, self.key, self.iv, buffer.data)
+            # memoryview: os segmentos apontam para o buffer, sem copias do texto claro
+            image = memoryview(buffer.data)[:size]
+            validate_combined_image(image)
+            sparse = split_image_segments(image)
+        except Exception:
+            buffer.wipe()
+            raise
+        self._buffer = buffer
+        self.sparse = sparse
+        self.sha256 = sha
+        print(f"Firmware final validado e em cache (sha256 {sha[:16]}..., {size} bytes).")
+
+    def close(self):
+        self.sparse = None
+        self.sha256 = None
+        self.payloads.clear()
+        if self._buffer is not None:
+            self._buffer.wipe()
+            self._buffer = None
+
+
+if __name__ == "__main__":
+    # Validacao manual: python firmware_cache.py [<arquivo.enc>]
+    import teste
+
+    path = sys.argv[1] if len(sys.argv) > 1 else teste.FINAL_FIRMWARE_ENC_PATH
+    cache = FinalFirmwareCache(path, teste.ENCRYPTION_KEY, teste.ENCRYPTION_IV, lock_memory=True)
+    sparse = cache.get()
+    print(f"{len(sparse.segments)} segmentos, {sparse.data_size} bytes de dados.")
+    cache.close()
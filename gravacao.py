@@ -0,0 +1,771 @@
+# gravacao.py
+# Motor de gravacao com uma unica conexao esptool (ROM + stub) por DUT.
+#
+# O fluxo antigo chamava esptool.main() para erase_flash, write_flash, run e a
+# gravacao final; cada chamada resetava o chip, sincronizava a ROM, detectava o
+# chip, subia o stub e renegociava o baud. Aqui a porta e o stub ficam abertos
+# durante todo o ciclo do DUT e as operacoes usam o ESPLoader diretamente.
+#
+# Uso (teste.py):
+#   session = FlashSession("COM4")
+#   session.connect()
+#   session.erase_flash()
+#   session.write_files([(0x1000, "build/bootloader/bootloader.bin"), ...])
+#   ser = session.run_app()          # mesma porta, ja em 115200 para o monitor
+#   ...
+#   session.enter_bootloader()       # volta para a ROM e recarrega o stub
+#   session.write_images([(0x0, imagem)])
+#   session.close()
+#   session.print_report()
+#
+# As imagens comprimidas ficam em um cache por conteudo (SHA-256 + nivel de
+# compressao): o zlib roda uma vez por imagem, nao uma vez por DUT. O firmware
+# final decriptado nao entra no PAYLOAD_CACHE: o FinalFirmwareCache tem o seu
+# PayloadCache, com os comprimidos em buffers travados e zerados junto com ele.
+# Com diff=True cada regiao e comparada pelo MD5 calculado no chip antes de
+# gravar: o que ja esta igual (retrabalho/reteste) nao e transmitido.
+# Com uma escada de baud (ladder) a sessao tenta do degrau mais alto para o
+# mais baixo, valida cada um com uma leitura conferida por MD5 e guarda o
+# maior baud estavel por porta em um arquivo de estado (BaudMemory); o proximo
+# DUT ja comeca dali. Falha de escrita desce um degrau e tenta de novo; o
+# degrau menor so e salvo se a leitura de teste confirmar o problema. Depois
+# de BAUD_PROMOTE_AFTER ciclos limpos (ou BAUD_PROMOTE_TIMEOUT) a porta tenta
+# de novo um degrau acima.
+# Benchmark dos niveis de compressao (tempo de CPU x tempo no fio):
+#   python gravacao.py bench [--baud 460800 921600] [--final]
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+import esptool
+from esptool.loader import DEFAULT_TIMEOUT, ERASE_WRITE_TIMEOUT_PER_MB, timeout_per_mb
+from esptool.util import flash_size_bytes
+
+from metricas import TRACER
+
+ROM_BAUD = 115200
+DEFAULT_FLASH_BAUD = 460800
+BAUD_LADDER = (2000000, 1500000, 921600, 460800, 115200)
+# Leitura usada para validar cada degrau (vai e volta pela UART, conferida pelo MD5 do chip)
+BAUD_PROBE_SIZE = 0x1000
+# Porta rebaixada volta a tentar um degrau acima depois de N ciclos limpos ou deste tempo (s)
+BAUD_PROMOTE_AFTER = 20
+BAUD_PROMOTE_TIMEOUT = 4 * 3600
+FLASH_SIZE = "8MB"
+COMPRESS_LEVEL = 9
+STUB_FLASH_WRITE_SIZE = 0x4000
+# Granularidade do modo diff: imagens maiores sao comparadas em pedacos deste tamanho
+DIFF_CHUNK_SIZE = 0x10000
+# Pedaco de entrada do zlib.compressobj nos payloads travados (texto claro em memoria protegida)
+COMPRESS_CHUNK = 0x10000
+# Overhead por bloco no fio: delimitadores SLIP + cabecalho do comando + cabecalho de dados
+BLOCK_WIRE_OVERHEAD = 2 + 8 + 16
+
+
+class CompressedPayload:
+    def __init__(self, data: bytes, size: int, md5: str, level: int, compress_time: float):
+        self.data = data
+        self.size = size  # tamanho descomprimido (ja com padding de 4 bytes)
+        self.md5 = md5
+        self.level = level
+        self.compress_time = compress_time
+        self.buffer = None  # buffer travado de um payload fora do cache (PayloadCache.compress)
+        self._block_sizes: dict[int, list[int]] = {}
+
+    def wipe(self):
+        if self.buffer is not None:
+            self.buffer.wipe()
+            self.buffer = None
+
+    def block_sizes(self, block_size: int) -> list[int]:
+        # Bytes descomprimidos por bloco, usados no timeout de cada bloco
+        sizes = self._block_sizes.get(block_size)
+        if sizes is None:
+            decompress = zlib.decompressobj()
+            sizes = [
+                len(decompress.decompress(self.data[pos:pos + block_size]))
+                for pos in range(0, len(self.data), block_size)
+            ]
+            self._block_sizes[block_size] = sizes
+        return sizes
+
+
+class PayloadCache:
+    """Cache de payloads comprimidos, enderecado por SHA-256 da imagem + nivel.
+
+    ``buffer_factory(tamanho)`` (opcional) devolve um buffer zerado com
+    ``.data`` (bytearray) e ``.wipe()``: o padding e a compressao (zlib em
+    pedacos) escrevem direto nesses buffers, sem copias inteiras no heap, e
+    ``clear()`` os zera. Usado para texto claro (firmware final decriptado).
+    """
+
+    def __init__(self, level: int = COMPRESS_LEVEL, buffer_factory=None):
+        self.level = level
+        self.hits = 0
+        self.misses = 0
+        self.buffer_factory = buffer_factory
+        self._payloads: dict[tuple[str, int], CompressedPayload] = {}
+        self._buffers = []
+        self._lock = threading.Lock()
+
+    def get(self, image, level: int | None = None) -> CompressedPayload:
+        level = self.level if level is None else level
+        padded = self._pad_locked(image)
+        image = memoryview(padded.data) if padded is not None else _pad_to(image, 4)
+        try:
+            key = (hashlib.sha256(image).hexdigest(), level)
+            with self._lock:
+                payload = self._payloads.get(key)
+                if payload is not None:
+                    self.hits += 1
+                    return payload
+                self.misses += 1
+                payload = self._compress(image, level)
+                self._payloads[key] = payload
+                return payload
+        finally:
+            if padded is not None:
+                padded.wipe()
+
+    def compress(self, image, level: int | None = None) -> CompressedPayload:
+        """Comprime sem guardar no cache (faixas do modo diff, que mudam a cada DUT).
+
+        Com buffer_factory, chame ``payload.wipe()`` depois de gravar.
+        """
+        level = self.level if level is None else level
+        padded = self._pad_locked(image)
+        try:
+            return self._compress(memoryview(padded.data) if padded is not None else _pad_to(image, 4),
+                                  level, keep=False)
+        finally:
+            if padded is not None:
+                padded.wipe()
+
+    def _pad_locked(self, image):
+        # Com buffer_factory o padding (raro: segmentos ja vem alinhados) vai para um buffer travado
+        if self.buffer_factory is None or len(image) % 4 == 0:
+            return None
+        size = len(image)
+        padded = self.buffer_factory(size + (-size) % 4)
+        padded.data[:size] = image
+        padded.data[size:] = b"\xFF" * (len(padded.data) - size)
+        return padded
+
+    def _compress(self, image, level: int, keep: bool = True) -> CompressedPayload:
+        t0 = time.monotonic()
+        buffer = None
+        if self.buffer_factory is None:
+            data = zlib.compress(image, level)
+        else:
+            buffer = self._compress_locked(image, level)
+            if keep:
+                self._buffers.append(buffer)
+            data = memoryview(buffer.data)
+        payload = CompressedPayload(
+            data, len(image), hashlib.md5(image).hexdigest(), level, time.monotonic() - t0
+        )
+        if not keep:
+            payload.buffer = buffer
+        payload.block_sizes(STUB_FLASH_WRITE_SIZE)
+        return payload
+
+    def _compress_locked(self, image, level: int):
+        # compressobj em pedacos, com a saida escrita direto em um buffer do tamanho
+        # maximo (compressBound do zlib); depois vai para um do tamanho exato e o
+        # primeiro e zerado. Nenhuma copia inteira fica no heap.
+        size = len(image)
+        scratch = self.buffer_factory(size + (size >> 12) + (size >> 14) + (size >> 25) + 64)
+        try:
+            out = scratch.data
+            pos = 0
+            compressor = zlib.compressobj(level)
+            view = memoryview(image)
+            for start in range(0, size, COMPRESS_CHUNK):
+                pos = _write_at(out, pos, compressor.compress(view[start:start + COMPRESS_CHUNK]))
+            pos = _write_at(out, pos, compressor.flush())
+            buffer = self.buffer_factory(pos)
+            buffer.data[:] = memoryview(out)[:pos]
+            return buffer
+        finally:
+            scratch.wipe()
+
+    def warm(self, images) -> float:
+        """Comprime antecipadamente (na partida); devolve o tempo gasto."""
+        t0 = time.monotonic()
+        for _, image in images:
+            self.get(image)
+        return time.monotonic() - t0
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+            for buffer in self._buffers:
+                buffer.wipe()
+            self._buffers.clear()
+
+
+PAYLOAD_CACHE = PayloadCache()
+
+
+class BaudMemory:
+    """Maior baud estavel por porta/fixture, persistido em JSON.
+
+    Cada porta guarda ``{"baud", "clean", "since"}``: o degrau atual, quantos
+    ciclos limpos ja rodaram nele e desde quando. O arquivo e compartilhado
+    pelos workers da estacao; toda atualizacao relê e grava sob um lock de
+    arquivo (``<estado>.lock``).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _entry(value) -> dict | None:
+        if not value:
+            return None
+        if not isinstance(value, dict):
+            # Formato antigo: so o baud
+            return {"baud": int(value), "clean": 0, "since": 0.0}
+        return {"baud": int(value["baud"]), "clean": int(value.get("clean", 0)),
+                "since": float(value.get("since", 0.0))}
+
+    def get(self, key: str) -> dict | None:
+        return self._entry(self._load().get(key))
+
+    def update(self, key: str, change) -> dict | None:
+        """Le, aplica ``change(entrada ou None)`` e grava, tudo sob o lock."""
+        with self._locked():
+            state = self._load()
+            entry = change(self._entry(state.get(key)))
+            if entry is None or entry == self._entry(state.get(key)):
+                return entry
+            state[key] = entry
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+            return entry
+
+    def set(self, key: str, baud: int):
+        self.update(key, lambda _: {"baud": baud, "clean": 0, "since": time.time()})
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a+b") as f:
+            if os.name == "nt":
+                import msvcrt
+
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.05)
+                try:
+                    yield
+                finally:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class FlashSession:
+    def __init__(
+        self,
+        port: str,
+        baud: int = DEFAULT_FLASH_BAUD,
+        flash_size: str = FLASH_SIZE,
+        payloads: PayloadCache | None = None,
+        diff: bool = False,
+        ladder: tuple[int, ...] | None = None,
+        baud_memory: BaudMemory | None = None,
+    ):
+        self.port = port
+        self.diff = diff
+        self.ladder = tuple(sorted(ladder, reverse=True)) if ladder else None
+        self.baud_memory = baud_memory
+        # Degrau mais alto que ainda vale a pena tentar nesta porta
+        self._baud_ceiling = None
+        self._saved_baud = None  # degrau no BaudMemory (None: porta nova)
+        self._promoting = False  # esta sessao tenta um degrau acima do salvo
+        self._link_clean = True  # nenhuma falha de escrita nesta sessao
+        self._negotiated = False
+        if self.ladder:
+            self._baud_ceiling = self._initial_ceiling(baud_memory.get(port) if baud_memory else None)
+        self.payloads = payloads if payloads is not None else PAYLOAD_CACHE
+        self.baud = baud
+        self.flash_size = flash_size
+        self.rom = None  # loader da ROM (mantem a porta serial aberta)
+        self.esp = None  # loader do stub, valido enquanto o chip estiver no bootloader
+        self.setup_time = None  # custo de um connect + stub + troca de baud
+        self.stage_times: dict[str, float] = {}
+        self.saved_times: dict[str, float] = {}
+        self.bytes_sent = 0
+        self.bytes_skipped = 0
+        self.mac = None  # MAC base do eFuse, lido no connect
+        self._fresh_connection = False
+
+    # ---- conexao -----------------------------------------------------------
+
+    def connect(self):
+        t0 = time.monotonic()
+        self.rom = esptool.cmds.detect_chip(self.port, ROM_BAUD, "default_reset")
+        self._load_stub()
+        # Duas leituras de registrador: identifica o DUT antes de qualquer erase
+        self.mac = ":".join(f"{b:02X}" for b in self.esp.read_mac())
+        self.setup_time = time.monotonic() - t0
+        self._add_time("connect", self.setup_time)
+
+    def enter_bootloader(self):
+        # Depois que o app rodou o stub foi perdido: reseta para a ROM na mesma porta
+        if self.esp is not None:
+            return
+        t0 = time.monotonic()
+        if self.rom is None:
+            self.rom = esptool.cmds.detect_chip(self.port, ROM_BAUD, "default_reset")
+        else:
+            self.rom._set_port_baudrate(ROM_BAUD)
+            self.rom.connect("default_reset")
+        self._load_stub()
+        self._add_time("reconnect", time.monotonic() - t0)
+
+    def _load_stub(self):
+        esp = self.rom.run_stub()
+        esp.flash_set_parameters(flash_size_bytes(self.flash_size))
+        if self.ladder:
+            esp = self._negotiate_baud(esp)
+        elif self.baud > ROM_BAUD:
+            esp.change_baud(self.baud)
+        self.esp = esp
+        self._fresh_connection = True
+
+    def _initial_ceiling(self, entry: dict | None) -> int:
+        if entry is None:
+            return self.ladder[0]
+        self._saved_baud = entry["baud"]
+        higher = [b for b in self.ladder if b > entry["baud"]]
+        due = (entry["clean"] >= BAUD_PROMOTE_AFTER
+               or time.time() - entry["since"] >= BAUD_PROMOTE_TIMEOUT)
+        if higher and due:
+            self._promoting = True
+            print(f"{self.port}: {entry['clean']} ciclo(s) limpo(s) em {entry['baud']} baud; "
+                  f"tentando {higher[-1]} de novo.")
+            return higher[-1]
+        return entry["baud"]
+
+    def _negotiate_baud(self, esp):
+        landed = ROM_BAUD
+        for baud in self.ladder:
+            if baud > self._baud_ceiling:
+                continue
+            if baud <= ROM_BAUD:
+                break
+            ok, esp = self._try_baud(esp, baud)
+            if ok:
+                landed = baud
+                break
+            print(f"Baud {baud} instavel em {self.port}; descendo um degrau.")
+        self.baud = landed
+        self._baud_ceiling = landed
+        # So a leitura de teste decide o que fica salvo: degrau confirmado
+        # abaixo do salvo, promocao aceita, ou promocao recusada (zera a contagem)
+        if landed != self._saved_baud or self._promoting:
+            self._save_baud(landed)
+        self._promoting = False
+        self._negotiated = True
+        return esp
+
+    def _try_baud(self, esp, baud: int):
+        """Sobe o stub para ``baud`` e valida com a leitura de teste.
+
+        Devolve (ok, esp); se falhar, ``esp`` e um stub novo em 115200.
+        """
+        try:
+            esp.change_baud(baud)
+            self._probe_link(esp)
+            return True, esp
+        except Exception as e:
+            print(f"Leitura de teste falhou em {baud} baud ({e}).")
+            # O stub ficou no baud novo: volta para a ROM e recarrega
+            self.rom._set_port_baudrate(ROM_BAUD)
+            self.rom.connect("default_reset")
+            esp = self.rom.run_stub()
+            esp.flash_set_parameters(flash_size_bytes(self.flash_size))
+            return False, esp
+
+    def _probe_link(self, esp):
+        data = esp.read_flash(0, BAUD_PROBE_SIZE)
+        if hashlib.md5(data).hexdigest() != esp.flash_md5sum(0, BAUD_PROBE_SIZE):
+            raise esptool.FatalError("leitura de teste corrompida")
+
+    def _save_baud(self, baud: int):
+        self._saved_baud = baud
+        if self.baud_memory is not None:
+            self.baud_memory.set(self.port, baud)
+
+    def _count_clean_cycle(self):
+        baud = self.baud
+
+        def change(entry):
+            if entry is None or entry["baud"] != baud:
+                return entry
+            return dict(entry, clean=entry["clean"] + 1)
+
+        self.baud_memory.update(self.port, change)
+
+    def step_down(self):
+        """Desce um degrau da escada (ou para 115200 sem escada) e reconecta.
+
+        Com escada, o degrau que falhou passa antes pela leitura de teste: so
+        se ela tambem falhar o degrau menor e salvo para os proximos DUTs;
+        senao a descida vale so para esta sessao.
+        """
+        failed = self.baud
+        lower = [b for b in (self.ladder or ()) if b < failed]
+        baud = lower[0] if lower else ROM_BAUD
+        print(f"Reduzindo baud de {self.port}: {failed} -> {baud}.")
+        self._link_clean = False
+        if not self.ladder:
+            # Estado do stub e incerto depois de uma falha: volta para a ROM e sobe o stub de novo
+            self.baud = baud
+            self.esp = None
+            self.enter_bootloader()
+            return
+        t0 = time.monotonic()
+        self.esp = None
+        self.rom._set_port_baudrate(ROM_BAUD)
+        self.rom.connect("default_reset")
+        esp = self.rom.run_stub()
+        esp.flash_set_parameters(flash_size_bytes(self.flash_size))
+        ok, esp = self._try_baud(esp, failed)
+        if ok:
+            print(f"Leitura de teste ok em {failed} baud; erro tratado como transitorio.")
+        else:
+            self._save_baud(baud)
+        if baud > ROM_BAUD:
+            esp.change_baud(baud)
+        self.baud = baud
+        self._baud_ceiling = baud
+        self.esp = esp
+        self._fresh_connection = True
+        self._add_time("reconnect", time.monotonic() - t0)
+
+    @property
+    def serial(self):
+        return self.rom._port if self.rom is not None else None
+
+    def close(self):
+        if self.baud_memory is not None and self._negotiated and self._link_clean:
+            self._count_clean_cycle()
+        self._negotiated = False
+        if self.rom is not None:
+            try:
+                self.rom._port.close()
+            except Exception:
+                pass
+        self.rom = None
+        self.esp = None
+
+    # ---- operacoes ---------------------------------------------------------
+
+    def erase_flash(self):
+        t0 = time.monotonic()
+        print("Erasing flash (this may take a while)...")
+        self._stub().erase_flash()
+        self._op_done("erase", t0)
+
+    def erase_regions(self, regions: list[tuple[int, int]], skip_blank: bool = True, stage: str = "erase"):
+        """Apaga so as regioes indicadas (alinhadas a setor).
+
+        Com ``skip_blank`` o MD5 da regiao e calculado no chip primeiro e regioes
+        que ja estao em 0xFF (DUT novo) nao sao apagadas.
+        """
+        t0 = time.monotonic()
+        esp = self._stub()
+        erased = skipped = 0
+        for offset, size in regions:
+            if skip_blank and esp.flash_md5sum(offset, size) == _blank_md5(size):
+                skipped += size
+                continue
+            print(f"Erasing region 0x{offset:08x} - 0x{offset + size:08x}...")
+            with TRACER.span("erase_region", "esptool", offset=f"0x{offset:08x}", size=size):
+                esp.erase_region(offset, size)
+            erased += size
+        print(f"Erase por regiao: {erased // 1024} KB apagados, {skipped // 1024} KB ja vazios.")
+        self._op_done(stage, t0)
+
+    def write_files(self, addr_files: list[tuple[int, str]], stage: str = "write"):
+        self.write_images(read_files(addr_files), stage=stage)
+
+    def write_images(
+        self,
+        images: list[tuple[int, bytes]],
+        stage: str = "write",
+        diff: bool | None = None,
+        retry: bool = True,
+        payloads: PayloadCache | None = None,
+    ):
+        # Aceita bytes ou memoryview (segmentos do cache do firmware final)
+        t0 = time.monotonic()
+        try:
+            esp = self._stub()
+            payloads = self.payloads if payloads is None else payloads
+            pending = [(address, image, True) for address, image in images]
+            skipped = 0
+            if self.diff if diff is None else diff:
+                pending, skipped = self._changed_regions(esp, images)
+            for address, image, cache in pending:
+                self._write_compressed(esp, address, image, payloads, cache=cache)
+            # O stub so confirma o ultimo bloco depois de grava-lo; operacao final forca a espera
+            esp.read_reg(esptool.loader.ESPLoader.CHIP_DETECT_MAGIC_REG_ADDR)
+            # So a tentativa que terminou conta (a repeticao apos step_down refaz o diff)
+            self.bytes_skipped += skipped
+        except Exception as e:
+            if not retry or self.baud <= ROM_BAUD:
+                raise
+            print(f"\nErro na gravacao em {self.baud} baud ({e}).")
+            self._add_time(stage, time.monotonic() - t0)
+            self.step_down()
+            # Imagens inteiras estao em cache: repetir custa so o tempo no fio
+            self.write_images(images, stage=stage, diff=diff, retry=False, payloads=payloads)
+            return
+        self._op_done(stage, t0)
+
+    def _write_compressed(self, esp, address: int, image, payloads: PayloadCache, cache: bool = True):
+        payload = payloads.get(image) if cache else payloads.compress(image)
+        try:
+            self._send_payload(esp, address, payload)
+        finally:
+            if not cache:
+                payload.wipe()
+
+    def _send_payload(self, esp, address: int, payload: CompressedPayload):
+        uncsize = payload.size
+        calcmd5 = payload.md5
+        comp = payload.data
+        block_sizes = payload.block_sizes(esp.FLASH_WRITE_SIZE)
+        t_begin = time.monotonic()
+        with TRACER.span("flash_defl_begin", "esptool", address=f"0x{address:08x}"):
+            blocks = esp.flash_defl_begin(uncsize, len(comp), address)
+        t = time.monotonic()
+        timeout = DEFAULT_TIMEOUT
+        for seq in range(blocks):
+            block = comp[seq * esp.FLASH_WRITE_SIZE:(seq + 1) * esp.FLASH_WRITE_SIZE]
+            print(f"\rWriting at 0x{address:08x}... ({100 * (seq + 1) // blocks} %)", end="")
+            sys.stdout.flush()
+            block_uncompressed = block_sizes[seq]
+            with TRACER.span("bloco", "esptool", seq=seq, bytes=len(block)):
+                esp.flash_defl_block(block, seq, timeout=timeout)
+            # O stub confirma ao receber e grava enquanto recebe o proximo bloco
+            timeout = max(DEFAULT_TIMEOUT, timeout_per_mb(ERASE_WRITE_TIMEOUT_PER_MB, block_uncompressed))
+        self.bytes_sent += len(comp)
+        elapsed = time.monotonic() - t
+        TRACER.elapsed(f"write 0x{address:08x}", time.monotonic() - t_begin, "esptool",
+                       bytes=uncsize, compressed=len(comp), baud=self.baud)
+        print(f"\rWrote {uncsize} bytes ({len(comp)} compressed) at 0x{address:08x} in {elapsed:.1f} s.")
+        with TRACER.span("flash_md5sum", "esptool", address=f"0x{address:08x}"):
+            res = esp.flash_md5sum(address, uncsize)
+        if res != calcmd5:
+            raise esptool.FatalError(
+                f"MD5 da flash nao confere em 0x{address:08x}: esperado {calcmd5}, lido {res}"
+            )
+
+    def _changed_regions(self, esp, images):
+        """Compara cada imagem (em pedacos de DIFF_CHUNK_SIZE) com o MD5 da flash
+        e devolve as faixas diferentes, juntando pedacos vizinhos, e os bytes iguais.
+
+        Cada faixa vai como (endereco, dados, cache): so imagens inteiras usam o
+        cache de payloads; faixas parciais mudam de DUT para DUT e sao
+        comprimidas na hora, sem ficar guardadas.
+        """
+        changed = []
+        skipped = 0
+        for address, image in images:
+            image = _pad_to(image, 4)
+            if esp.flash_md5sum(address, len(image)) == hashlib.md5(image).hexdigest():
+                print(f"0x{address:08x}: {len(image)} bytes ja gravados, pulando.")
+                skipped += len(image)
+                continue
+            run_start = None
+            for pos in range(0, len(image), DIFF_CHUNK_SIZE):
+                chunk = image[pos:pos + DIFF_CHUNK_SIZE]
+                same = len(image) > DIFF_CHUNK_SIZE and (
+                    esp.flash_md5sum(address + pos, len(chunk)) == hashlib.md5(chunk).hexdigest()
+                )
+                if same:
+                    skipped += len(chunk)
+                    if run_start is not None:
+                        changed.append((address + run_start, image[run_start:pos], False))
+                        run_start = None
+                elif run_start is None:
+                    run_start = pos
+            if run_start is not None:
+                changed.append((address + run_start, image[run_start:], run_start == 0))
+        kept = sum(len(image) for _, image, _ in changed)
+        print(f"Gravacao diff: {kept // 1024} KB diferentes, {skipped // 1024} KB iguais.")
+        return changed, skipped
+
+    def run_app(self):
+        """Reinicia o DUT no app gravado e devolve a serial (mesma porta) em 115200.
+
+        A porta fica aberta durante o reset e ja esta em 115200 (com o buffer
+        limpo) antes de soltar o RTS, entao o banner do ROM nao se perde.
+        """
+        t0 = time.monotonic()
+        port = self.rom._port
+        self.rom._set_port_baudrate(ROM_BAUD)
+        port.reset_input_buffer()
+        self.rom.hard_reset()
+        self.esp = None
+        self._op_done("run", t0)
+        return port
+
+    def hard_reset(self):
+        t0 = time.monotonic()
+        self.rom.hard_reset()
+        self.esp = None
+        self._add_time("hard_reset", time.monotonic() - t0)
+
+    def _stub(self):
+        if self.esp is None:
+            self.enter_bootloader()
+        return self.esp
+
+    # ---- tempos ------------------------------------------------------------
+
+    def _add_time(self, stage: str, seconds: float):
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+        TRACER.elapsed(stage, seconds, "esptool", port=self.port, baud=self.baud)
+
+    def _op_done(self, stage: str, t0: float):
+        self._add_time(stage, time.monotonic() - t0)
+        # Cada operacao feita sem nova conexao evita um esptool.main() completo
+        # (reset + sync + deteccao + stub + baud), que custa ~setup_time
+        if not self._fresh_connection and self.setup_time is not None:
+            self.saved_times[stage] = self.saved_times.get(stage, 0.0) + self.setup_time
+        self._fresh_connection = False
+
+    def print_report(self):
+        if not self.stage_times:
+            return
+        print("\n--- Gravacao: tempo por etapa (sessao unica) ---")
+        for stage, seconds in self.stage_times.items():
+            saved = self.saved_times.get(stage)
+            extra = f" | economizado ~{saved:.1f} s" if saved else ""
+            print(f"  {stage:<12} {seconds:6.1f} s{extra}")
+        print(f"  total economizado por unidade: ~{sum(self.saved_times.values()):.1f} s "
+              f"(@ {self.baud} baud, {self.bytes_sent} bytes enviados)")
+        if self.diff:
+            print(f"  diff: {self.bytes_skipped} bytes ja iguais na flash nao foram enviados")
+
+
+def read_files(addr_files: list[tuple[int, str]]) -> list[tuple[int, bytes]]:
+    images = []
+    for address, path in addr_files:
+        with open(path, "rb") as f:
+            images.append((address, f.read()))
+    return images
+
+
+def wire_bytes(payload: bytes, block_size: int = STUB_FLASH_WRITE_SIZE) -> int:
+    # Bytes reais na UART: SLIP escapa 0xC0/0xDB com 2 bytes, mais o overhead por bloco
+    blocks = -(-len(payload) // block_size)
+    escapes = payload.count(b"\xC0") + payload.count(b"\xDB")
+    return len(payload) + escapes + blocks * BLOCK_WIRE_OVERHEAD
+
+
+def benchmark_levels(images, bauds, levels=range(0, 10)):
+    """Mede, por nivel de zlib, tempo de compressao e tempo estimado no fio."""
+    results = []
+    raw = b"".join(bytes(_pad_to(image, 4)) for _, image in images)
+    for level in levels:
+        t0 = time.perf_counter()
+        payloads = [zlib.compress(bytes(_pad_to(image, 4)), level) for _, image in images]
+        compress_time = time.perf_counter() - t0
+        on_wire = sum(wire_bytes(p) for p in payloads)
+        results.append({
+            "level": level,
+            "raw": len(raw),
+            "compressed": sum(len(p) for p in payloads),
+            "compress_s": compress_time,
+            # 8N1: 10 bits por byte
+            "wire_s": {baud: on_wire * 10 / baud for baud in bauds},
+        })
+    return results
+
+
+def print_benchmark(results, bauds):
+    print(f"{'nivel':>5} {'comprimido':>12} {'zlib (s)':>9} " +
+          " ".join(f"{'fio@' + str(b):>12} {'total':>7}" for b in bauds))
+    for r in results:
+        cols = " ".join(f"{r['wire_s'][b]:12.2f} {r['compress_s'] + r['wire_s'][b]:7.2f}" for b in bauds)
+        print(f"{r['level']:>5} {r['compressed']:>12} {r['compress_s']:9.3f} {cols}")
+    for baud in bauds:
+        best = min(results, key=lambda r: r["compress_s"] + r["wire_s"][baud])
+        cached = min(results, key=lambda r: r["wire_s"][baud])
+        print(f"@{baud}: mais rapido sem cache = nivel {best['level']}; "
+              f"com cache (so fio) = nivel {cached['level']}")
+
+
+@functools.lru_cache(maxsize=32)
+def _blank_md5(size: int) -> str:
+    return hashlib.md5(b"\xFF" * size).hexdigest()
+
+
+def _write_at(out: bytearray, pos: int, piece: bytes) -> int:
+    # Escreve sem crescer o bytearray (realocar deixaria a copia antiga fora do lock)
+    if pos + len(piece) > len(out):
+        raise RuntimeError("Saida do zlib maior que o compressBound.")
+    out[pos:pos + len(piece)] = piece
+    return pos + len(piece)
+
+
+def _pad_to(data, alignment: int, pad_character: bytes = b"\xFF"):
+    pad_mod = len(data) % alignment
+    if pad_mod != 0:
+        data = bytes(data) + pad_character * (alignment - pad_mod)
+    return data
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark de compressao das imagens gravadas.")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--baud", type=int, nargs="+", default=[DEFAULT_FLASH_BAUD])
+    parser.add_argument("--final", action="store_true", help="inclui os segmentos do firmware final")
+    args = parser.parse_args()
+
+    import teste
+
+    sets = [("FVT", read_files(teste.FVT_IMAGES))]
+    if args.final:
+        sets.append(("final", teste.get_final_firmware().segments))
+    for name, images in sets:
+        print(f"\n=== {name}: {sum(len(i) for _, i in images)} bytes ===")
+        print_benchmark(benchmark_levels(images, args.baud), args.baud)
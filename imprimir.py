@@ -2,14 +2,27 @@
 # Uso:
 #   LBX + QR (b-PAC):
 #       python imprimir.py --lbx ".\etiqueta.lbx" --qr "https://exemplo.com/ABC" [--printer "QL-800"] [--qr-field qr] [--copies 1]
+#   Lote (reimpressão; StartPrint/EndPrint por trabalho, retoma de onde parou):
+#       python imprimir.py --lbx ".\etiqueta.lbx" --batch lote.csv --text-field Texto3 [--batch-chunk 50] [--restart]
+#   No teste.py o documento b-PAC fica aberto entre etiquetas (LbxSession);
+#   por DUT só o QR/texto são atualizados antes de imprimir.
+#   LBX sem b-PAC (renderizado em Python, impresso pelo spooler):
+#       python imprimir.py --lbx ".\etiqueta.lbx" --qr "..." --text-field Texto3 --text "..." --native
 #   PNG (spooler):
 #       python imprimir.py --png ".\etiqueta.png" [--printer "QL-800"] [--copies 1]
 
 from __future__ import annotations
 
 import argparse
+import atexit
+import csv
+import json
 import os
 import sys
+import threading
+import time
+
+from metricas import TRACER
 
 PRINTER_DEFAULT_MATCH = "QL-800"  # parte do nome da fila da Brother (caso --printer não seja usado)
 
@@ -40,71 +53,396 @@ def pick_printer_win32(preferred: str | None = None) -> str:
                            f"Filas disponíveis: {', '.join(printers) if printers else '(nenhuma)'}")
     return default_p
 
-def print_png(path_png: str, printer_name: str | None, copies: int):
-    try:
-        import win32print, win32ui
-        from PIL import Image, ImageWin
-    except ImportError as e:
-        raise RuntimeError("Dependências faltando para impressão de PNG. Instale no Windows:\n"
-                           "  pip install pywin32 pillow") from e
+# Constantes do GDI
+PHYSICALWIDTH  = 110
+PHYSICALHEIGHT = 111
+HORZRES = 8
+VERTRES = 10
+PHYSICALOFFSETX = 112
+PHYSICALOFFSETY = 113
+# Imagens já preparadas (DIB) guardadas por sessão de impressora
+DIB_CACHE_SIZE = 8
 
-    printer = pick_printer_win32(printer_name)
-    hprinter = win32print.OpenPrinter(printer)
-    try:
+class GdiPrinter:
+    """Fila do spooler aberta uma vez (handle + DC) e reaproveitada entre etiquetas.
+
+    Os device caps são lidos uma vez por impressora; cada imagem é
+    convertida/redimensionada e vira DIB uma única vez, e todas as cópias
+    saem como páginas do mesmo documento. ``times`` acumula o tempo por
+    etapa (decode, resize, dib, spool) para o relatório.
+    """
+
+    def __init__(self, printer_name: str | None = None):
+        self.printer_name = printer_name
+        self.printer = None
+        self.caps = None
+        self.times: dict[str, float] = {}
+        self.jobs = 0
+        self._hprinter = None
+        self._hdc = None
+        self._dibs: dict = {}
+
+    def add_time(self, stage: str, seconds: float):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+        TRACER.elapsed(stage, seconds, "impressao")
+
+    def open(self):
+        try:
+            import win32print, win32ui
+        except ImportError as e:
+            raise RuntimeError("Dependências faltando para impressão de PNG. Instale no Windows:\n"
+                               "  pip install pywin32 pillow") from e
+
+        self.close()
+        t0 = time.monotonic()
+        printer = pick_printer_win32(self.printer_name)
+        self._hprinter = win32print.OpenPrinter(printer)
         hdc = win32ui.CreateDC()
         hdc.CreatePrinterDC(printer)
+        caps = {
+            "phys_width": hdc.GetDeviceCaps(PHYSICALWIDTH),
+            "phys_height": hdc.GetDeviceCaps(PHYSICALHEIGHT),
+            "horz_res": hdc.GetDeviceCaps(HORZRES),
+            "vert_res": hdc.GetDeviceCaps(VERTRES),
+            "offx": hdc.GetDeviceCaps(PHYSICALOFFSETX),
+            "offy": hdc.GetDeviceCaps(PHYSICALOFFSETY),
+        }
+        if caps != self.caps:
+            # Outra impressora/driver: DIBs preparados para a área antiga não servem
+            self._dibs.clear()
+        self.printer, self._hdc, self.caps = printer, hdc, caps
+        self.add_time("open", time.monotonic() - t0)
+
+    def prepare(self, image, key=None):
+        """Converte, redimensiona para a área imprimível e monta o DIB (com cache por ``key``)."""
+        from PIL import Image, ImageWin
+
+        if key is not None and key in self._dibs:
+            return self._dibs[key]
+        if callable(image):
+            # Carregamento adiado: só decodifica quando o DIB não está em cache
+            image = image()
+        caps = self.caps
+        t0 = time.monotonic()
+        img = image.convert("RGB")
+
+        # área imprimível
+        box_w = caps["horz_res"]
+        box_h = caps["vert_res"]
+
+        # Redimensiona preservando aspecto para caber na área imprimível
+        img_ratio = img.width / img.height
+        box_ratio = box_w / box_h
+        if img_ratio > box_ratio:
+            new_w = box_w
+            new_h = int(new_w / img_ratio)
+        else:
+            new_h = box_h
+            new_w = int(new_h * img_ratio)
+        if new_w <= 0 or new_h <= 0:
+            raise RuntimeError("Dimensões de destino inválidas retornadas pelo driver.")
+
+        if (new_w, new_h) != img.size:
+            img = img.resize((new_w, new_h), Image.LANCZOS)
+        t1 = time.monotonic()
+        self.add_time("resize", t1 - t0)
+
+        # Centraliza
+        x = caps["offx"] + (box_w - new_w)//2
+        y = caps["offy"] + (box_h - new_h)//2
+
+        prepared = (ImageWin.Dib(img), (x, y, x + new_w, y + new_h))
+        self.add_time("dib", time.monotonic() - t1)
+        if key is not None:
+            if len(self._dibs) >= DIB_CACHE_SIZE:
+                self._dibs.pop(next(iter(self._dibs)))
+            self._dibs[key] = prepared
+        return prepared
+
+    def print_image(self, image, copies: int = 1, doc_name: str = "etiqueta", key=None) -> dict[str, float]:
+        """Imprime e devolve o tempo por etapa (s) gasto nesta chamada.
+
+        ``image`` é uma imagem PIL ou uma função que a carrega (só chamada
+        se o DIB de ``key`` não estiver em cache).
+        """
+        before = dict(self.times)
+        self._print_image(image, copies, doc_name, key)
+        return {stage: seconds - before.get(stage, 0.0)
+                for stage, seconds in self.times.items() if seconds != before.get(stage, 0.0)}
+
+    def _print_image(self, image, copies: int, doc_name: str, key):
+        if self._hdc is None:
+            self.open()
+        dib, rect = self.prepare(image, key)
+        try:
+            self._spool(dib, rect, copies, doc_name)
+        except Exception as e:
+            # DC inválido (impressora removida/driver reiniciado): reabre e tenta uma vez
+            print(f"Spooler falhou ({e}); reabrindo a impressora.")
+            self.open()
+            dib, rect = self.prepare(image, key)
+            self._spool(dib, rect, copies, doc_name)
+
+    def _spool(self, dib, rect, copies: int, doc_name: str):
+        t0 = time.monotonic()
+        hdc = self._hdc
+        # Uma página por cópia no mesmo documento; o DIB é o mesmo em todas
+        hdc.StartDoc(doc_name)
         for _ in range(max(1, copies)):
-            hdc.StartDoc(path_png)
             hdc.StartPage()
+            dib.draw(hdc.GetHandleOutput(), rect)
+            hdc.EndPage()
+        hdc.EndDoc()
+        self.jobs += 1
+        self.add_time("spool", time.monotonic() - t0)
+
+    def report(self) -> str:
+        return f"{self.jobs} trabalho(s) em '{self.printer}': {format_stage_times(self.times)}"
+
+    def close(self):
+        hdc, hprinter = self._hdc, self._hprinter
+        self._hdc = self._hprinter = None
+        try:
+            if hdc is not None:
+                hdc.DeleteDC()
+            if hprinter is not None:
+                import win32print
+                win32print.ClosePrinter(hprinter)
+        except Exception:
+            pass
+
+def format_stage_times(times: dict[str, float]) -> str:
+    return ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in times.items())
+
+_gdi_printers: dict[tuple, GdiPrinter] = {}
+
+def get_gdi_printer(printer_name: str | None = None) -> GdiPrinter:
+    key = (printer_name, threading.get_ident())
+    printer = _gdi_printers.get(key)
+    if printer is None:
+        printer = _gdi_printers[key] = GdiPrinter(printer_name)
+    return printer
+
+def print_png(path_png: str, printer_name: str | None, copies: int):
+    from PIL import Image
+
+    printer = get_gdi_printer(printer_name)
+    st = os.stat(path_png)
+    key = (os.path.abspath(path_png), st.st_mtime_ns, st.st_size)
+
+    def load():
+        t0 = time.monotonic()
+        img = Image.open(path_png)
+        img.load()
+        printer.add_time("decode", time.monotonic() - t0)
+        return img
+
+    times = printer.print_image(load, copies, doc_name=path_png, key=key)
+    print(f"✅ PNG impresso em '{printer.printer}' ({copies} cópia(s)) | {format_stage_times(times)}")
+
+def print_image(image, printer_name: str | None, copies: int, doc_name: str = "etiqueta"):
+    """Imprime uma imagem PIL pelo spooler (GDI), ajustada à área imprimível."""
+    printer = get_gdi_printer(printer_name)
+    times = printer.print_image(image, copies, doc_name=doc_name)
+    print(f"✅ Imagem impressa em '{printer.printer}' ({copies} cópia(s)) | {format_stage_times(times)}")
+
+def _object_names(bpac) -> list[str]:
+    try:
+        return [bpac.GetObjectByIndex(i).Name for i in range(bpac.ObjectCount)]
+    except Exception:
+        return []
+
+def _missing_object(bpac, kind: str, name: str) -> RuntimeError:
+    names = _object_names(bpac)
+    return RuntimeError(f"Objeto de {kind} '{name}' não encontrado no template.\n"
+                        f"Objetos disponíveis: {', '.join(names) if names else '(não foi possível listar)'}\n"
+                        f"Dica: no P-touch Editor renomeie o {kind} para '{name}'.")
+
+class LbxSession:
+    """Documento b-PAC aberto uma vez e reaproveitado entre etiquetas.
+
+    Abre o template, escolhe a impressora e resolve os objetos (QR e texto)
+    uma única vez; por etiqueta só atualiza os textos e imprime. Se o .lbx
+    mudar no disco ou o b-PAC falhar (COM caiu, driver reiniciado), o
+    documento é reaberto e a impressão repetida uma vez.
+
+    Objetos COM ficam presos à thread que os criou: use a sessão sempre da
+    mesma thread (print_lbx_qr já mantém uma sessão por thread).
+    """
+
+    def __init__(self, path_lbx: str, printer_name: str | None = None,
+                 qr_field: str = "qr", text_field: str | None = None):
+        self.path_lbx = path_lbx
+        self.printer_name = printer_name
+        self.qr_field = qr_field
+        self.text_field = text_field
+        self.printer = None
+        self.opens = 0
+        self._bpac = None
+        self._qr = None
+        self._text = None
+        self._stamp = None
+
+    def _template_stamp(self):
+        st = os.stat(self.path_lbx)
+        return st.st_mtime_ns, st.st_size
+
+    def open(self):
+        try:
+            import win32com.client as win32
+        except ImportError as e:
+            raise RuntimeError("Dependências faltando para b-PAC. Instale no Windows:\n"
+                               "  (instalador oficial do b-PAC SDK) e, se usar Python, pywin32") from e
+
+        self.close()
+        stamp = self._template_stamp()
+        bpac = win32.Dispatch("bpac.Document")
+        ok = bpac.Open(self.path_lbx)
+        if not ok:
+            raise RuntimeError(f"Não abriu o LBX: {self.path_lbx}. Verifique o caminho e se o b-PAC está instalado.")
 
-            img = Image.open(path_png).convert("RGB")
-
-            # Constantes do GDI
-            PHYSICALWIDTH  = 110
-            PHYSICALHEIGHT = 111
-            HORZRES = 8
-            VERTRES = 10
-            PHYSICALOFFSETX = 112
-            PHYSICALOFFSETY = 113
-
-            phys_width  = hdc.GetDeviceCaps(PHYSICALWIDTH)
-            phys_height = hdc.GetDeviceCaps(PHYSICALHEIGHT)
-            horz_res    = hdc.GetDeviceCaps(HORZRES)
-            vert_res    = hdc.GetDeviceCaps(VERTRES)
-            offx        = hdc.GetDeviceCaps(PHYSICALOFFSETX)
-            offy        = hdc.GetDeviceCaps(PHYSICALOFFSETY)
-
-            # área imprimível
-            box_w = horz_res
-            box_h = vert_res
-
-            # Redimensiona preservando aspecto para caber na área imprimível
-            img_ratio = img.width / img.height
-            box_ratio = box_w / box_h
-            if img_ratio > box_ratio:
-                new_w = box_w
-                new_h = int(new_w / img_ratio)
+        # Seleciona a fila (uma vez por sessão)
+        try:
+            if self.printer_name:
+                bpac.Printer.SetPrinter(self.printer_name, True)
+                self.printer = self.printer_name
             else:
-                new_h = box_h
-                new_w = int(new_h * img_ratio)
-            if new_w <= 0 or new_h <= 0:
-                raise RuntimeError("Dimensões de destino inválidas retornadas pelo driver.")
+                # tenta achar QL-800
+                for i in range(bpac.Printer.PrinterCount):
+                    name = bpac.Printer.GetPrinterByIndex(i).Name
+                    if PRINTER_DEFAULT_MATCH.lower() in name.lower():
+                        bpac.Printer.SetPrinter(name, True)
+                        self.printer = name
+                        break
+            # segue com a atual se não achou
+        except Exception:
+            pass
 
-            img = img.resize((new_w, new_h), Image.LANCZOS)
+        # Objeto de QR pelo nome (default: "qr")
+        qr = bpac.GetObject(self.qr_field)
+        if qr is None:
+            raise _missing_object(bpac, "QR", self.qr_field)
+        text_obj = None
+        if self.text_field:
+            text_obj = bpac.GetObject(self.text_field)
+            if text_obj is None:
+                raise _missing_object(bpac, "texto", self.text_field)
 
-            # Centraliza
-            x = offx + (box_w - new_w)//2
-            y = offy + (box_h - new_h)//2
+        self._bpac, self._qr, self._text, self._stamp = bpac, qr, text_obj, stamp
+        self.opens += 1
 
-            dib = ImageWin.Dib(img)
-            dib.draw(hdc.GetHandleOutput(), (x, y, x + new_w, y + new_h))
+    def is_stale(self) -> bool:
+        if self._bpac is None:
+            return True
+        try:
+            return self._template_stamp() != self._stamp
+        except OSError:
+            return True
 
-            hdc.EndPage()
-            hdc.EndDoc()
-        hdc.DeleteDC()
-        print(f"✅ PNG impresso em '{printer}' ({copies} cópia(s)).")
-    finally:
-        win32print.ClosePrinter(hprinter)
+    def print_label(self, qr_text: str, text_value: str | None = None, copies: int = 1) -> float:
+        """Imprime uma etiqueta; devolve o tempo gasto (s)."""
+        if text_value is not None and not self.text_field:
+            raise ValueError("Informe --text-field quando quiser preencher texto dinâmico.")
+        t0 = time.monotonic()
+        if self.is_stale():
+            self.open()
+        try:
+            self._print(qr_text, text_value, copies)
+        except RuntimeError:
+            # Erro reportado pelo b-PAC (sem papel, tampa aberta...): não reimprime
+            raise
+        except Exception as e:
+            # Sessão velha (b-PAC/driver reiniciado): reabre e tenta uma vez
+            print(f"b-PAC falhou ({e}); reabrindo o template.")
+            self.open()
+            self._print(qr_text, text_value, copies)
+        return time.monotonic() - t0
+
+    def _print(self, qr_text: str, text_value: str | None, copies: int):
+        self._qr.Text = qr_text
+        if text_value is not None:
+            self._text.Text = text_value
+        bpac = self._bpac
+        bpac.StartPrint("", 0)
+        bpac.PrintOut(max(1, copies), 0)
+        if not bpac.EndPrint():
+            raise RuntimeError(f"b-PAC não concluiu a impressão (ErrorCode {getattr(bpac, 'ErrorCode', '?')}).")
+
+    def print_batch(self, rows: list[dict], on_printed=None) -> int:
+        """Imprime várias etiquetas em um único trabalho b-PAC.
+
+        StartPrint uma vez, PrintOut por linha (cada uma com seus textos e
+        cópias) e EndPrint uma vez; ``on_printed(n)`` é chamado a cada
+        PrintOut. Devolve quantas linhas foram para o trabalho.
+
+        As linhas são conferidas antes do StartPrint; se algo falhar no meio,
+        o trabalho é descartado (documento fechado sem EndPrint) em vez de
+        sair pela metade e esconder o erro original.
+        """
+        job = []
+        for n, row in enumerate(rows, 1):
+            text = row.get("text")
+            if text is not None and not self.text_field:
+                raise ValueError("Informe --text-field quando o lote tem a coluna 'text'.")
+            try:
+                copies = max(1, int(row.get("copies") or 1))
+            except (TypeError, ValueError):
+                raise ValueError(f"Linha {n} do trabalho com cópias inválidas: {row.get('copies')!r}.") from None
+            job.append((row["qr"], text, copies))
+        if self.is_stale():
+            self.open()
+        bpac = self._bpac
+        bpac.StartPrint("", 0)
+        done = 0
+        try:
+            for qr_text, text, copies in job:
+                self._qr.Text = qr_text
+                if self._text is not None:
+                    # Linha sem texto limpa o campo (não herda o da etiqueta anterior)
+                    self._text.Text = text or ""
+                bpac.PrintOut(copies, 0)
+                done += 1
+                if on_printed is not None:
+                    on_printed(done)
+        except BaseException:
+            # Aborta o trabalho: fecha sem EndPrint; a próxima chamada reabre o template
+            self.close()
+            raise
+        if not bpac.EndPrint():
+            raise RuntimeError(f"b-PAC não concluiu a impressão (ErrorCode {getattr(bpac, 'ErrorCode', '?')}).")
+        return done
+
+    def close(self):
+        bpac = self._bpac
+        self._bpac = self._qr = self._text = self._stamp = None
+        if bpac is None:
+            return
+        # Evita chamar Close() se for propriedade booleana
+        try:
+            close_attr = getattr(bpac, "Close", None)
+            if callable(close_attr):
+                close_attr()
+        except Exception:
+            pass
+
+_lbx_sessions: dict[tuple, LbxSession] = {}
+
+def get_lbx_session(path_lbx: str, printer_name: str | None = None,
+                    qr_field: str = "qr", text_field: str | None = None) -> LbxSession:
+    key = (os.path.abspath(path_lbx), printer_name, qr_field, text_field, threading.get_ident())
+    session = _lbx_sessions.get(key)
+    if session is None:
+        session = _lbx_sessions[key] = LbxSession(key[0], printer_name, qr_field, text_field)
+    return session
+
+@atexit.register
+def close_lbx_sessions():
+    for session in _lbx_sessions.values():
+        session.close()
+    _lbx_sessions.clear()
+    for printer in _gdi_printers.values():
+        printer.close()
+    _gdi_printers.clear()
 
 def print_lbx_qr(
     path_lbx: str,
@@ -115,76 +453,133 @@ def print_lbx_qr(
     text_field: str | None = None,
     text_value: str | None = None,
 ):
-    try:
-        import win32com.client as win32
-    except ImportError as e:
-        raise RuntimeError("Dependências faltando para b-PAC. Instale no Windows:\n"
-                           "  (instalador oficial do b-PAC SDK) e, se usar Python, pywin32") from e
+    if text_value is not None and not text_field:
+        raise ValueError("Informe --text-field quando quiser preencher texto dinâmico.")
+    session = get_lbx_session(path_lbx, printer_name, qr_field, text_field)
+    with TRACER.span("b-PAC print", "impressao", copies=copies):
+        spent = session.print_label(qr_text, text_value, copies)
+    print(f"✅ LBX impresso ({copies} cópia(s), {spent * 1000:.0f} ms).")
+
+def print_lbx_native(
+    path_lbx: str,
+    qr_text: str,
+    printer_name: str | None,
+    qr_field: str,
+    copies: int,
+    text_field: str | None = None,
+    text_value: str | None = None,
+):
+    """Mesma etiqueta do print_lbx_qr, desenhada em Python (etiqueta.py) e impressa pelo spooler."""
+    from etiqueta import get_renderer
 
-    bpac = win32.Dispatch("bpac.Document")
-    ok = bpac.Open(path_lbx)
-    if not ok:
-        raise RuntimeError(f"Não abriu o LBX: {path_lbx}. Verifique o caminho e se o b-PAC está instalado.")
+    t0 = time.monotonic()
+    with TRACER.span("render", "impressao"):
+        image = get_renderer(path_lbx, qr_field=qr_field, text_field=text_field).render(qr_text, text_value)
+    rendered = time.monotonic() - t0
+    print_image(image, printer_name, copies, doc_name=os.path.basename(path_lbx))
+    print(f"Etiqueta renderizada sem b-PAC em {rendered * 1000:.0f} ms.")
 
-    # Seleciona a fila
-    try:
-        if printer_name:
-            bpac.Printer.SetPrinter(printer_name, True)
-        else:
-            # tenta achar QL-800
-            for i in range(bpac.Printer.PrinterCount):
-                name = bpac.Printer.GetPrinterByIndex(i).Name
-                if PRINTER_DEFAULT_MATCH.lower() in name.lower():
-                    bpac.Printer.SetPrinter(name, True)
-                    break
-        # segue com a atual se não achou
-    except Exception:
+def print_lbx_null(
+    path_lbx: str,
+    qr_text: str,
+    printer_name: str | None,
+    qr_field: str,
+    copies: int,
+    text_field: str | None = None,
+    text_value: str | None = None,
+):
+    """Backend sem impressora (simulacao/carga): aceita a etiqueta e descarta."""
+    with TRACER.span("etiqueta descartada", "impressao", copies=copies):
         pass
+    print(f"Etiqueta descartada (backend nulo, {copies} cópia(s)).")
+
+# Texto da etiqueta do DUT (usado pela estação e pelos lotes do envio.py links)
+def build_label_text(mac_address):
+    mac_parts = mac_address.split(':')
+    ssid_suffix = ':'.join(mac_parts[-3:])
+    SSID = f"RCD-{ssid_suffix}"
+    PASSWORD1 = "admin000"
+    PASSWORD2 = "admin"
+    USERNAME = "admin"
+
+    return (
+        f"MAC:{mac_address}\n"
+        f"SSID: {SSID}\n"
+        f"Password: {PASSWORD1}\n"
+        f"Username: {USERNAME}\n"
+        f"Password: {PASSWORD2}"
+    )
+
+BATCH_QR_COLUMNS = ("qr", "auvoLink")
 
-    # Objeto de QR pelo nome (default: "qr")
-    qr = bpac.GetObject(qr_field)
-    if qr is None:
-        # ajuda: liste objetos do layout
+def read_batch(path: str, mac_text: bool = True) -> list[dict]:
+    """Linhas (qr, text, copies) de um CSV com cabeçalho ou de um JSONL.
+
+    A coluna do QR pode se chamar ``qr`` ou ``auvoLink`` (CSV do
+    ``python envio.py links``). Sem ``text`` e com ``mac_address`` (caso do
+    ``links``), o texto é o mesmo da etiqueta impressa na estação; com
+    ``mac_text=False`` (template sem campo de texto) fica vazio.
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = list(csv.DictReader(f))
+    rows = []
+    for n, record in enumerate(records, 1):
+        qr = next((record[c] for c in BATCH_QR_COLUMNS if record.get(c)), None)
+        if qr is None:
+            raise ValueError(f"Linha {n} do lote sem QR (colunas aceitas: {', '.join(BATCH_QR_COLUMNS)}).")
+        text = record.get("text") or None
+        if text is None and mac_text and record.get("mac_address"):
+            text = build_label_text(record["mac_address"])
         try:
-            names = []
-            for i in range(bpac.ObjectCount):
-                names.append(bpac.GetObjectByIndex(i).Name)
-        except Exception:
-            names = []
-        raise RuntimeError(f"Objeto de QR '{qr_field}' não encontrado no template.\n"
-                           f"Objetos disponíveis: {', '.join(names) if names else '(não foi possível listar)'}\n"
-                           f"Dica: no P-touch Editor renomeie o QR para '{qr_field}'.")
+            copies = max(1, int(record.get("copies") or 1))
+        except (TypeError, ValueError):
+            raise ValueError(f"Linha {n} do lote com cópias inválidas: {record.get('copies')!r}.") from None
+        rows.append({"qr": qr, "text": text, "copies": copies})
+    return rows
 
-    qr.Text = qr_text
+def batch_progress_path(batch_path: str) -> str:
+    return batch_path + ".progress"
 
-    if text_value is not None:
-        if not text_field:
-            raise ValueError("Informe --text-field quando quiser preencher texto dinâmico.")
-        text_obj = bpac.GetObject(text_field)
-        if text_obj is None:
-            try:
-                names = []
-                for i in range(bpac.ObjectCount):
-                    names.append(bpac.GetObjectByIndex(i).Name)
-            except Exception:
-                names = []
-            raise RuntimeError(
-                f"Objeto de texto '{text_field}' não encontrado no template.\n"
-                f"Objetos disponíveis: {', '.join(names) if names else '(não foi possível listar)'}\n"
-                f"Dica: no P-touch Editor renomeie o texto para '{text_field}'."
-            )
-        text_obj.Text = text_value
-
-    bpac.StartPrint("", 0)
-    bpac.PrintOut(max(1, copies), 0)
-    bpac.EndPrint()
-
-    # Evita chamar Close() se for propriedade booleana
-    close_attr = getattr(bpac, "Close", None)
-    if callable(close_attr):
-        close_attr()
-    bpac = None
-    print(f"✅ LBX impresso ({copies} cópia(s)).")
+def print_lbx_batch(path_lbx: str, batch_path: str, printer_name: str | None, qr_field: str,
+                    text_field: str | None, chunk: int = 50, restart: bool = False):
+    """Imprime um lote em uma sessão b-PAC, retomando da última linha impressa.
+
+    O lote vai em trabalhos de até ``chunk`` linhas; o progresso
+    (``<lote>.progress``) só avança depois do EndPrint de cada trabalho,
+    então uma queda no meio reimprime no máximo um trabalho.
+    """
+    rows = read_batch(batch_path, mac_text=bool(text_field))
+    progress_path = batch_progress_path(batch_path)
+    start = 0
+    if not restart and os.path.exists(progress_path):
+        with open(progress_path, "r", encoding="utf-8") as f:
+            start = min(int(f.read().strip() or 0), len(rows))
+        if start:
+            print(f"Retomando da linha {start + 1} de {len(rows)} ({start} já impressas).")
+    session = get_lbx_session(path_lbx, printer_name, qr_field, text_field)
+    total = len(rows)
+    t0 = time.monotonic()
+    printed = start
+    while printed < total:
+        job = rows[printed:printed + max(1, chunk)]
+        base = printed
+
+        def on_printed(n):
+            sys.stdout.write(f"\r[{base + n}/{total}] enviando para a impressora...")
+            sys.stdout.flush()
+
+        printed += session.print_batch(job, on_printed)
+        with open(progress_path, "w", encoding="utf-8") as f:
+            f.write(str(printed))
+    elapsed = time.monotonic() - t0
+    done = total - start
+    rate = f", {elapsed / done * 1000:.0f} ms por etiqueta" if done else ""
+    print(f"\n✅ Lote impresso: {done} etiqueta(s) em {elapsed:.1f} s{rate}.")
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
 
 def main():
     parser = argparse.ArgumentParser(description="Impressão Brother QL (b-PAC ou spooler).")
@@ -193,13 +588,21 @@ def main():
     parser.add_argument("--qr-field", default="qr", help="nome do objeto QR no .lbx (padrão: qr)")
     parser.add_argument("--text", help="texto dinâmico para preencher no template .lbx")
     parser.add_argument("--text-field", help="nome do objeto de texto no .lbx (use com --text)")
+    parser.add_argument("--native", action="store_true", help="com --lbx: desenha a etiqueta em Python (Pillow) e imprime pelo spooler, sem b-PAC")
+    parser.add_argument("--batch", help="lote CSV/JSONL (colunas qr|auvoLink, text, copies) impresso em uma sessão b-PAC")
+    parser.add_argument("--batch-chunk", type=int, default=50, help="linhas por trabalho de impressão no lote (padrão: 50)")
+    parser.add_argument("--restart", action="store_true", help="ignora o progresso salvo e imprime o lote do início")
     parser.add_argument("--png", help="caminho para a imagem .png a imprimir (spooler)")
     parser.add_argument("--printer", help="nome (ou parte) da fila da impressora. Ex.: \"QL-800-62mm\"")
     parser.add_argument("--copies", type=int, default=1, help="número de cópias (padrão: 1)")
     args = parser.parse_args()
 
     try:
-        if args.lbx:
+        if args.lbx and args.batch:
+            path = ensure_file(args.lbx)
+            print_lbx_batch(path, ensure_file(args.batch), args.printer, args.qr_field,
+                            args.text_field, args.batch_chunk, args.restart)
+        elif args.lbx:
             if not args.qr:
                 print("Erro: use --qr junto com --lbx.")
                 sys.exit(1)
@@ -207,12 +610,13 @@ def main():
                 print("Erro: use --text-field junto com --text.")
                 sys.exit(1)
             path = ensure_file(args.lbx)
-            print_lbx_qr(path, args.qr, args.printer, args.qr_field, args.copies, args.text_field, args.text)
+            print_lbx = print_lbx_native if args.native else print_lbx_qr
+            print_lbx(path, args.qr, args.printer, args.qr_field, args.copies, args.text_field, args.text)
         elif args.png:
             path = ensure_file(args.png)
             print_png(path, args.printer, args.copies)
         else:
-            print("Use --lbx <arquivo.lbx> --qr <texto>  OU  --png <arquivo.png>.")
+            print("Use --lbx <arquivo.lbx> --qr <texto>  OU  --lbx <arquivo.lbx> --batch <lote>  OU  --png <arquivo.png>.")
             sys.exit(2)
     except Exception as e:
         # mensagens claras e amigáveis
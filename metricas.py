@@ -0,0 +1,344 @@
+# metricas.py
+# Tempo por etapa de cada DUT e relatorio de vazao da estacao.
+#
+# O teste.py abre um CycleRecorder por DUT e envolve cada etapa (erase,
+# gravacao FVT, boot, execucao do FVT, envio, QR, etiqueta, gravacao final)
+# com recorder.stage("nome"). No fim do ciclo um registro JSON por DUT
+# (MAC, lote, porta, tempos, bytes gravados, baud, resultado) vai para
+# logs/metricas/<data>_<porta>.jsonl: um arquivo por dia e por porta, entao
+# os workers da estacao nunca disputam o mesmo arquivo.
+#
+# Relatorio (unidades/hora, p50/p95 por etapa, gargalos):
+#   python metricas.py report [--dir logs/metricas] [--hours 8]
+#   python metricas.py report --since "2026-10-18 08:00" --until "2026-10-18 12:00" --port COM4
+#
+# Linha do tempo (Chrome Trace Event / Perfetto): com --trace-dir o teste.py
+# liga o TRACER e, a cada DUT, grava um .json com os spans de todas as threads
+# do processo (etapas, operacoes esptool, blocos da escrita, serial, HTTP,
+# impressao). Os tempos sao de relogio de parede em microssegundos, entao os
+# arquivos de portas diferentes (um processo por porta) podem ser juntados:
+#   python metricas.py merge-trace logs/traces/*.json --out estacao.json
+# Abra em https://ui.perfetto.dev ou chrome://tracing.
+
+from __future__ import annotations
+
+import contextlib
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+# Relogio dos spans: parede (alinhado entre processos) com a resolucao do perf_counter
+_EPOCH0 = time.time()
+_PERF0 = time.perf_counter()
+
+
+def clock_us() -> float:
+    return (_EPOCH0 + time.perf_counter() - _PERF0) * 1e6
+
+
+class Tracer:
+    """Spans "X" do formato Chrome Trace; desligado, span() nao registra nada."""
+
+    def __init__(self):
+        self.enabled = False
+        self._events: list[dict] = []
+        self._threads: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, cat: str = "op", **args):
+        if not self.enabled:
+            yield
+            return
+        start = clock_us()
+        try:
+            yield
+        finally:
+            self.complete(name, start, clock_us() - start, cat, args)
+
+    def complete(self, name: str, start_us: float, dur_us: float, cat: str = "op", args: dict | None = None):
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        tid = thread.native_id or threading.get_ident()
+        event = {"name": name, "cat": cat, "ph": "X", "ts": round(start_us, 1),
+                 "dur": round(dur_us, 1), "pid": os.getpid(), "tid": tid}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._threads[tid] = thread.name
+            self._events.append(event)
+
+    def elapsed(self, name: str, seconds: float, cat: str = "op", **args):
+        """Span que terminou agora e durou ``seconds`` (para tempos ja medidos)."""
+        if self.enabled:
+            self.complete(name, clock_us() - seconds * 1e6, seconds * 1e6, cat, args)
+
+    def drain(self) -> list[dict]:
+        """Eventos desde a ultima chamada (e os nomes das threads), esvaziando o buffer."""
+        with self._lock:
+            events, self._events = self._events, []
+            threads = dict(self._threads)
+        pid = os.getpid()
+        meta = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                for tid, name in threads.items()]
+        return meta + events
+
+    def write(self, path: str, process_name: str | None = None) -> int:
+        events = self.drain()
+        if process_name:
+            events.insert(0, {"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0,
+                              "args": {"name": process_name}})
+        write_trace(path, events)
+        return sum(1 for ev in events if ev["ph"] == "X")
+
+
+TRACER = Tracer()
+
+
+def write_trace(path: str, events: list[dict]):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def merge_traces(paths: list[str]) -> list[dict]:
+    """Junta traces de varios processos/ciclos (metadados repetidos saem uma vez)."""
+    events = []
+    seen_meta = set()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for ev in data.get("traceEvents", data if isinstance(data, list) else []):
+            if ev.get("ph") == "M":
+                key = (ev["name"], ev["pid"], ev.get("tid"), json.dumps(ev.get("args"), sort_keys=True))
+                if key in seen_meta:
+                    continue
+                seen_meta.add(key)
+            events.append(ev)
+    return events
+
+
+# Etapas que rodam em paralelo com a gravacao final (pos-teste): ficam fora
+# do caminho critico quando o ciclo usa o pipeline
+PARALLEL_STAGES = ("api", "qr", "label")
+
+
+class CycleRecorder:
+    """Tempos e contadores de um ciclo de DUT; seguro entre threads."""
+
+    def __init__(self, port: str, batch: str | None = None):
+        self.port = port
+        self.batch = batch
+        self.mac = None
+        self.outcome = None
+        self.pipelined = False
+        self.started_at = time.time()
+        self.stages: dict[str, float] = {}
+        self.extra: dict = {}
+        self._t0 = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        t0 = time.monotonic()
+        try:
+            with TRACER.span(name, "etapa", port=self.port):
+                yield
+        finally:
+            self.add(name, time.monotonic() - t0)
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record(self) -> dict:
+        with self._lock:
+            stages = {name: round(seconds, 4) for name, seconds in self.stages.items()}
+        return {
+            "ts": round(self.started_at, 3),
+            "port": self.port,
+            "mac": self.mac,
+            "batch": self.batch,
+            "outcome": self.outcome,
+            "pipelined": self.pipelined,
+            "total": round(time.monotonic() - self._t0, 4),
+            "stages": stages,
+            **self.extra,
+        }
+
+
+def _file_suffix(port: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in port.strip("/\\"))
+
+
+class MetricsLog:
+    """JSONL por dia e por porta; uma linha (um write) por DUT."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path_for(self, port: str, ts: float) -> str:
+        day = time.strftime("%Y-%m-%d", time.localtime(ts))
+        return os.path.join(self.directory, f"{day}_{_file_suffix(port)}.jsonl")
+
+    def append(self, record: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with open(self.path_for(record["port"], record["ts"]), "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def records(self, since: float | None = None, until: float | None = None,
+                port: str | None = None, batch: str | None = None) -> list[dict]:
+        out = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.jsonl"))):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # linha cortada (processo morto no meio do write)
+                    if since is not None and rec["ts"] < since:
+                        continue
+                    if until is not None and rec["ts"] >= until:
+                        continue
+                    if port is not None and rec.get("port") != port:
+                        continue
+                    if batch is not None and rec.get("batch") != batch:
+                        continue
+                    out.append(rec)
+        out.sort(key=lambda rec: rec["ts"])
+        return out
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Percentil com interpolacao linear (q de 0 a 100)."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def summarize(records: list[dict]) -> dict:
+    """Vazao, percentis por etapa e ranking de gargalos de um conjunto de registros."""
+    if not records:
+        return {"units": 0}
+    first = records[0]["ts"]
+    last_end = max(rec["ts"] + rec["total"] for rec in records)
+    span = max(last_end - first, 1e-9)
+    outcomes: dict[str, int] = {}
+    for rec in records:
+        outcomes[rec.get("outcome") or "error"] = outcomes.get(rec.get("outcome") or "error", 0) + 1
+
+    per_stage: dict[str, list[float]] = {}
+    for rec in records:
+        for name, seconds in rec["stages"].items():
+            per_stage.setdefault(name, []).append(seconds)
+    cycle_time = sum(rec["total"] for rec in records)
+
+    stages = []
+    for name, values in per_stage.items():
+        parallel = name in PARALLEL_STAGES and any(rec.get("pipelined") for rec in records)
+        stages.append({
+            "stage": name,
+            "n": len(values),
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values),
+            # Fracao do tempo total de ciclo gasto na etapa (soma sobre os DUTs)
+            "share": sum(values) / cycle_time if cycle_time else 0.0,
+            "parallel": parallel,
+        })
+    # Gargalos: etapas do caminho critico por tempo total; as paralelas vao para o fim
+    stages.sort(key=lambda st: (st["parallel"], -st["share"]))
+    totals = [rec["total"] for rec in records]
+    return {
+        "units": len(records),
+        "outcomes": outcomes,
+        "span": span,
+        "units_per_hour": len(records) / span * 3600,
+        "passed_per_hour": outcomes.get("pass", 0) / span * 3600,
+        "cycle": {"p50": percentile(totals, 50), "p95": percentile(totals, 95), "max": max(totals)},
+        "stages": stages,
+        "ports": sorted({rec["port"] for rec in records}),
+    }
+
+
+def format_summary(summary: dict) -> str:
+    if not summary["units"]:
+        return "Nenhum ciclo registrado no periodo."
+    outcomes = ", ".join(f"{k} {v}" for k, v in sorted(summary["outcomes"].items()))
+    cycle = summary["cycle"]
+    lines = [
+        f"{summary['units']} DUTs ({outcomes}) em {summary['span'] / 3600:.2f} h "
+        f"nas portas {', '.join(summary['ports'])}",
+        f"Vazao: {summary['units_per_hour']:.1f} unidades/h ({summary['passed_per_hour']:.1f} aprovadas/h)",
+        f"Ciclo: p50 {cycle['p50']:.1f} s | p95 {cycle['p95']:.1f} s | max {cycle['max']:.1f} s",
+        "",
+        f"{'#':>2} {'etapa':<12} {'n':>5} {'media':>7} {'p50':>7} {'p95':>7} {'max':>7} {'% ciclo':>8}",
+    ]
+    for rank, st in enumerate(summary["stages"], 1):
+        note = "  (paralelo a gravacao final)" if st["parallel"] else ""
+        lines.append(
+            f"{rank:>2} {st['stage']:<12} {st['n']:>5} {st['mean']:>6.2f}s {st['p50']:>6.2f}s "
+            f"{st['p95']:>6.2f}s {st['max']:>6.2f}s {st['share'] * 100:>7.1f}%{note}"
+        )
+    return "\n".join(lines)
+
+
+def _parse_time(text: str) -> float:
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"data/hora invalida: {text!r} (use AAAA-MM-DD [HH:MM[:SS]])")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "metricas")
+    parser = argparse.ArgumentParser(description="Relatorio de tempos por etapa da estacao.")
+    parser.add_argument("command", choices=["report", "merge-trace"])
+    parser.add_argument("traces", nargs="*", help="merge-trace: arquivos .json de trace")
+    parser.add_argument("--dir", default=default_dir)
+    parser.add_argument("--hours", type=float, help="so as ultimas N horas")
+    parser.add_argument("--since", help="inicio (AAAA-MM-DD [HH:MM[:SS]])")
+    parser.add_argument("--until", help="fim (AAAA-MM-DD [HH:MM[:SS]])")
+    parser.add_argument("--port")
+    parser.add_argument("--batch")
+    parser.add_argument("--json", action="store_true", help="imprime o resumo em JSON")
+    parser.add_argument("--out", default="estacao-trace.json", help="merge-trace: arquivo de saida")
+    args = parser.parse_args()
+
+    if args.command == "merge-trace":
+        if not args.traces:
+            parser.error("informe os arquivos de trace")
+        events = merge_traces(args.traces)
+        write_trace(args.out, events)
+        spans = sum(1 for ev in events if ev.get("ph") == "X")
+        print(f"{len(args.traces)} trace(s), {spans} spans -> {args.out}")
+        sys.exit(0)
+
+    try:
+        since = _parse_time(args.since) if args.since else None
+        until = _parse_time(args.until) if args.until else None
+    except ValueError as e:
+        parser.error(str(e))
+    if args.hours:
+        since = max(since or 0, time.time() - args.hours * 3600)
+    records = MetricsLog(args.dir).records(since, until, port=args.port, batch=args.batch)
+    summary = summarize(records)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(format_summary(summary))
+    sys.exit(0)
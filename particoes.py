@@ -0,0 +1,234 @@
+# particoes.py
+# Leitura da tabela de particoes do ESP-IDF (partition-table.bin) e montagem do
+# plano de erase por regiao usado no lugar do erase_flash completo.
+#
+# Formato de cada entrada (32 bytes, little endian):
+#   magic 0xAA50 | type | subtype | offset | size | label[16] | flags
+# A tabela termina em uma entrada 0xFF.. ou na entrada de MD5 (0xEBEB).
+#
+# Tambem divide uma imagem combinada (merge_bin) em segmentos com dados e
+# regioes de padding (0xFF), para gravar so o que tem conteudo.
+#
+# Uso:
+#   python particoes.py build/partition_table/partition-table.bin
+#   python particoes.py --image .build/rcd-firmware-combined-decrypted.bin
+
+from __future__ import annotations
+
+import struct
+import sys
+from typing import NamedTuple
+
+ENTRY_FORMAT = "<2sBBLL16sL"
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+ENTRY_MAGIC = b"\xAA\x50"
+MD5_MAGIC = b"\xEB\xEB"
+SECTOR_SIZE = 0x1000
+PARTITION_TABLE_SIZE = 0xC00
+# Buracos menores que isso entre dados sao gravados junto (evita muitos flash_begin)
+MIN_SPARSE_GAP = 0x10000
+
+TYPE_APP = 0x00
+TYPE_DATA = 0x01
+
+SUBTYPE_OTA = 0x00
+SUBTYPE_NVS = 0x02
+SUBTYPE_COREDUMP = 0x03
+SUBTYPE_NVS_KEYS = 0x04
+SUBTYPE_SPIFFS = 0x82
+
+# Particoes de dados que guardam estado do DUT anterior e precisam estar limpas
+ERASE_DATA_SUBTYPES = {
+    SUBTYPE_OTA,
+    SUBTYPE_NVS,
+    SUBTYPE_COREDUMP,
+    SUBTYPE_NVS_KEYS,
+    SUBTYPE_SPIFFS,
+}
+
+
+class Partition(NamedTuple):
+    label: str
+    type: int
+    subtype: int
+    offset: int
+    size: int
+    flags: int
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+def parse_partition_table(data: bytes) -> list[Partition]:
+    partitions = []
+    for pos in range(0, len(data) - ENTRY_SIZE + 1, ENTRY_SIZE):
+        entry = data[pos:pos + ENTRY_SIZE]
+        if entry[:2] in (b"\xFF\xFF", MD5_MAGIC):
+            break
+        magic, ptype, subtype, offset, size, label, flags = struct.unpack(ENTRY_FORMAT, entry)
+        if magic != ENTRY_MAGIC:
+            raise ValueError(f"Entrada invalida na tabela de particoes (offset 0x{pos:x}).")
+        partitions.append(Partition(
+            label.rstrip(b"\x00").decode("ascii", "replace"), ptype, subtype, offset, size, flags
+        ))
+    if not partitions:
+        raise ValueError("Tabela de particoes vazia ou invalida.")
+    return partitions
+
+
+def read_partition_table(path: str) -> list[Partition]:
+    with open(path, "rb") as f:
+        return parse_partition_table(f.read())
+
+
+def align_range(offset: int, size: int, sector: int = SECTOR_SIZE) -> tuple[int, int]:
+    start = offset - offset % sector
+    end = -(-(offset + size) // sector) * sector
+    return start, end - start
+
+
+def merge_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[list[int]] = []
+    for start, size in sorted(r for r in ranges if r[1] > 0):
+        end = start + size
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end - start) for start, end in merged]
+
+
+def subtract_ranges(ranges: list[tuple[int, int]], holes: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    result = []
+    holes = merge_ranges(holes)
+    for start, size in merge_ranges(ranges):
+        end = start + size
+        for h_start, h_size in holes:
+            h_end = h_start + h_size
+            if h_end <= start or h_start >= end:
+                continue
+            if h_start > start:
+                result.append((start, h_start - start))
+            start = max(start, h_end)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end - start))
+    return result
+
+
+def build_erase_plan(
+    partitions: list[Partition],
+    written: list[tuple[int, int]] = (),
+    extra: list[tuple[int, int]] = (),
+) -> list[tuple[int, int]]:
+    """Regioes (offset, tamanho) alinhadas a setor que devem ser apagadas.
+
+    ``written`` sao as faixas que o write_flash vai gravar logo depois (ele ja
+    apaga esses setores), ``extra`` sao faixas adicionais a limpar.
+    """
+    ranges = [
+        (p.offset, p.size)
+        for p in partitions
+        if p.type == TYPE_DATA and p.subtype in ERASE_DATA_SUBTYPES
+    ]
+    ranges += list(extra)
+    ranges = [align_range(o, s) for o, s in ranges]
+    holes = [align_range(o, s) for o, s in written]
+    # Setores so parcialmente cobertos pela gravacao tambem sao apagados por ela
+    return subtract_ranges(ranges, holes)
+
+
+class SparseImage(NamedTuple):
+    segments: list[tuple[int, bytes]]  # (offset, dados) a gravar
+    blank: list[tuple[int, int]]  # (offset, tamanho) de padding, so apagar
+    size: int
+
+    @property
+    def data_size(self) -> int:
+        return sum(len(data) for _, data in self.segments)
+
+
+def find_partition_table(image: bytes, start: int = 0x1000, end: int = 0x10000) -> int:
+    for offset in range(start, min(end, len(image)), SECTOR_SIZE):
+        if image[offset:offset + 2] != ENTRY_MAGIC:
+            continue
+        try:
+            parse_partition_table(image[offset:offset + PARTITION_TABLE_SIZE])
+        except ValueError:
+            continue
+        return offset
+    raise ValueError("Tabela de particoes nao encontrada na imagem combinada.")
+
+
+def _is_blank(chunk) -> bool:
+    # Comparacao direta funciona tanto para bytes quanto para memoryview
+    return chunk == b"\xFF" * len(chunk)
+
+
+def split_image_segments(image: bytes, min_gap: int = MIN_SPARSE_GAP) -> SparseImage:
+    """Divide a imagem combinada em segmentos com dados e regioes de padding.
+
+    Os limites vem da tabela de particoes dentro da imagem: nenhum segmento
+    atravessa uma particao. Dentro de cada regiao os setores em 0xFF viram
+    padding quando formam um buraco de pelo menos ``min_gap`` bytes.
+    """
+    table_offset = find_partition_table(image)
+    partitions = parse_partition_table(image[table_offset:table_offset + PARTITION_TABLE_SIZE])
+    bounds = {0, table_offset, table_offset + SECTOR_SIZE, len(image)}
+    for p in partitions:
+        bounds.update((p.offset, p.end))
+    bounds = sorted(b for b in bounds if 0 <= b <= len(image))
+
+    segments: list[tuple[int, bytes]] = []
+    blank: list[tuple[int, int]] = []
+    for region_start, region_end in zip(bounds, bounds[1:]):
+        data_runs: list[list[int]] = []
+        for sector in range(region_start, region_end, SECTOR_SIZE):
+            sector_end = min(sector + SECTOR_SIZE, region_end)
+            if _is_blank(image[sector:sector_end]):
+                continue
+            if data_runs and sector - data_runs[-1][1] < min_gap:
+                data_runs[-1][1] = sector_end
+            else:
+                data_runs.append([sector, sector_end])
+        cursor = region_start
+        for run_start, run_end in data_runs:
+            if run_start > cursor:
+                blank.append((cursor, run_start - cursor))
+            segments.append((run_start, image[run_start:run_end]))
+            cursor = run_end
+        if cursor < region_end:
+            blank.append((cursor, region_end - cursor))
+    # O erase do stub exige faixas alinhadas a setor
+    blank = merge_ranges([align_range(o, s) for o, s in blank])
+    blank = subtract_ranges(blank, [align_range(o, len(d)) for o, d in segments])
+    return SparseImage(segments, blank, len(image))
+
+
+def format_plan(plan: list[tuple[int, int]]) -> str:
+    total = sum(size for _, size in plan)
+    lines = [f"  0x{o:08x} - 0x{o + s:08x} ({s // 1024} KB)" for o, s in plan]
+    lines.append(f"  total: {total // 1024} KB")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--image":
+        with open(sys.argv[2], "rb") as f:
+            sparse = split_image_segments(f.read())
+        print("Segmentos com dados:")
+        print(format_plan([(o, len(d)) for o, d in sparse.segments]))
+        print("Padding (apagado, nao transferido):")
+        print(format_plan(sparse.blank))
+        sys.exit(0)
+    if len(sys.argv) != 2:
+        print("Uso: python particoes.py <partition-table.bin> | --image <combinado.bin>")
+        sys.exit(2)
+    table = read_partition_table(sys.argv[1])
+    for p in table:
+        print(f"{p.label:<16} type={p.type:#04x} subtype={p.subtype:#04x} "
+              f"offset=0x{p.offset:08x} size=0x{p.size:06x}")
+    print("Plano de erase (particoes de dados):")
+    print(format_plan(build_erase_plan(table)))
@@ -0,0 +1,236 @@
+# qr_mask.py
+# Escolha de mascara do qrcode (aplicacao + lost_point) vetorizada com NumPy.
+#
+# O qrcode.make(fit=True) aplica as 8 mascaras e pontua cada uma com
+# qrcode.util.lost_point, que percorre todos os modulos em Python puro; e a
+# maior parte do custo de gerar um QR. Aqui as quatro regras da ISO/IEC 18004
+# sao calculadas sobre a matriz inteira de uma vez, com o mesmo resultado
+# (inclusive os arredondamentos) da implementacao original.
+#
+# A aplicacao das mascaras tambem e vetorizada: no modo de teste do qrcode o
+# layout das 8 mascaras so difere nos modulos de dados (as informacoes de
+# formato/versao ficam todas claras), entao o layout e montado uma vez, os
+# dados sao desmascarados e cada mascara vira um XOR sobre a matriz. Sao 2
+# chamadas de map_data por QR em vez de 9.
+#
+# install() troca qrcode.util.lost_point e QRCode.best_mask_pattern pelas
+# versoes vetorizadas; sem NumPy nada muda. O qr_store chama install() ao ser
+# importado.
+#
+# Conferencia e benchmark (URLs no formato do auvoLink):
+#   python qr_mask.py verify [--n 2000]
+#   python qr_mask.py bench [--n 300]
+
+from __future__ import annotations
+
+import random
+import string
+import sys
+import time
+
+import qrcode
+import qrcode.util
+from qrcode.main import QRCode, copy_2d_array, precomputed_qr_blanks
+
+try:
+    import numpy as np
+except ImportError:  # NumPy e opcional: sem ele fica a implementacao do qrcode
+    np = None
+
+# Padrao 1:1:3:1:1 com 4 modulos claros antes/depois (bit mais alto = primeiro modulo)
+FINDER_LIKE_1 = 0b10111010000
+FINDER_LIKE_2 = 0b00001011101
+FINDER_LIKE_SIZE = 11
+
+_original_lost_point = qrcode.util.lost_point
+_original_best_mask_pattern = QRCode.best_mask_pattern
+_mask_cache: dict[int, list] = {}
+
+
+def _run_penalty(matrix) -> int:
+    # Regra 1: sequencias de 5+ modulos da mesma cor, por linha (matriz ja transposta para colunas)
+    rows, cols = matrix.shape
+    padded = np.full((rows, cols + 2), 2, dtype=np.int8)
+    padded[:, 1:-1] = matrix
+    changes = np.flatnonzero(padded[:, 1:] != padded[:, :-1])
+    # Entre linhas a "sequencia" tem tamanho 1 (sentinela), que nao pontua
+    runs = np.diff(changes)
+    runs = runs[runs >= 5]
+    return int((runs - 2).sum())
+
+
+def _finder_penalty(matrix) -> int:
+    # Regra 3: janelas de 11 modulos empacotadas em inteiros e comparadas com os dois padroes
+    rows, cols = matrix.shape
+    if cols < FINDER_LIKE_SIZE:
+        return 0
+    width = cols - FINDER_LIKE_SIZE + 1
+    windows = np.zeros((rows, width), dtype=np.int32)
+    for k in range(FINDER_LIKE_SIZE):
+        windows |= matrix[:, k:k + width].astype(np.int32) << (FINDER_LIKE_SIZE - 1 - k)
+    return 40 * int(np.count_nonzero((windows == FINDER_LIKE_1) | (windows == FINDER_LIKE_2)))
+
+
+def lost_point(modules) -> int:
+    """Mesmo valor de qrcode.util.lost_point, calculado com NumPy."""
+    matrix = np.asarray(modules, dtype=bool)
+    count = matrix.shape[0]
+    transposed = matrix.T
+
+    lost = _run_penalty(matrix) + _run_penalty(transposed)
+
+    # Regra 2: blocos 2x2 da mesma cor
+    top_left = matrix[:-1, :-1]
+    same = (top_left == matrix[:-1, 1:]) & (top_left == matrix[1:, :-1]) & (top_left == matrix[1:, 1:])
+    lost += 3 * int(np.count_nonzero(same))
+
+    lost += _finder_penalty(matrix) + _finder_penalty(transposed)
+
+    # Regra 4: proporcao de escuros (mesma conta em float do original)
+    dark_count = int(np.count_nonzero(matrix))
+    percent = float(dark_count) / (count**2)
+    rating = int(abs(percent * 100 - 50) / 5)
+    return lost + rating * 10
+
+
+def mask_patterns(count: int) -> list:
+    """As 8 mascaras (True = inverte) para uma matriz count x count, em cache."""
+    masks = _mask_cache.get(count)
+    if masks is None:
+        i, j = np.indices((count, count))
+        masks = [
+            (i + j) % 2 == 0,
+            i % 2 == 0,
+            j % 3 == 0,
+            (i + j) % 3 == 0,
+            (i // 2 + j // 3) % 2 == 0,
+            (i * j) % 2 + (i * j) % 3 == 0,
+            ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+            ((i * j) % 3 + (i + j) % 2) % 2 == 0,
+        ]
+        _mask_cache[count] = masks
+    return masks
+
+
+def _data_region(qr: QRCode):
+    # Modulos que o map_data preenche: o que ainda e None depois dos padroes fixos
+    saved = qr.modules
+    qr.modules = copy_2d_array(precomputed_qr_blanks[qr.version])
+    qr.setup_type_info(True, 0)
+    if qr.version >= 7:
+        qr.setup_type_number(True)
+    region = np.array([[cell is None for cell in row] for row in qr.modules], dtype=bool)
+    qr.modules = saved
+    return region
+
+
+def best_mask_pattern(self) -> int:
+    """Mesmo resultado de QRCode.best_mask_pattern com um unico map_data de teste."""
+    self.makeImpl(True, 0)
+    masks = mask_patterns(self.modules_count)
+    data = _data_region(self)
+    unmasked = np.asarray(self.modules, dtype=bool) ^ (masks[0] & data)
+    min_lost_point = 0
+    pattern = 0
+    for i in range(8):
+        points = lost_point(unmasked ^ (masks[i] & data))
+        if i == 0 or min_lost_point > points:
+            min_lost_point = points
+            pattern = i
+    return pattern
+
+
+def install() -> bool:
+    """Usa as versoes vetorizadas no qrcode; devolve False se o NumPy nao estiver instalado."""
+    if np is None:
+        return False
+    qrcode.util.lost_point = lost_point
+    QRCode.best_mask_pattern = best_mask_pattern
+    return True
+
+
+def uninstall():
+    qrcode.util.lost_point = _original_lost_point
+    QRCode.best_mask_pattern = _original_best_mask_pattern
+
+
+def auvo_links(n: int, seed: int = 1234) -> list[str]:
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    links = []
+    for i in range(n):
+        kind = i % 3
+        if kind == 0:
+            token = "".join(rng.choice(alphabet) for _ in range(rng.randint(8, 40)))
+            links.append(f"https://app.auvo.com.br/equipamento/{token}")
+        elif kind == 1:
+            mac = "".join(rng.choice("0123456789ABCDEF") for _ in range(12))
+            links.append(f"https://app2.auvo.com.br/qr/{mac}?id={rng.randint(1, 10**9)}")
+        else:
+            path = "/".join("".join(rng.choice(alphabet) for _ in range(rng.randint(3, 12))) for _ in range(rng.randint(1, 6)))
+            links.append(f"https://app.auvo.com.br/{path}")
+    return links
+
+
+def _make(link: str):
+    qr = qrcode.QRCode()
+    qr.add_data(link)
+    qr.make(fit=True)
+    return qr
+
+
+def verify(n: int) -> bool:
+    """Compara lost_point em todas as mascaras, a mascara escolhida e a matriz final com o qrcode original."""
+    links = auvo_links(n)
+    mismatches = 0
+    for link in links:
+        uninstall()
+        reference = _make(link)
+        for mask in range(8):
+            reference.makeImpl(True, mask)
+            expected = _original_lost_point(reference.modules)
+            got = lost_point(reference.modules)
+            if got != expected:
+                mismatches += 1
+                print(f"DIVERGENCIA mascara {mask}: {got} != {expected} ({link})")
+        reference = _make(link)
+        install()
+        fast = _make(link)
+        if fast.get_matrix() != reference.get_matrix():
+            mismatches += 1
+            print(f"DIVERGENCIA na matriz final ({link})")
+        # best_mask_pattern refaz o layout de teste: conferir depois da matriz final
+        if best_mask_pattern(fast) != _original_best_mask_pattern(fast):
+            mismatches += 1
+            print(f"DIVERGENCIA na mascara escolhida ({link})")
+    uninstall()
+    print(f"{len(links)} links x 8 mascaras conferidos: {'OK' if not mismatches else f'{mismatches} divergencias'}")
+    return not mismatches
+
+
+def benchmark(n: int):
+    links = auvo_links(n)
+    for label, active in (("qrcode original", False), ("NumPy", True)):
+        install() if active else uninstall()
+        t0 = time.perf_counter()
+        for link in links:
+            _make(link)
+        elapsed = time.perf_counter() - t0
+        print(f"{label:<16}: {elapsed / n * 1000:7.2f} ms por QR ({n} links)")
+    uninstall()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Escolha de mascara vetorizada do qrcode.")
+    parser.add_argument("command", choices=["verify", "bench"])
+    parser.add_argument("--n", type=int, default=None)
+    args = parser.parse_args()
+
+    if np is None:
+        print("NumPy nao instalado: pip install numpy")
+        sys.exit(1)
+    if args.command == "verify":
+        sys.exit(0 if verify(args.n or 2000) else 1)
+    benchmark(args.n or 300)
@@ -0,0 +1,175 @@
+# qr_store.py
+# QR codes em memoria (cache LRU por link) e arquivo opcional em SQLite.
+#
+# O QR do auvoLink e gerado uma vez por link e reaproveitado (matriz para a
+# etiqueta, PNG para o arquivo). Nada e gravado em pastas por MAC: quando o
+# arquivo esta ligado, o PNG vai para um unico SQLite indexado por MAC,
+# gravado por uma thread em segundo plano (fora do caminho critico do DUT).
+#
+# Uso:
+#   python qr_store.py list [--db spool/qrcodes.sqlite3]
+#   python qr_store.py get 00:4B:12:18:81:A4 [--out qr.png]
+
+from __future__ import annotations
+
+import atexit
+import functools
+import io
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import qrcode
+from PIL import Image
+
+import qr_mask
+from metricas import TRACER
+
+# Escolha de mascara vetorizada (mesma matriz); sem NumPy segue o qrcode puro
+qr_mask.install()
+
+QR_CACHE_SIZE = 1024
+# Mesmo tamanho do PNG gerado antes pelo teste.py (padrao do qrcode)
+PNG_BOX_SIZE = 10
+DEFAULT_BORDER = 4
+DEFAULT_ECC = qrcode.constants.ERROR_CORRECT_M
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS qrcodes (
+    mac TEXT PRIMARY KEY,
+    link TEXT NOT NULL,
+    png BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS qrcodes_link ON qrcodes (link);
+"""
+
+
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_matrix(link: str, ecc: int = DEFAULT_ECC, border: int = DEFAULT_BORDER) -> tuple[tuple[bool, ...], ...]:
+    """Matriz do QR (True = modulo escuro), ja com a borda; imutavel e em cache."""
+    qr = qrcode.QRCode(error_correction=ecc, border=border)
+    qr.add_data(link)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+
+def matrix_image(matrix, box_size: int = 1) -> Image.Image:
+    size = len(matrix)
+    image = Image.new("L", (size, size), 255)
+    image.putdata([0 if cell else 255 for row in matrix for cell in row])
+    if box_size > 1:
+        image = image.resize((size * box_size, size * box_size), Image.NEAREST)
+    return image
+
+
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_png(link: str, box_size: int = PNG_BOX_SIZE) -> bytes:
+    out = io.BytesIO()
+    matrix_image(qr_matrix(link), box_size).convert("1").save(out, format="PNG", optimize=True)
+    return out.getvalue()
+
+
+class QrArchive:
+    """PNGs dos QR por MAC em um unico SQLite; gravacao em segundo plano."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self._connect()
+        try:
+            db.executescript(_SCHEMA)
+        finally:
+            db.close()
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def put(self, mac: str, link: str):
+        with TRACER.span("arquivar QR", "qr", mac=mac):
+            self._put(mac, link)
+
+    def _put(self, mac: str, link: str):
+        db = self._connect()
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO qrcodes (mac, link, png, created_at) VALUES (?, ?, ?, ?)",
+                (mac.upper(), link, qr_png(link), time.time()),
+            )
+        finally:
+            db.close()
+
+    def put_async(self, mac: str, link: str):
+        """Enfileira o arquivamento; o PNG e gerado e gravado pela thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="qr-arquivo", daemon=True)
+            self._thread.start()
+            # Thread daemon: sem isso os PNGs ainda na fila se perdem na saida
+            atexit.register(self.flush)
+        self._queue.put((mac, link))
+
+    def flush(self):
+        """Espera a fila de arquivamento esvaziar (ex.: antes de sair)."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            mac, link = self._queue.get()
+            try:
+                self.put(mac, link)
+            except Exception as e:
+                print(f"Falha ao arquivar o QR de {mac}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def get(self, mac: str) -> tuple[str, bytes] | None:
+        db = self._connect()
+        try:
+            row = db.execute("SELECT link, png FROM qrcodes WHERE mac = ?", (mac.upper(),)).fetchone()
+        finally:
+            db.close()
+        return (row[0], bytes(row[1])) if row else None
+
+    def entries(self) -> list[tuple[str, str, float]]:
+        db = self._connect()
+        try:
+            return db.execute("SELECT mac, link, created_at FROM qrcodes ORDER BY created_at").fetchall()
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    default_db = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool", "qrcodes.sqlite3")
+    parser = argparse.ArgumentParser(description="Arquivo de QR codes por MAC.")
+    parser.add_argument("command", choices=["list", "get"])
+    parser.add_argument("mac", nargs="?")
+    parser.add_argument("--db", default=default_db)
+    parser.add_argument("--out", help="get: grava o PNG neste arquivo")
+    args = parser.parse_args()
+
+    archive = QrArchive(args.db)
+    if args.command == "list":
+        for mac, link, created in archive.entries():
+            print(f"{mac}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))}  {link}")
+        sys.exit(0)
+    if not args.mac:
+        parser.error("informe o MAC")
+    entry = archive.get(args.mac)
+    if entry is None:
+        print(f"QR de {args.mac} nao encontrado em {args.db}")
+        sys.exit(1)
+    link, png = entry
+    out = args.out or args.mac.replace(":", "_") + "_qr.png"
+    with open(out, "wb") as f:
+        f.write(png)
+    print(f"{link}\nQR salvo em {out}")
@@ -0,0 +1,209 @@
+# resultados.py
+# Historico local dos ciclos por MAC (SQLite), para o caminho rapido de reteste.
+#
+# Cada ciclo do teste.py grava uma linha: MAC, lote, porta, data, resultado e
+# o que ja foi feito com a unidade (FVT aprovado, firmware final gravado,
+# etiqueta impressa, auvoLink) mais o JSON do FVT. O estado e acumulado: um
+# reteste que so reimprime a etiqueta continua marcando o FVT como aprovado.
+#
+# Logo depois do connect (o esptool ja le o MAC) a estacao consulta a ultima
+# linha do MAC; com a janela de reteste ligada (--retest-window, desligada por
+# padrao) a unidade com FVT aprovado dentro dela pula o erase + FVT e vai
+# direto para a gravacao final e/ou a etiqueta. Unidade ja concluida so
+# reimprime a etiqueta com --reprint-label; sem ele refaz o ciclo completo.
+#
+# Uso:
+#   python resultados.py mac 24:0A:C4:12:34:56 [--db spool/resultados.sqlite3]
+#   python resultados.py list [--batch RCD...] [--hours 8] [--pending]
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import sys
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mac TEXT NOT NULL,
+    batch TEXT,
+    port TEXT,
+    ts REAL NOT NULL,
+    mode TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    fvt_passed INTEGER NOT NULL DEFAULT 0,
+    final_flashed INTEGER NOT NULL DEFAULT 0,
+    label_printed INTEGER NOT NULL DEFAULT 0,
+    auvo_link TEXT,
+    result_json TEXT,
+    total REAL
+);
+CREATE INDEX IF NOT EXISTS results_mac ON results (mac, ts);
+CREATE INDEX IF NOT EXISTS results_batch ON results (batch, ts);
+CREATE INDEX IF NOT EXISTS results_ts ON results (ts);
+"""
+
+MODE_FULL = "completo"
+MODE_RETEST = "reteste"
+
+_FLAGS = ("fvt_passed", "final_flashed", "label_printed")
+
+
+class ResultStore:
+    """Historico por MAC em SQLite (seguro entre os processos da estacao)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self._connect()
+        try:
+            db.executescript(_SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.row_factory = sqlite3.Row
+        return db
+
+    def record(self, mac: str, batch: str | None, port: str | None, mode: str, outcome: str,
+               fvt_passed: bool = False, final_flashed: bool = False, label_printed: bool = False,
+               auvo_link: str | None = None, result_json: str | None = None, total: float | None = None):
+        """Grava o ciclo; flags e link se somam aos da ultima linha do mesmo MAC."""
+        mac = mac.upper()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            last = db.execute(
+                "SELECT * FROM results WHERE mac = ? ORDER BY ts DESC, id DESC LIMIT 1", (mac,)
+            ).fetchone()
+            if last is not None and mode == MODE_RETEST:
+                # Reteste nao refaz o FVT: herda o que a unidade ja tinha feito
+                fvt_passed = fvt_passed or bool(last["fvt_passed"])
+                final_flashed = final_flashed or bool(last["final_flashed"])
+                label_printed = label_printed or bool(last["label_printed"])
+                auvo_link = auvo_link or last["auvo_link"]
+                result_json = result_json or last["result_json"]
+            db.execute(
+                "INSERT INTO results (mac, batch, port, ts, mode, outcome, fvt_passed, final_flashed, "
+                "label_printed, auvo_link, result_json, total) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (mac, batch, port, time.time(), mode, outcome, int(fvt_passed), int(final_flashed),
+                 int(label_printed), auvo_link, result_json, total),
+            )
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def latest(self, mac: str) -> dict | None:
+        db = self._connect()
+        try:
+            row = db.execute(
+                "SELECT * FROM results WHERE mac = ? ORDER BY ts DESC, id DESC LIMIT 1", (mac.upper(),)
+            ).fetchone()
+        finally:
+            db.close()
+        return _entry(row) if row else None
+
+    def history(self, mac: str) -> list[dict]:
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT * FROM results WHERE mac = ? ORDER BY ts, id", (mac.upper(),)).fetchall()
+        finally:
+            db.close()
+        return [_entry(row) for row in rows]
+
+    def entries(self, batch: str | None = None, since: float | None = None) -> list[dict]:
+        """Ultima linha de cada MAC (opcionalmente so do lote / a partir de ``since``)."""
+        query = "SELECT * FROM results r WHERE id = (SELECT id FROM results WHERE mac = r.mac ORDER BY ts DESC, id DESC LIMIT 1)"
+        params: list = []
+        if batch is not None:
+            query += " AND batch = ?"
+            params.append(batch)
+        if since is not None:
+            query += " AND ts >= ?"
+            params.append(since)
+        db = self._connect()
+        try:
+            rows = db.execute(query + " ORDER BY ts", params).fetchall()
+        finally:
+            db.close()
+        return [_entry(row) for row in rows]
+
+
+def _entry(row: sqlite3.Row) -> dict:
+    entry = dict(row)
+    for flag in _FLAGS:
+        entry[flag] = bool(entry[flag])
+    return entry
+
+
+def retest_plan(entry: dict | None, window: float, reprint: bool = False) -> dict | None:
+    """O que falta fazer em uma unidade com FVT ja aprovado, ou None (ciclo completo).
+
+    ``window`` em segundos: FVT aprovado ha mais tempo que isso e refeito.
+    Unidade ja concluida (final + etiqueta) so reimprime a etiqueta com
+    ``reprint``; sem ele volta para o ciclo completo (retrabalho).
+    """
+    if entry is None or not entry["fvt_passed"] or not entry["result_json"]:
+        return None
+    if window <= 0 or time.time() - entry["ts"] > window:
+        return None
+    flash = not entry["final_flashed"]
+    label = not entry["label_printed"]
+    if not flash and not label:
+        if not reprint:
+            return None
+        label = True
+    return {"final_flash": flash, "label": label}
+
+
+def describe(entry: dict) -> str:
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["ts"]))
+    done = [name for name, flag in (("FVT", entry["fvt_passed"]), ("final", entry["final_flashed"]),
+                                    ("etiqueta", entry["label_printed"])) if flag]
+    return (f"{entry['mac']}  {when}  {entry['port'] or '-':<14} {entry['batch'] or '-':<22} "
+            f"{entry['mode']:<8} {entry['outcome']:<5} [{', '.join(done) or 'nada'}]")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    default_db = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool", "resultados.sqlite3")
+    parser = argparse.ArgumentParser(description="Historico local dos DUTs por MAC.")
+    parser.add_argument("command", choices=["mac", "list"])
+    parser.add_argument("mac", nargs="?")
+    parser.add_argument("--db", default=default_db)
+    parser.add_argument("--batch", help="list: so o lote indicado")
+    parser.add_argument("--hours", type=float, help="list: so as ultimas N horas")
+    parser.add_argument("--pending", action="store_true",
+                        help="list: so unidades aprovadas sem firmware final ou sem etiqueta")
+    parser.add_argument("--json", action="store_true", help="mac: mostra tambem o JSON do FVT")
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    if args.command == "mac":
+        if not args.mac:
+            parser.error("informe o MAC")
+        history = store.history(args.mac)
+        if not history:
+            print(f"{args.mac} sem registros em {args.db}")
+            sys.exit(1)
+        for entry in history:
+            print(describe(entry))
+        last = history[-1]
+        if last["auvo_link"]:
+            print(f"auvoLink: {last['auvo_link']}")
+        if args.json and last["result_json"]:
+            print(json.dumps(json.loads(last["result_json"]), indent=2, ensure_ascii=False))
+        sys.exit(0)
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    entries = store.entries(batch=args.batch, since=since)
+    if args.pending:
+        entries = [e for e in entries if e["fvt_passed"] and not (e["final_flashed"] and e["label_printed"])]
+    for entry in entries:
+        print(describe(entry))
+    print(f"{len(entries)} unidade(s)")
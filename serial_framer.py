@@ -0,0 +1,214 @@
+# serial_framer.py
+# Separacao incremental da saida UART do firmware FVT em linhas de log e
+# frames JSON completos.
+#
+# O framer recebe blocos de bytes na ordem em que chegam (feed) e devolve
+# eventos ("log", linha) e ("json", texto). Dentro de um frame ele acompanha a
+# profundidade de chaves, strings e escapes, entao JSON aninhado e chaves
+# dentro de strings nao fecham o frame antes da hora.
+#
+# Benchmark (replay de capturas feitas com teste.py --capture-serial):
+#   python serial_framer.py bench captura1.bin [captura2.bin ...] [--chunk 64]
+
+from __future__ import annotations
+
+import re
+import sys
+import time
+
+# Caracteres que mudam o estado dentro de um frame JSON
+_JSON_SPECIAL = re.compile(rb'[{}"\\]')
+_WHITESPACE = b" \t\r\n"
+# Frame maior que isso e tratado como lixo e devolvido como log
+MAX_FRAME_SIZE = 64 * 1024
+
+
+class JsonFramer:
+    def __init__(self, max_frame: int = MAX_FRAME_SIZE):
+        self.max_frame = max_frame
+        self._line = bytearray()
+        self._frame = bytearray()
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Logo apos o "{": ainda nao se sabe se e JSON ou so uma chave no log
+        self._opening = False
+
+    @property
+    def frame_open(self) -> bool:
+        """True com um frame JSON confirmado e ainda incompleto.
+
+        Uma chave solta no log nao conta: o "{" so vira frame depois que o
+        proximo caractere util (aspas ou "}") e visto.
+        """
+        return self._depth > 0 and not self._opening
+
+    def feed(self, data: bytes) -> list[tuple[str, str]]:
+        events: list[tuple[str, str]] = []
+        pos = 0
+        size = len(data)
+        while pos < size:
+            if self._depth == 0:
+                pos = self._feed_log(data, pos, events)
+            else:
+                pos = self._feed_frame(data, pos, events)
+        return events
+
+    def flush(self) -> list[tuple[str, str]]:
+        """Devolve o que ficou pendente (linha sem \\n ou frame incompleto) como log."""
+        events: list[tuple[str, str]] = []
+        pending = bytes(self._line) + bytes(self._frame)
+        self._reset_frame()
+        self._line.clear()
+        if pending:
+            events.append(("log", _decode(pending)))
+        return events
+
+    def _feed_log(self, data: bytes, pos: int, events) -> int:
+        brace = data.find(b"{", pos)
+        end = len(data) if brace < 0 else brace
+        chunk = data[pos:end]
+        newline = chunk.rfind(b"\n")
+        if newline >= 0:
+            self._line += chunk[:newline + 1]
+            for line in bytes(self._line).splitlines():
+                events.append(("log", _decode(line)))
+            self._line.clear()
+            self._line += chunk[newline + 1:]
+        else:
+            self._line += chunk
+        if brace < 0:
+            return len(data)
+        self._frame += b"{"
+        self._depth = 1
+        self._opening = True
+        return brace + 1
+
+    def _check_opening(self, data: bytes, pos: int, events) -> int:
+        # Um objeto JSON comeca com "{" seguido de '"' ou '}'; qualquer outra coisa e log
+        end = pos
+        while end < len(data) and data[end] in _WHITESPACE:
+            end += 1
+        self._frame += data[pos:end]
+        if end == len(data):
+            return end
+        self._opening = False
+        if data[end] not in b'"}':
+            self._line += self._frame
+            self._reset_frame()
+        elif self._line.strip():
+            # Texto antes do frame na mesma linha sai como log proprio
+            events.append(("log", _decode(bytes(self._line))))
+            self._line.clear()
+        else:
+            self._line.clear()
+        return end
+
+    def _feed_frame(self, data: bytes, pos: int, events) -> int:
+        if self._opening:
+            pos = self._check_opening(data, pos, events)
+            if self._opening or self._depth == 0:
+                return pos
+        for match in _JSON_SPECIAL.finditer(data, pos):
+            char = match.group()
+            if self._escape:
+                self._escape = False
+                continue
+            if self._in_string:
+                if char == b"\\":
+                    self._escape = True
+                elif char == b'"':
+                    self._in_string = False
+                continue
+            if char == b'"':
+                self._in_string = True
+            elif char == b"{":
+                self._depth += 1
+            elif char == b"}":
+                self._depth -= 1
+                if self._depth == 0:
+                    end = match.end()
+                    self._frame += data[pos:end]
+                    events.append(("json", _decode(bytes(self._frame))))
+                    self._reset_frame()
+                    return end
+        self._frame += data[pos:]
+        if len(self._frame) > self.max_frame:
+            # Nunca fechou: provavelmente lixo na serial; devolve como log e recomeca
+            events.append(("log", _decode(bytes(self._frame))))
+            self._reset_frame()
+        return len(data)
+
+    def _reset_frame(self):
+        self._frame.clear()
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._opening = False
+
+
+def _decode(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace").rstrip("\r\n")
+
+
+def legacy_extract(data: bytes):
+    # Algoritmo antigo do read_serial (chr por byte, sem aninhamento), so para comparacao
+    json_data = ""
+    json_started = False
+    log = []
+    for byte in data:
+        char = chr(byte)
+        if char == "{":
+            json_started = True
+            json_data = char
+        elif char == "}" and json_started:
+            json_data += char
+            return json_data, log
+        elif json_started:
+            json_data += char
+        else:
+            log.append(char)
+    return None, log
+
+
+def replay(data: bytes, chunk: int) -> tuple[int, int]:
+    framer = JsonFramer()
+    frames = lines = 0
+    for pos in range(0, len(data), chunk):
+        for kind, _ in framer.feed(data[pos:pos + chunk]):
+            if kind == "json":
+                frames += 1
+            else:
+                lines += 1
+    lines += len(framer.flush())
+    return frames, lines
+
+
+def benchmark(paths: list[str], chunk: int, repeat: int = 20):
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            frames, lines = replay(data, chunk)
+        framer_s = (time.perf_counter() - t0) / repeat
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            legacy_extract(data)
+        legacy_s = (time.perf_counter() - t0) / repeat
+        mb = len(data) / 1e6
+        print(f"{path}: {len(data)} bytes, {frames} frames JSON, {lines} linhas de log")
+        print(f"  framer : {framer_s * 1000:8.2f} ms ({mb / framer_s if framer_s else 0:8.1f} MB/s, blocos de {chunk} B)")
+        print(f"  antigo : {legacy_s * 1000:8.2f} ms ({mb / legacy_s if legacy_s else 0:8.1f} MB/s, ate o 1o frame)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark do framer JSON da serial.")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("captures", nargs="+", help="arquivos com bytes crus da UART")
+    parser.add_argument("--chunk", type=int, default=64, help="tamanho dos blocos lidos (padrao: 64)")
+    args = parser.parse_args()
+    benchmark(args.captures, args.chunk)
+    sys.exit(0)
@@ -1,14 +1,23 @@
+import argparse
+import contextlib
+import functools
 import json
 import os
-import qrcode
-import requests
-import serial
-import subprocess
+import sqlite3
+import sys
 import time
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from concurrent.futures import ThreadPoolExecutor
 
 import esptool
-from imprimir import print_lbx_qr
+from envio import BatchSender, UploadSpool, UploadWorker, create_http_session, format_timing, prewarm, split_key
+from firmware_cache import FinalFirmwareCache
+from gravacao import BAUD_LADDER, PAYLOAD_CACHE, BaudMemory, FlashSession, read_files
+from imprimir import build_label_text, print_lbx_native, print_lbx_null, print_lbx_qr
+from metricas import TRACER, CycleRecorder, MetricsLog
+from serial_framer import JsonFramer
+from qr_store import QrArchive, qr_matrix
+from resultados import MODE_FULL, MODE_RETEST, ResultStore, describe, retest_plan
+from particoes import build_erase_plan, format_plan, read_partition_table
 
 
 
@@ -22,15 +31,27 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 FINAL_FIRMWARE_ENC_PATH = os.path.join(
     SCRIPT_DIR, "final-firmware", "rcd_firmware_v1_2_5-combined.bin.enc"
 )
-DECRYPTED_OUTPUT_DIR = os.path.join(SCRIPT_DIR, ".build")
-DECRYPTED_OUTPUT_PATH = os.path.join(
-    DECRYPTED_OUTPUT_DIR, "rcd-firmware-combined-decrypted.bin"
-)
 ENCRYPTION_KEY = b"+KbPeSgVkYp3s6v9y$B&E)H@McQfTjWm"
 ENCRYPTION_IV = b"WnZr4u7w!z%C*F-J"
-BOOTLOADER_OFFSET = 0x1000
-DEFAULT_FLASH_BAUD = 460800
-FALLBACK_FLASH_BAUD = 115200
+SERIAL_READ_TIMEOUT = 0.1
+API_BASE_URL = "https://services.polusbrasil.com.br"
+API_SAVE_TESTS_PATH = "/api/meter/save-tests/rcd-cr"
+# Endpoint de lote (gzip) usado so com --batch-upload / envio.py drain --batch
+API_BATCH_PATH = API_SAVE_TESTS_PATH + "/batch"
+# (conexao, leitura) em segundos
+API_TIMEOUT = (5, 30)
+DEFAULT_AUVO_WAIT = 15.0
+UPLOAD_SPOOL_PATH = os.path.join(SCRIPT_DIR, "spool", "uploads.sqlite3")
+QR_ARCHIVE_PATH = os.path.join(SCRIPT_DIR, "spool", "qrcodes.sqlite3")
+RESULTS_DB_PATH = os.path.join(SCRIPT_DIR, "spool", "resultados.sqlite3")
+# FVT aprovado ha menos que isso (h) nao e refeito quando o MAC volta ao fixture
+# Reteste rapido so quando o operador pede (--retest-window); 0 sempre refaz erase + FVT
+DEFAULT_RETEST_WINDOW = 0.0
+METRICS_DIR = os.path.join(SCRIPT_DIR, "logs", "metricas")
+TRACE_DIR = os.path.join(SCRIPT_DIR, "logs", "traces")
+# Banner do ROM apos o reset ("rst:0x1 (POWERON_RESET),boot:0x13 ...")
+BOOT_MARKERS = (b"rst:", b"ets ")
+BAUD_STATE_PATH = os.path.join(SCRIPT_DIR, ".build", "baud-state.json")
 FLASH_CHIP = "esp32"
 
 fvt_firmware_path = "build/rcd-firmware.bin"
@@ -39,6 +60,14 @@ fvt_partition_table_path = "build/partition_table/partition-table.bin"
 fvt_ota_data_initial_path = "build/ota_data_initial.bin"
 fvt_site_bin_path = "build/site.bin"
 
+FVT_IMAGES = [
+    (0x1000, fvt_bootloader_path),  # bootloader
+    (0xF000, fvt_partition_table_path),  # partition table
+    (0x14000, fvt_ota_data_initial_path),  # OTA data initial
+    (0x20000, fvt_firmware_path),  # Aplicacao inicial (ota_0)
+    (0x325000, fvt_site_bin_path),  # site.bin
+]
+
 
 
 """ Campos para inserir Sistema Polus"""
@@ -72,110 +101,225 @@ def find_esp32_port():
 
 
 # FunÃ§Ã£o para ler e imprimir os dados da porta serial
-def read_serial(ser):
-    json_data = ""
-    json_started = False
+def wait_for_boot(ser, timeout, capture=None):
+    """Espera o banner de boot do DUT e devolve tudo o que foi lido ate ali.
+
+    Os bytes devolvidos devem ser repassados ao read_serial (``pending``)
+    para que nenhum log do inicio do boot se perca. Sem banner em
+    ``timeout`` segundos levanta TimeoutError.
+    """
+    t0 = time.monotonic()
+    deadline = t0 + timeout
+    ser.timeout = SERIAL_READ_TIMEOUT
+    received = bytearray()
+    while time.monotonic() < deadline:
+        data = ser.read(max(1, ser.in_waiting))
+        if not data:
+            continue
+        if capture is not None:
+            capture.write(data)
+        received += data
+        if any(marker in received for marker in BOOT_MARKERS):
+            print(f"DUT iniciou em {(time.monotonic() - t0) * 1000:.0f} ms.")
+            return bytes(received)
+    raise TimeoutError(f"DUT nao reiniciou em {timeout:g} s (sem banner de boot na serial).")
+
+
+def read_serial(ser, timeout=None, capture=None, pending=b"", on_frame=None):
+    """Le a UART ate chegar um frame JSON valido e devolve o texto dele.
+
+    As leituras bloqueiam no timeout da porta (nada de busy-poll); linhas de
+    log sao impressas inteiras. Sem JSON em ``timeout`` segundos levanta
+    TimeoutError. ``capture`` (arquivo binario) recebe os bytes crus;
+    ``pending`` sao bytes ja lidos (e capturados) antes da chamada.
+    ``on_frame()`` e chamado uma vez, quando o primeiro frame comeca a chegar
+    (ou, se ele vier inteiro em uma leitura, logo antes de devolve-lo).
+    """
+    framer = JsonFramer()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    ser.timeout = SERIAL_READ_TIMEOUT
     while True:
-        if ser.in_waiting > 0:
-            data = ser.read(ser.in_waiting)
-            for byte in data:
-                char = chr(byte)
-                if char == "{":
-                    json_started = True
-                    json_data = char
-                elif char == "}" and json_started:
-                    json_data += char
-                    json_started = False
-                    return json_data  # Retorna o JSON capturado e encerra o loop
-                elif json_started:
-                    json_data += char
-                else:
-                    print(char, end="")
+        if deadline is not None and time.monotonic() > deadline:
+            for _, line in framer.flush():
+                print(line)
+            raise TimeoutError(f"Nenhum JSON recebido da serial em {timeout:g} s.")
+        if pending:
+            data, pending = pending, b""
+        else:
+            data = ser.read(max(1, ser.in_waiting))
+            if not data:
+                continue
+            if capture is not None:
+                capture.write(data)
+        events = framer.feed(data)
+        if on_frame is not None and (framer.frame_open or any(kind == "json" for kind, _ in events)):
+            on_frame()
+            on_frame = None
+        for kind, text in events:
+            if kind == "json":
+                try:
+                    frame = json.loads(text)
+                except ValueError:
+                    frame = None
+                if isinstance(frame, dict) and "mac_address" in frame:
+                    return text
+                # JSON que nao e o resultado do FVT (ou chaves no meio do log)
+                print(text)
+                continue
+            print(text)
+
+
+def open_serial_capture(options, port):
+    if not options.capture_serial:
+        return None
+    os.makedirs(options.capture_serial, exist_ok=True)
+    name = "".join(c if c.isalnum() else "_" for c in port) + time.strftime("-%Y%m%d-%H%M%S.bin")
+    return open(os.path.join(options.capture_serial, name), "wb")
 
 
 # FunÃ§Ã£o para enviar dados para a API
-def send_data_to_api(json_data, token):
-    api_url = "https://services.polusbrasil.com.br/api/meter/save-tests/rcd-cr"
-    headers = {
-        "x-access-token": token,
-        "Content-Type": "application/json",
-    }
-    response_payload = {}
-    try:
-        response = requests.post(
-            api_url,
-            json={"test": json_data, "batch_number": batch_number},
-            headers=headers,
-        )
-        response.raise_for_status()  # Lança um erro para códigos de status HTTP 4xx/5xx
-        print("Data saved successfully")
-        try:
-            response_payload = response.json()
-        except ValueError as json_error:
-            print(f"Resposta da API nao retornou JSON valido: {json_error}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending data to API: {e}")
-    return response_payload
-
-
-# FunÃ§Ã£o para gerar um qrcode e salvar em uma pasta especifica
-def create_auvo_qr_code(folder_name, link):
-    qr = qrcode.QRCode(version=1)
-    qr.add_data(link)
-    qr.make(fit=True)
-
-    img = qr.make_image(fill_color="black", back_color="white")
-    # Caso nao exista pasta, o programa cria
-    if os.path.exists(f"./{folder_name}") == False:
-        os.mkdir(f"./{folder_name}")
-
-    img.save(f"./{folder_name}/{folder_name}_qr.png")
-    return os.path.abspath(f"./{folder_name}/{folder_name}_qr.png")
-
-
-def ensure_ciphertext_block_size(file_path):
-    size = os.path.getsize(file_path)
-    if size == 0 or size % 16 != 0:
-        raise ValueError(
-            f"Tamanho invalido do arquivo cifrado ({size} bytes). "
-            "O arquivo deve ser multiplo de 16 para AES-CBC sem padding."
+def send_data_to_api(json_data, token, batch, idempotency_key=None):
+    """POST do resultado na Polus (no lote ``batch``); devolve o JSON da resposta.
+
+    O lote vem da chave do spool, nao do ``batch_number`` atual: um pendente
+    de um lote anterior continua indo para o lote em que foi testado. Erros
+    de rede/HTTP sao levantados (requests.exceptions.RequestException) para
+    o UploadWorker decidir entre nova tentativa e rejeicao.
+    """
+    api_url = f"{API_BASE_URL}{API_SAVE_TESTS_PATH}"
+    headers = {
+        "x-access-token": token,
+        "Content-Type": "application/json",
+    }
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    response_payload = {}
+    with TRACER.span("POST save-tests", "http", mac=json_data.get("mac_address")):
+        response = get_http_session().post(
+            api_url,
+            json={"test": json_data, "batch_number": batch},
+            headers=headers,
+            timeout=API_TIMEOUT,
         )
+    timing = getattr(response, "timing", None)
+    if timing:
+        print(f"POST Polus {response.status_code}: {format_timing(timing)}")
+    response.raise_for_status()  # Lança um erro para códigos de status HTTP 4xx/5xx
+    print("Data saved successfully")
+    try:
+        response_payload = response.json()
+    except ValueError as json_error:
+        print(f"Resposta da API nao retornou JSON valido: {json_error}")
+    return response_payload
 
 
-def decrypt_encrypted_firmware(enc_path, out_path=DECRYPTED_OUTPUT_PATH):
-    ensure_ciphertext_block_size(enc_path)
-    print(f"Decriptando firmware final de {enc_path} ...")
-    cipher = Cipher(algorithms.AES(ENCRYPTION_KEY), modes.CBC(ENCRYPTION_IV))
-    decryptor = cipher.decryptor()
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(enc_path, "rb") as fin, open(out_path, "wb") as fout:
-        for chunk in iter(lambda: fin.read(64 * 1024), b""):
-            if chunk:
-                fout.write(decryptor.update(chunk))
-        fout.write(decryptor.finalize())
-    try:
-        validate_decrypted_image(out_path)
-    except Exception:
-        try:
-            os.remove(out_path)
-        except OSError:
-            pass
-        raise
-    print(f"Firmware final decriptado salvo em {out_path}.")
-    return out_path
+_http_session = None
 
 
-def validate_decrypted_image(bin_path):
-    try:
-        with open(bin_path, "rb") as f:
-            f.seek(BOOTLOADER_OFFSET)
-            boot_byte = f.read(1)
-    except OSError as exc:
-        raise RuntimeError(f"Falha ao validar firmware decriptado: {exc}")
-    if not boot_byte or boot_byte[0] != 0xE9:
-        raise ValueError(
-            "Arquivo decriptado invalido: byte magico 0xE9 nao encontrado no offset do bootloader."
+def get_http_session():
+    """Sessao HTTP do processo: conexao keep-alive reaproveitada entre DUTs."""
+    global _http_session
+    if _http_session is None:
+        _http_session = create_http_session()
+    return _http_session
+
+
+def prewarm_api_connection():
+    # Abre DNS + TCP + TLS em segundo plano logo antes do veredito (fim da
+    # leitura do FVT), para a conexao ainda estar viva no POST do resultado
+    return prewarm(get_http_session(), API_BASE_URL, API_TIMEOUT)
+
+
+_upload_worker = None
+
+
+def build_upload_worker(spool, batch=False, batch_size=None, concurrency=None):
+    send_batch = None
+    if batch:
+        send_batch = BatchSender(
+            get_http_session(), f"{API_BASE_URL}{API_BATCH_PATH}", {"x-access-token": token}, API_TIMEOUT
+        )
+    kwargs = {}
+    if batch_size:
+        kwargs["batch_size"] = batch_size
+    if concurrency:
+        kwargs["concurrency"] = concurrency
+    return UploadWorker(
+        spool,
+        lambda payload, key: send_data_to_api(payload, token, split_key(key)[1], idempotency_key=key),
+        send_batch=send_batch,
+        **kwargs,
+    )
+
+
+def get_upload_worker(options=None):
+    """Worker de envio do processo (criado e iniciado no primeiro uso).
+
+    Os pendentes de execucoes anteriores saem assim que ele inicia.
+    """
+    global _upload_worker, API_BASE_URL
+    if _upload_worker is None:
+        if options is not None and options.api_url:
+            API_BASE_URL = options.api_url.rstrip("/")
+        _upload_worker = build_upload_worker(
+            UploadSpool(UPLOAD_SPOOL_PATH), batch=bool(options and options.batch_upload)
         )
+        _upload_worker.start()
+    return _upload_worker
+
+
+def queue_test_result(data, options=None):
+    """Grava o resultado no spool e espera o auvoLink por ate ``--auvo-wait`` s.
+
+    Devolve o auvoLink ou None (API lenta/fora: o envio continua em segundo
+    plano e a etiqueta sai sem link).
+    """
+    worker = get_upload_worker()
+    key = worker.spool.enqueue(data["mac_address"], batch_number, data)
+    budget = options.auvo_wait if options is not None else DEFAULT_AUVO_WAIT
+    if budget <= 0:
+        worker.notify()
+        return None
+    t0 = time.monotonic()
+    response = worker.wait_response(key, timeout=budget)
+    if response is None:
+        entry = worker.spool.get(key) or {}
+        error = entry.get("last_error")
+        print(f"Resultado ainda nao enviado apos {budget:g} s; segue no spool ({key})."
+              + (f" Ultimo erro: {error}" if error else ""))
+        return None
+    print(f"Resultado enviado para a Polus em {time.monotonic() - t0:.2f} s.")
+    return response.get("auvoLink")
+
+
+
+# FunÃ§Ã£o para gerar o qrcode em memoria (arquivo opcional em SQLite)
+def create_auvo_qr_code(mac_address, link, archive=True):
+    """QR do auvoLink em memoria (matriz em cache por link).
+
+    Com ``archive`` o PNG e gerado e gravado no arquivo SQLite por MAC em
+    segundo plano (sem pastas por MAC no diretorio de trabalho).
+    """
+    matrix = qr_matrix(link)
+    if archive:
+        get_qr_archive().put_async(mac_address, link)
+    return matrix
+
+
+_qr_archive = None
+
+
+def get_qr_archive():
+    global _qr_archive
+    if _qr_archive is None:
+        _qr_archive = QrArchive(QR_ARCHIVE_PATH)
+    return _qr_archive
+
+
+def flush_qr_archive():
+    """Espera os PNGs enfileirados serem gravados (workers da estacao saem sem atexit)."""
+    if _qr_archive is not None:
+        _qr_archive.flush()
 
 
 def resolve_encrypted_firmware_path():
@@ -189,226 +333,692 @@ def resolve_encrypted_firmware_path():
     return enc_path
 
 
-def flash_decrypted_image(port, image_path, baud):
-    print(f"Gravando imagem combinada em {port} @ {baud} baud ...")
-    esptool.main(
-        [
-            "--chip",
-            FLASH_CHIP,
-            "--port",
-            port,
-            "--baud",
-            str(baud),
-            "--before",
-            "default_reset",
-            "--after",
-            "hard_reset",
-            "write_flash",
-            "--flash_mode",
-            "dio",
-            "--flash_freq",
-            "40m",
-            "--flash_size",
-            "8MB",
-            "0x0",
-            image_path,
-        ]
+def flash_decrypted_image(session, sparse):
+    print(f"Gravando imagem combinada em {session.port} @ {session.baud} baud ...")
+    print(
+        f"Imagem esparsa: {sparse.data_size // 1024} KB de dados em {len(sparse.segments)} segmentos, "
+        f"{sum(size for _, size in sparse.blank) // 1024} KB de padding so apagados."
     )
+    # Imagem combinada em 0x0: o esptool nao altera o cabecalho (so em 0x1000),
+    # entao --flash_mode/--flash_freq nao mudam nada aqui; o tamanho vai no stub.
+    session.erase_regions(sparse.blank, stage="final_erase")
+    # Payloads do texto claro vem do cache do firmware (travados/zerados com ele)
+    session.write_images(sparse.segments, stage="final_flash", payloads=_final_firmware_cache.payloads)
+    session.hard_reset()
+
+
+_final_firmware_cache = None
 
 
-def flash_final_encrypted_firmware(port):
+def get_final_firmware(lock_memory=False):
+    """Imagem final decriptada, validada e dividida em segmentos (cache em memoria).
+
+    O .enc so e decriptado de novo se o SHA-256 do arquivo mudar.
+    """
+    global _final_firmware_cache
     enc_path = resolve_encrypted_firmware_path()
-    decrypted_path = decrypt_encrypted_firmware(enc_path)
+    if _final_firmware_cache is None or _final_firmware_cache.enc_path != enc_path:
+        if _final_firmware_cache is not None:
+            # Outro .enc: zera o texto claro (e os payloads) do anterior
+            _final_firmware_cache.close()
+        _final_firmware_cache = FinalFirmwareCache(
+            enc_path, ENCRYPTION_KEY, ENCRYPTION_IV, lock_memory=lock_memory
+        )
+    _final_firmware_cache.payloads.level = PAYLOAD_CACHE.level
+    # Decripta so na primeira vez (ou se o .enc mudar); depois o span e so o SHA-256
+    with TRACER.span("firmware final (decrypt/cache)", "firmware"):
+        return _final_firmware_cache.get()
+
+
+def flash_final_encrypted_firmware(session, options=None):
+    sparse = get_final_firmware(lock_memory=bool(options and options.lock_firmware_memory))
+    # Falha de escrita desce um degrau de baud e repete dentro da sessao
+    flash_decrypted_image(session, sparse)
+    print("Gravacao do firmware final concluida com sucesso.")
+
+
+def prepare_station(options):
+    """Carga feita uma vez na partida (por processo): worker de envio,
+    firmware final em memoria e payloads comprimidos das imagens FVT e final."""
+    PAYLOAD_CACHE.level = options.compress_level
+    TRACER.enabled = bool(options.trace_dir)
+    worker = get_upload_worker(options)
+    pending = worker.spool.counts().get("pending", 0)
+    if pending:
+        print(f"{pending} resultado(s) pendente(s) no spool; reenviando em segundo plano.")
     try:
-        try:
-            flash_decrypted_image(port, decrypted_path, DEFAULT_FLASH_BAUD)
-        except Exception as high_speed_error:
-            if DEFAULT_FLASH_BAUD != FALLBACK_FLASH_BAUD:
-                print(
-                    f"Erro na gravacao em {DEFAULT_FLASH_BAUD} baud ({high_speed_error}). "
-                    f"Tentando novamente em {FALLBACK_FLASH_BAUD} baud."
-                )
-                flash_decrypted_image(port, decrypted_path, FALLBACK_FLASH_BAUD)
+        spent = PAYLOAD_CACHE.warm(read_files(FVT_IMAGES))
+        print(f"Imagens FVT comprimidas em cache ({spent:.2f} s).")
+    except OSError as e:
+        print(f"Aviso: imagens FVT nao carregadas na partida: {e}")
+    try:
+        sparse = get_final_firmware(lock_memory=options.lock_firmware_memory)
+        spent = _final_firmware_cache.payloads.warm(sparse.segments)
+        print(f"Firmware final comprimido em cache ({spent:.2f} s).")
+    except Exception as e:
+        # Nao impede o FVT; o erro volta a aparecer na gravacao final
+        print(f"Aviso: firmware final nao carregado na partida: {e}")
+
+
+REQUIRED_KEYS = [
+    "mac_address",
+    "nvs_passed",
+    "buzzer_passed",
+    "red_led_passed",
+    "green_led_passed",
+    "blue_led_passed",
+    "button_passed",
+    "rtc_passed",
+    "coel_comm_passed",
+    "wifi_passed",
+    "spiffs_passed",
+    "dht22_passed",
+    "ds18b20_passed",
+]
+
+DEFAULT_PORT = "COM4"
+
+LABEL_BACKENDS = {
+    "bpac": print_lbx_qr,
+    "nativo": print_lbx_native,
+    "nulo": print_lbx_null,
+}
+
+
+def _report(on_stage, stage, detail=""):
+    # Informa a etapa atual para a estacao (status por porta); sem callback nao faz nada
+    if on_stage is not None:
+        on_stage(stage, detail)
+
+
+def _timed(recorder, stage):
+    # Cronometra a etapa no registro do DUT (metricas.py); sem registro nao faz nada
+    return recorder.stage(stage) if recorder is not None else contextlib.nullcontext()
+
+
+@functools.lru_cache(maxsize=1)
+def fvt_erase_plan():
+    """Regioes a apagar antes do FVT, montadas a partir da tabela de particoes.
+
+    As faixas gravadas pelas imagens FVT ficam de fora porque o write_flash ja
+    apaga esses setores.
+    """
+    partitions = read_partition_table(fvt_partition_table_path)
+    written = [(offset, os.path.getsize(path)) for offset, path in FVT_IMAGES]
+    plan = build_erase_plan(partitions, written=written)
+    print("Plano de erase por regiao:")
+    print(format_plan(plan))
+    return plan
+
+
+def connect_dut(session, on_stage=None, recorder=None):
+    """Conecta ao bootloader (stub + baud) e le o MAC; False se o DUT nao responder."""
+    _report(on_stage, "connect")
+    try:
+        with _timed(recorder, "connect"):
+            session.connect()
+    except Exception as e:
+        print(f"Error communicating with ESP32: {e}")
+        return False
+    print(f"DUT conectado: MAC {session.mac}")
+    return True
+
+
+def run_fvt_stage(session, options, on_stage=None, recorder=None):
+    """Apaga, grava o firmware FVT, reinicia o DUT e captura o JSON da serial.
+
+    Todas as operacoes usam a mesma conexao (``session``, ja conectada por
+    ``connect_dut``) com o DUT.
+    """
+    json_data = ""
+    try:
+        _report(on_stage, "erase")
+        print("Erasing flash memory ")
+        # Apagando a memória
+        with _timed(recorder, "erase"):
+            if options.full_erase:
+                session.erase_flash()
             else:
-                raise
-        print("Gravacao do firmware final concluida com sucesso.")
-    finally:
+                session.erase_regions(fvt_erase_plan())
+        print("Flash erase complete. ")
+        # Gravando o firmware no mesmo stub/baud da conexao
+        _report(on_stage, "fvt_flash")
+        print("Flashing ESP32...")
+        with _timed(recorder, "fvt_flash"):
+            session.write_files(FVT_IMAGES, stage="fvt_flash")
+
+        # Resetando o ESP32; a porta continua aberta durante o reset
+        _report(on_stage, "reset")
+        print("Resetting ESP32...")
+        capture = open_serial_capture(options, session.port)
         try:
-            os.remove(decrypted_path)
-        except OSError:
-            pass
+            with _timed(recorder, "boot"):
+                ser = session.run_app()
+                print("ESP32 reset. Starting serial monitor...")
+                boot_log = wait_for_boot(ser, options.boot_timeout, capture=capture)
+
+            _report(on_stage, "serial")
+            print("Terminal started:")
+            with _timed(recorder, "fvt_run"):
+                json_data = read_serial(
+                    ser, timeout=options.serial_timeout, capture=capture, pending=boot_log,
+                    on_frame=prewarm_api_connection,
+                )
+        finally:
+            if capture is not None:
+                capture.close()
+
+    except Exception as e:
+        print(f"Error communicating with ESP32: {e}")
 
+    print("\nJSON Captured:")
+    print(json_data)
+    return json_data
 
-while True:
-    clear_screen()
-    # esp32_port = find_esp32_port()
-    esp32_port = "COM4"
 
-    if esp32_port is None:
-        input(
-            "No ESP device found. Please make sure an ESP device is connected to the PC and press Enter to retry."
+_post_test_executor = None
+
+
+def _init_post_test_thread():
+    # b-PAC (COM) na thread de pos-teste; fora do Windows nao ha o que iniciar
+    try:
+        import pythoncom
+    except ImportError:
+        return
+    pythoncom.CoInitialize()
+
+
+def get_post_test_executor():
+    """Thread unica de envio/QR/etiqueta, reaproveitada entre DUTs.
+
+    Sempre a mesma thread: a sessao b-PAC (uma por thread) continua aberta de
+    um DUT para o outro.
+    """
+    global _post_test_executor
+    if _post_test_executor is None:
+        _post_test_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pos-teste", initializer=_init_post_test_thread
         )
-        clear_screen()
-    else:
-        try:
-            print("Erasing flash memory ")
-            # Apagando a memÃ³ria
-            esptool.main(
-                [
-                    "--chip",
-                    "esp32",
-                    "--port",
-                    esp32_port,
-                    "erase_flash", 
-                ]
-            )
-            print("Flash erase complete. ")
-            # Gravando o firmware usando esptool
-            print("Flashing ESP32...")
-            esptool.main(
-                [
-                    "--chip",
-                    "esp32",
-                    "--port",
-                    esp32_port,
-                    "--baud",
-                    "460800", #"115200", 460800
-                    "write_flash",
-                    "-z",
-                    "0x1000",
-                    fvt_bootloader_path,  # bootloader
-                    "0xf000",
-                    fvt_partition_table_path,  # partition table
-                    "0x14000",
-                    fvt_ota_data_initial_path,  # OTA data initial
-                    "0x20000",
-                    fvt_firmware_path,  # Aplicacao inicial (ota_0)
-                    "0x325000",
-                    fvt_site_bin_path,  # site.bin
-                ]
-            )
+    return _post_test_executor
 
-            # Resetando o ESP32
-            print("Resetting ESP32...")
-            esptool.main(["--port", esp32_port, "run"])
 
-            print("ESP32 reset. Starting serial monitor...")
+def publish_test_result(data, options=None, on_stage=None, recorder=None):
+    """Envia o resultado para a Polus, gera o QR e imprime a etiqueta.
 
-            # Estabelecer conexÃ£o serial com o ESP32 para monitoramento
-            ser = serial.Serial(esp32_port, baudrate=115200, timeout=1)
-            time.sleep(2)  # Esperar a reinicializaÃ§Ã£o
+    Nao usa o DUT: no ciclo aprovado roda em paralelo com a gravacao final.
+    Devolve ``auvo_link`` e ``label_printed`` (para o historico local).
+    """
+    published = {"auvo_link": None, "label_printed": False}
+    print("\n\nSending test suite to Polus...")
 
-            print("Terminal started:")
-            json_data = read_serial(ser)
+    try:
+        _report(on_stage, "api")
+        # O envio sai do spool em segundo plano; aqui so se espera o link do QR
+        with _timed(recorder, "api"):
+            auvo_link = queue_test_result(data, options)
+        published["auvo_link"] = auvo_link
+        if not auvo_link:
+            print("Warning: link from Auvo was not sent; QR code will be empty.")
+
+        archive = options is None or not options.no_qr_archive
+        with _timed(recorder, "qr"):
+            qr_modules = create_auvo_qr_code(data["mac_address"], auvo_link or "", archive=archive)
+
+        print("\n\n QRCODE Generated!!")
+        print("++++++++++++++++++++++++++++++++++++++++++++")
+        print(f'+ MAC_ADDRESS: {data["mac_address"]}  ')
+        print(f"+ QRCode em memoria ({len(qr_modules)}x{len(qr_modules)} modulos)")
+        if archive:
+            print(f"+  arquivado em {QR_ARCHIVE_PATH}         ")
+        print("++++++++++++++++++++++++++++++++++++++++++++")
 
+        text_for_label = build_label_text(data["mac_address"])
+
+        #impressão da etiqueta
+        try:
+            _report(on_stage, "label")
+            lbx_template = os.path.abspath("RCD_v1.3_template.lbx")
+            print("\\nPrinting label via LBX template...")
+            backend = options.label_backend if options is not None else "bpac"
+            print_label = LABEL_BACKENDS[backend]
+            with _timed(recorder, "label"):
+                print_label(
+                    path_lbx=lbx_template,
+                    qr_text=auvo_link or "",
+                    printer_name=None,
+                    qr_field="qr",
+                    copies=1,
+                    text_field="Texto3",
+                    text_value=text_for_label,
+                )
+            published["label_printed"] = True
+            print("Label printed successfully.")
         except Exception as e:
-            print(f"Error communicating with ESP32: {e}")
-        finally:
-            try:
-                if ser.is_open:
-                    ser.close()
-            except NameError:
-                pass
+            print(f"LBX print failed: {e}")
+
+    except Exception as e:
+        print(f"🚨 --> Error saving test on Polus System: {e}")
+    return published
+
+
+def complete_approved_unit(session, data, options=None, on_stage=None, recorder=None, result=None,
+                           final_flash=True, publish=True):
+    """Gravacao final e envio/QR/etiqueta de uma unidade aprovada no FVT.
+
+    Com o pipeline a gravacao comeca na hora e o pos-teste roda em paralelo;
+    o ciclo so termina quando os dois ramos acabam. ``final_flash`` e
+    ``publish`` deixam o reteste fazer so o que falta. ``result`` e
+    atualizado a cada passo (vale mesmo se a gravacao levantar excecao).
+    """
+    result = result if result is not None else {}
+    pipeline = final_flash and publish and not (options is not None and options.no_pipeline)
+    if recorder is not None:
+        recorder.pipelined = pipeline
+    if publish and not pipeline:
+        result.update(publish_test_result(data, options, on_stage=on_stage, recorder=recorder))
+    if not final_flash:
+        return result
+
+    post_test = None
+    if pipeline:
+        # O status da porta acompanha a gravacao; o pos-teste so aparece no log
+        post_test = get_post_test_executor().submit(publish_test_result, data, options, recorder=recorder)
+    try:
+        print("\n\nFlashing final encrypted firmware in ESP32...")
+        _report(on_stage, "final_flash")
+        with _timed(recorder, "final_flash"):
+            flash_final_encrypted_firmware(session, options)
+        result["final_flashed"] = True
+    finally:
+        if post_test is not None:
+            if not post_test.done():
+                _report(on_stage, "pos_teste")
+                print("Gravacao final concluida; aguardando envio/etiqueta...")
+            # Espera pelo pos-teste alem da gravacao (caminho critico do pipeline)
+            with _timed(recorder, "pos_teste"):
+                result.update(post_test.result())
+    return result
+
+
+def handle_test_results(session, json_data, options=None, on_stage=None, recorder=None, result=None):
+    """Avalia o JSON, envia para a Polus, imprime a etiqueta e grava o firmware final.
+
+    Com o DUT aprovado a gravacao final comeca logo apos o veredito, enquanto
+    envio, QR e etiqueta rodam na thread de pos-teste; o ciclo so termina
+    quando os dois ramos acabam (``--no-pipeline`` volta ao fluxo em serie).
+
+    Retorna (e preenche, se informado) um dicionario com ``mac_address`` e
+    ``outcome`` (``"pass"``, ``"fail"`` ou ``"error"``), mais o que ja foi
+    feito com a unidade (``fvt_passed``, ``final_flashed``, ``label_printed``,
+    ``auvo_link``) para o historico local.
+    """
+    if result is None:
+        result = {}
+    result.setdefault("mac_address", None)
+    result.setdefault("outcome", "error")
+    try:
+        data = json.loads(json_data)
+        result["mac_address"] = data.get("mac_address")
+        result["result_json"] = json_data
+
+        # Check if all required keys exist and have the value `true`
+        all_tests_passed = True
+        for key in REQUIRED_KEYS:
+            if key not in data or not data[key]:
+                all_tests_passed = False
+                print(f"Test {key} failed or missing.")
+        result["fvt_passed"] = all_tests_passed
 
-        print("\nJSON Captured:")
-        print(json_data)
+        if all_tests_passed:
+            print("\n\nAll tests passed!")
+            complete_approved_unit(session, data, options, on_stage=on_stage, recorder=recorder, result=result)
+            result["outcome"] = "pass"
 
+        else:
+            if recorder is not None:
+                recorder.pipelined = False
+            result.update(publish_test_result(data, options, on_stage=on_stage, recorder=recorder))
+            print("\n\nNot all tests passed.")
+            result["outcome"] = "fail"
+
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON: {e}")
+
+    return result
+
+
+_result_store = None
+
+
+def get_result_store(options):
+    """Historico local por MAC (``--results-db``; '' desliga o historico e o reteste rapido)."""
+    global _result_store
+    path = options.results_db if options is not None else RESULTS_DB_PATH
+    if not path:
+        return None
+    if _result_store is None or _result_store.path != path:
+        _result_store = ResultStore(path)
+    return _result_store
+
+
+def lookup_retest(mac, options):
+    """Ultimo registro do MAC e o plano de reteste, ou None para o ciclo completo."""
+    store = get_result_store(options)
+    if store is None or not mac:
+        return None
+    try:
+        entry = store.latest(mac)
+    except sqlite3.Error as e:
+        print(f"Aviso: historico local indisponivel: {e}")
+        return None
+    if entry is None:
+        return None
+    plan = retest_plan(entry, options.retest_window * 3600, reprint=options.reprint_label)
+    if plan is None:
+        print(f"Historico do MAC (ciclo completo): {describe(entry)}")
+        return None
+    return entry, plan
+
+
+def run_retest(session, entry, plan, options, on_stage=None, recorder=None, result=None):
+    """Caminho rapido: o MAC ja passou no FVT, entao pula erase + FVT e faz so o que falta."""
+    todo = [name for name, flag in (("gravacao final", plan["final_flash"]), ("etiqueta", plan["label"])) if flag]
+    print(f"\nReteste: {describe(entry)}")
+    print(f"FVT ja aprovado; sem erase/FVT, so {' + '.join(todo)}.")
+    data = json.loads(entry["result_json"])
+    result.update(
+        mac_address=data.get("mac_address") or entry["mac"],
+        mode=MODE_RETEST,
+        fvt_passed=True,
+        result_json=entry["result_json"],
+    )
+    if plan["label"]:
+        prewarm_api_connection()
+    complete_approved_unit(
+        session, data, options, on_stage=on_stage, recorder=recorder, result=result,
+        final_flash=plan["final_flash"], publish=plan["label"],
+    )
+    if not plan["final_flash"]:
+        # So etiqueta: tira o DUT do bootloader e deixa o firmware final rodando
+        session.hard_reset()
+    result["outcome"] = "pass"
+    return result
+
+
+def store_result(options, session, result, record):
+    """Grava o ciclo no historico local por MAC (o do eFuse; sem ele o do JSON)."""
+    store = get_result_store(options)
+    mac = session.mac or result.get("mac_address")
+    if store is None or not mac:
+        return
+    try:
+        store.record(
+            mac,
+            batch_number,
+            session.port,
+            result.get("mode", MODE_FULL),
+            result["outcome"],
+            fvt_passed=result.get("fvt_passed", False),
+            final_flashed=result.get("final_flashed", False),
+            label_printed=result.get("label_printed", False),
+            auvo_link=result.get("auvo_link"),
+            result_json=result.get("result_json"),
+            total=record["total"],
+        )
+    except sqlite3.Error as e:
+        print(f"Aviso: ciclo nao gravado no historico local: {e}")
+
+
+def create_flash_session(esp32_port, options):
+    if options.baud:
+        # Baud fixo (diagnostico): sem escada e sem memoria por porta
+        return FlashSession(esp32_port, baud=options.baud, diff=options.diff_flash)
+    return FlashSession(
+        esp32_port,
+        diff=options.diff_flash,
+        ladder=BAUD_LADDER,
+        baud_memory=BaudMemory(BAUD_STATE_PATH),
+    )
+
+
+def record_cycle(recorder, session, options):
+    """Grava o registro do DUT (tempos, bytes, baud, resultado) em --metrics-dir."""
+    recorder.extra.update(
+        baud=session.baud,
+        bytes_sent=session.bytes_sent,
+        bytes_skipped=session.bytes_skipped,
+    )
+    record = recorder.record()
+    print(f"Ciclo em {record['total']:.1f} s: "
+          + ", ".join(f"{name} {seconds:.1f} s" for name, seconds in record["stages"].items()))
+    if options.trace_dir:
+        export_trace(options.trace_dir, record)
+    if options.metrics_dir:
         try:
-            data = json.loads(json_data)
-
-            # Define the required keys for successful test
-            required_keys = [
-                "mac_address",
-                "nvs_passed",
-                "buzzer_passed",
-                "red_led_passed",
-                "green_led_passed",
-                "blue_led_passed",
-                "button_passed",
-                "rtc_passed",
-                "coel_comm_passed",
-                "wifi_passed",
-                "spiffs_passed",
-                "dht22_passed",
-                "ds18b20_passed",
-            ]
-
-            # Check if all required keys exist and have the value `true`
-            all_tests_passed = True
-            for key in required_keys:
-                if key not in data or not data[key]:
-                    all_tests_passed = False
-                    print(f"Test {key} failed or missing.")
-
-            print("\n\nSending test suite to Polus...")
+            MetricsLog(options.metrics_dir).append(record)
+        except OSError as e:
+            print(f"Aviso: metricas do ciclo nao gravadas: {e}")
+    return record
 
-            try:
-                resPolus = send_data_to_api(json_data=data, token=token) or {}
-
-                auvo_link = resPolus.get("auvoLink")
-                if not auvo_link:
-                    print("Warning: link from Auvo was not sent; QR code will be empty.")
-
-                qrcode_path = create_auvo_qr_code(
-                    data["mac_address"].replace(":", "_"), auvo_link or ""
-                )
-
-                print("\n\n QRCODE Generated!!")
-                print("++++++++++++++++++++++++++++++++++++++++++++")
-                print(f'+ MAC_ADDRESS: {data["mac_address"]}  ')
-                print(f"+ QRCode was saved on:                     ")
-                print(f"+  {qrcode_path}                           ")
-                print("++++++++++++++++++++++++++++++++++++++++++++")
-
-                mac_address = data["mac_address"]
-                mac_parts = mac_address.split(':')
-                ssid_suffix = ':'.join(mac_parts[-3:])
-                SSID = f"RCD-{ssid_suffix}"
-                MAC_ADDRESS_INPUT = "00:4B:12:18:8C:38"
-                PASSWORD1 = "admin000"
-                PASSWORD2 = "admin"
-                USERNAME = "admin"
-
-                text_for_label = (
-                    f"MAC:{mac_address}\n"
-                    f"SSID: {SSID}\n"
-                    f"Password: {PASSWORD1}\n"
-                    f"Username: {USERNAME}\n"
-                    f"Password: {PASSWORD2}"
-                )
 
-                #impressÃ£o da etiqueta
-                try:
-                    lbx_template = os.path.abspath("RCD_v1.3_template.lbx")
-                    print("\\nPrinting label via LBX template...")
-                    print_lbx_qr(
-                        path_lbx=lbx_template,
-                        qr_text=auvo_link or "",
-                        printer_name=None,
-                        qr_field="qr",
-                        copies=1,
-                        text_field="Texto3",
-                        text_value=text_for_label,
-                    )
-                    print("Label printed successfully.")
-                except Exception as e:
-                    print(f"LBX print failed: {e}")
-
-            except Exception as e:
-                print(f"ðŸš¨ --> Error saving test on Polus System: {e}")
-
-            if all_tests_passed:
-                print("\n\nAll tests passed!")
-                print("\n\nFlashing final encrypted firmware in ESP32...")
-                flash_final_encrypted_firmware(esp32_port)
+def export_trace(trace_dir, record):
+    """Grava os spans do ciclo (todas as threads do processo) em um trace Chrome/Perfetto."""
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(record["ts"]))
+    mac = (record["mac"] or "sem-mac").replace(":", "")
+    port = "".join(c if c.isalnum() else "_" for c in record["port"].strip("/\\"))
+    path = os.path.join(trace_dir, f"{stamp}_{port}_{mac}.json")
+    try:
+        spans = TRACER.write(path, process_name=record["port"])
+    except OSError as e:
+        print(f"Aviso: trace do ciclo nao gravado: {e}")
+        return
+    print(f"Trace do ciclo ({spans} spans): {path}")
+
+
+def run_dut_cycle(esp32_port, options=None, on_stage=None):
+    """Executa o ciclo completo de um DUT na porta informada."""
+    if options is None:
+        options = build_parser().parse_args([])
+    if options.trace_dir:
+        TRACER.enabled = True
+    session = create_flash_session(esp32_port, options)
+    recorder = CycleRecorder(esp32_port, batch_number)
+    result = {"mac_address": None, "outcome": "error", "mode": MODE_FULL}
+    try:
+        if not connect_dut(session, on_stage=on_stage, recorder=recorder):
+            return result
+        # Antes de qualquer erase: MAC com FVT aprovado vai direto para o que falta
+        retest = lookup_retest(session.mac, options)
+        if retest is not None:
+            run_retest(session, *retest, options, on_stage=on_stage, recorder=recorder, result=result)
+        else:
+            json_data = run_fvt_stage(session, options, on_stage=on_stage, recorder=recorder)
+            handle_test_results(session, json_data, options, on_stage=on_stage, recorder=recorder, result=result)
+        return result
+    finally:
+        session.close()
+        session.print_report()
+        recorder.mac = result["mac_address"] or session.mac
+        recorder.outcome = result["outcome"]
+        recorder.extra["mode"] = result["mode"]
+        record = record_cycle(recorder, session, options)
+        store_result(options, session, result, record)
 
-            else:
-                print("\n\nNot all tests passed.")
 
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON: {e}")
+def run_single_port(esp32_port, options):
+    prepare_station(options)
+    while True:
+        clear_screen()
+
+        if esp32_port is None:
+            esp32_port = find_esp32_port()
+        if esp32_port is None:
+            input(
+                "No ESP device found. Please make sure an ESP device is connected to the PC and press Enter to retry."
+            )
+            clear_screen()
+            continue
+
+        run_dut_cycle(esp32_port, options)
 
         input(
             "\n\nTest finished, please insert new hardware and press Enter, or close the program to exit.\n\n"
         )
         clear_screen()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Teste FVT + gravacao final do RCD.")
+    parser.add_argument(
+        "--port",
+        default=DEFAULT_PORT,
+        help=f"porta serial do DUT (padrao: {DEFAULT_PORT}; use 'auto' para detectar)",
+    )
+    parser.add_argument(
+        "--ports",
+        nargs="+",
+        help="modo estacao: lista de portas, um worker por porta. Ex.: --ports COM4 COM5 COM6",
+    )
+    parser.add_argument(
+        "--discover",
+        action="store_true",
+        help="modo estacao: detecta automaticamente as portas USB-serial dos fixtures",
+    )
+    parser.add_argument(
+        "--log-dir",
+        default=os.path.join(SCRIPT_DIR, "logs"),
+        help="pasta dos logs por porta no modo estacao",
+    )
+    parser.add_argument(
+        "--full-erase",
+        action="store_true",
+        help="apaga a flash inteira (erase_flash) em vez do erase por regiao; use em auditorias",
+    )
+    parser.add_argument(
+        "--lock-firmware-memory",
+        action="store_true",
+        help="trava o firmware final decriptado na RAM (sem swap) enquanto a estacao roda",
+    )
+    parser.add_argument(
+        "--baud",
+        type=int,
+        help="baud fixo de gravacao; sem ele a estacao negocia a escada "
+        f"{'/'.join(str(b) for b in BAUD_LADDER)} e lembra o melhor por porta",
+    )
+    parser.add_argument(
+        "--diff-flash",
+        action="store_true",
+        help="compara o MD5 de cada regiao no chip e so grava o que mudou (reteste/retrabalho)",
+    )
+    parser.add_argument(
+        "--serial-timeout",
+        type=float,
+        default=300.0,
+        help="tempo maximo (s) esperando o JSON do FVT antes de desistir do DUT (padrao: 300)",
+    )
+    parser.add_argument(
+        "--boot-timeout",
+        type=float,
+        default=10.0,
+        help="tempo maximo (s) esperando o banner de boot do DUT apos o reset (padrao: 10)",
+    )
+    parser.add_argument(
+        "--auvo-wait",
+        type=float,
+        default=DEFAULT_AUVO_WAIT,
+        help="tempo maximo (s) esperando o auvoLink da Polus para o QR; o envio continua "
+        f"em segundo plano (padrao: {DEFAULT_AUVO_WAIT:g}; 0 nao espera)",
+    )
+    parser.add_argument(
+        "--api-url",
+        help=f"URL base da API (padrao: {API_BASE_URL}); ex.: http://127.0.0.1:8080 com python api_local.py",
+    )
+    parser.add_argument(
+        "--batch-upload",
+        action="store_true",
+        help="envia o backlog do spool em lotes gzip pelo endpoint de lote",
+    )
+    parser.add_argument(
+        "--label-backend",
+        choices=sorted(LABEL_BACKENDS),
+        default="bpac",
+        help="bpac: template LBX pelo b-PAC; nativo: etiqueta desenhada em Python e impressa pelo spooler; "
+        "nulo: nao imprime (simulacao/carga, python dut_emulado.py station)",
+    )
+    parser.add_argument(
+        "--no-pipeline",
+        action="store_true",
+        help="envio/QR/etiqueta antes da gravacao final, em serie (padrao: em paralelo com a gravacao)",
+    )
+    parser.add_argument(
+        "--no-qr-archive",
+        action="store_true",
+        help=f"nao arquiva o PNG do QR por MAC (padrao: arquiva em {os.path.relpath(QR_ARCHIVE_PATH, SCRIPT_DIR)})",
+    )
+    parser.add_argument(
+        "--capture-serial",
+        metavar="PASTA",
+        help="grava os bytes crus da UART de cada DUT em PASTA (replay: python serial_framer.py bench)",
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        default=METRICS_DIR,
+        help="pasta do registro por DUT (tempos por etapa; relatorio: python metricas.py report); "
+        "'' desliga",
+    )
+    parser.add_argument(
+        "--trace-dir",
+        nargs="?",
+        const=TRACE_DIR,
+        metavar="PASTA",
+        help="grava um trace Chrome/Perfetto por DUT (padrao da pasta: "
+        f"{os.path.relpath(TRACE_DIR, SCRIPT_DIR)}; juntar portas: python metricas.py merge-trace)",
+    )
+    parser.add_argument(
+        "--results-db",
+        default=RESULTS_DB_PATH,
+        help="historico local por MAC (consulta: python resultados.py mac <MAC>); '' desliga o "
+        f"historico e o reteste rapido (padrao: {os.path.relpath(RESULTS_DB_PATH, SCRIPT_DIR)})",
+    )
+    parser.add_argument(
+        "--retest-window",
+        type=float,
+        default=DEFAULT_RETEST_WINDOW,
+        metavar="HORAS",
+        help="MAC com FVT aprovado ha menos de HORAS pula erase + FVT e vai direto para a gravacao "
+        f"final/etiqueta (padrao: {DEFAULT_RETEST_WINDOW:g}, desligado; 0 sempre refaz o FVT)",
+    )
+    parser.add_argument(
+        "--reprint-label",
+        action="store_true",
+        help="com --retest-window: unidade ja concluida (firmware final + etiqueta) que volta ao "
+        "fixture so reimprime a etiqueta; sem ela a unidade refaz o ciclo completo (retrabalho)",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        default=9,
+        choices=range(0, 10),
+        metavar="0-9",
+        help="nivel zlib dos payloads em cache (padrao: 9; veja python gravacao.py bench)",
+    )
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    if args.ports or args.discover:
+        from estacao import discover_ports, run_station
+
+        ports = args.ports or discover_ports()
+        if not ports:
+            print("Nenhuma porta serial de fixture encontrada.")
+            sys.exit(1)
+        run_station(ports, args, log_dir=args.log_dir)
+    else:
+        run_single_port(None if args.port == "auto" else args.port, args)
+
+
+if __name__ == "__main__":
+    main()